@@ -0,0 +1,22 @@
+"""
+Общая подготовка окружения бенчмарков: путь до пакета и обязательные переменные конфига
+"""
+import sys
+
+from os import environ, path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+sys.path.insert(0, path.join(ROOT, "src"))
+
+# config.py требует эти переменные; для бенчмарков подойдут любые значения
+for name, value in {
+    "GUILD_ID": "0",
+    "TRUSTED_IDS": "0",
+    "ON_READY_GUILD_SYNC": "0",
+    "VK_BYPASS_AUTH": "1",
+    "VK_BYPASS_ACCESS_TOKEN": "benchmark",
+    "FFMPEG": "ffmpeg",
+    "BITRATE": "128",
+}.items():
+    environ.setdefault(name, value)
@@ -0,0 +1,126 @@
+"""
+Бенчмарк HLS-ссылок: ffmpeg, читающий index.m3u8 сам, против HLSStream и прямой ссылки на mp3
+
+Локальный HTTP-сервер раздаёт трэк как mp3 и как HLS-плейлист из сегментов MPEG-TS, открытый и зашифрованный
+AES-128, с задержкой на каждый запрос, имитируя CDN ВКонтакте. Для каждого способа замеряется время
+до первого пакета и количество подвисаний: чтений пакета дольше 20 мс / speed при проигрывании в темпе плеера.
+
+Запуск из корня репозитория (нужен ffmpeg в PATH или в FFMPEG):
+    python benchmarks/hls_startup.py [--runs 3] [--latency 0.1] [--segment 2] [--speed 2]
+"""
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+from os import path
+from typing import Callable, List, Tuple
+
+import _env  # noqa: F401
+
+from aiohttp import ClientSession
+
+from track_gap import generate_tracks, start_server
+
+from bulbex.vkmusic import Song  # noqa: E402
+from bulbex.player import SourceFactory  # noqa: E402
+from bulbex.config import FFMPEG  # noqa: E402
+
+PACKET_SECONDS = 0.02
+
+
+def segment(directory: str, track: str, name: str, seconds: int, encrypted: bool) -> None:
+    """Нарезает mp3 на сегменты MPEG-TS с плейлистом name/index.m3u8"""
+    output = path.join(directory, name)
+    os.makedirs(output)
+
+    options = []
+    if encrypted:
+        key = path.join(output, "key.bin")
+        with open(key, "wb") as file:
+            file.write(os.urandom(16))
+        with open(path.join(output, "key.info"), "w") as file:
+            file.write(f"key.bin\n{key}\n")
+        options = ["-hls_key_info_file", path.join(output, "key.info")]
+
+    subprocess.run([FFMPEG, "-loglevel", "error", "-y", "-i", path.join(directory, track), "-c:a", "copy",
+                    "-f", "hls", "-hls_time", str(seconds), "-hls_list_size", "0", *options,
+                    "-hls_segment_filename", path.join(output, "seg%03d.ts"), path.join(output, "index.m3u8")],
+                   check=True)
+
+
+def play(source, speed: float) -> int:
+    """Читает источник до конца в темпе плеера. Возвращает количество подвисаний"""
+    interval = PACKET_SECONDS / speed
+    stalls = 0
+    while True:
+        started = time.perf_counter()
+        packet = source.read()
+        elapsed = time.perf_counter() - started
+        if not packet:
+            return stalls
+        if elapsed > interval:
+            stalls += 1
+        time.sleep(max(interval - elapsed, 0))
+
+
+async def measure(factory: SourceFactory, song: Song, speed: float) -> Tuple[float, int]:
+    loop = asyncio.get_running_loop()
+
+    started = time.perf_counter()
+    prepared = await factory.prepare(song, warmup_packets=1)
+    first_packet = time.perf_counter() - started
+
+    try:
+        stalls = await loop.run_in_executor(None, play, prepared.source, speed)
+    finally:
+        prepared.source.cleanup()
+    return first_packet, stalls
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seconds", type=int, default=20)
+    parser.add_argument("--segment", type=int, default=2, help="Длительность сегмента HLS, секунды")
+    parser.add_argument("--latency", type=float, default=0.1, help="Задержка ответа стенда CDN, секунды")
+    parser.add_argument("--speed", type=float, default=2.0, help="Ускорение проигрывания")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        track = generate_tracks(directory, 1, args.seconds)[0]
+        segment(directory, track, "hls", args.segment, encrypted=False)
+        segment(directory, track, "hls-aes", args.segment, encrypted=True)
+
+        runner = await start_server(directory, args.latency)
+        base = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+        def song(link: str) -> Song:
+            return Song(artist="Bench", title=link.rsplit("/", 2)[-2], duration=args.seconds, download_link=link)
+
+        async with ClientSession() as session:
+            variants: List[Tuple[str, Callable[[], SourceFactory], Song]] = [
+                ("ffmpeg читает m3u8", SourceFactory, song(f"{base}/hls/index.m3u8")),
+                ("HLSStream", lambda: SourceFactory(http=lambda: session), song(f"{base}/hls/index.m3u8")),
+                ("ffmpeg, AES-128", SourceFactory, song(f"{base}/hls-aes/index.m3u8")),
+                ("HLSStream, AES-128", lambda: SourceFactory(http=lambda: session), song(f"{base}/hls-aes/index.m3u8")),
+                ("прямой mp3", SourceFactory, song(f"{base}/{track}")),
+            ]
+
+            print(f"Трэк: {args.seconds} с, сегменты по {args.segment} с, задержка стенда: {args.latency * 1000:.0f} мс, "
+                  f"ускорение: x{args.speed:g}")
+            try:
+                for name, factory, variant in variants:
+                    results = [await measure(factory(), variant, args.speed) for _ in range(args.runs)]
+                    first_packets = [first_packet * 1000 for first_packet, _ in results]
+                    print(f"{name + ':':22} до первого пакета медиана {statistics.median(first_packets):7.1f} мс, "
+                          f"макс {max(first_packets):7.1f} мс; подвисаний за трэк {statistics.mean(s for _, s in results):5.1f}")
+            finally:
+                await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,332 @@
+"""
+Нагрузочный тест MusicCog без сети: N гильдий одновременно вызывают /play, /playlist и /skip
+
+ВКонтакте заменён локальным стендом (vk_standin.py), голосовой клиент Discord — поддельным, который
+читает пакеты источника в отдельном потоке с темпом 20 мс / speed, как AudioPlayer discord.py.
+Команды вызываются напрямую через callback, поэтому проходят тот же путь, что и в боте:
+_join, поиск через VKMusicSearch, планировщик запросов, подгрузку плейлистов, ffmpeg и _play_next.
+
+Отчёт: перцентили задержки команд, вызовы VK API на команду, память на сессию и паузы между трэками.
+
+Запуск из корня репозитория (нужен ffmpeg в PATH или в FFMPEG):
+    python benchmarks/load_test.py [--guilds 50] [--latency 0.05] [--rate-limit-rate 0.05] [--accounts 2]
+"""
+import os
+import gc
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+from types import SimpleNamespace
+from typing import Callable, List, Optional
+
+import _env  # noqa: F401
+
+from loguru import logger
+
+from vk_standin import VKStandIn
+
+PACKET_SECONDS = 0.02
+
+
+class FakeMessage:
+    async def edit(self, **_):
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"text-{guild_id}"
+        self.sent = 0
+
+    async def send(self, *_, **__) -> FakeMessage:
+        self.sent += 1
+        return FakeMessage()
+
+
+class FakeVoiceClient:
+    """
+    Голосовой клиент без Discord: поток читает пакеты источника в реальном темпе, ускоренном в speed раз,
+    и по окончании вызывает after из своего потока, как discord.VoiceClient.
+    Пауза между трэками — время от конца предыдущего трэка до первого пакета следующего
+    """
+
+    def __init__(self, channel: "FakeVoiceChannel", speed: float, gaps: List[float]):
+        self.channel = channel
+        self._speed = speed
+        self._gaps = gaps
+        self._connected = True
+        self._playing: Optional[threading.Event] = None
+        self._ended_at: Optional[float] = None
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._playing is not None
+
+    def play(self, source, after: Callable) -> None:
+        if self._playing is not None:
+            raise RuntimeError("Already playing audio.")
+
+        stop = self._playing = threading.Event()
+        threading.Thread(target=self._run, args=(source, after, stop), daemon=True).start()
+
+    def stop(self) -> None:
+        if self._playing is not None:
+            self._playing.set()
+
+    async def disconnect(self, force: bool = False) -> None:
+        self.stop()
+        self._connected = False
+        self.channel.guild.voice_client = None
+
+    async def move_to(self, channel: "FakeVoiceChannel") -> None:
+        self.channel = channel
+
+    def _run(self, source, after: Callable, stop: threading.Event) -> None:
+        error = None
+        try:
+            packet = source.read()
+            if self._ended_at is not None:
+                self._gaps.append(time.perf_counter() - self._ended_at)
+
+            interval = PACKET_SECONDS / self._speed
+            while packet and not stop.wait(interval):
+                packet = source.read()
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+            self._ended_at = time.perf_counter()
+            self._playing = None
+            after(error)
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", speed: float, gaps: List[float], connect_latency: float):
+        self.guild = guild
+        self.id = guild.id
+        self.name = f"voice-{guild.id}"
+        self._speed = speed
+        self._gaps = gaps
+        self._connect_latency = connect_latency
+
+    async def connect(self) -> FakeVoiceClient:
+        await asyncio.sleep(self._connect_latency)
+        self.guild.voice_client = FakeVoiceClient(self, self._speed, self._gaps)
+        return self.guild.voice_client
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.voice_client: Optional[FakeVoiceClient] = None
+
+
+class FakeContext:
+    """Контекст слэш-команды с автором в голосовом канале гильдии"""
+
+    def __init__(self, guild: FakeGuild, voice_channel: FakeVoiceChannel, text_channel: FakeTextChannel):
+        self.guild = guild
+        self.channel = text_channel
+        self.author = SimpleNamespace(id=guild.id, name=f"user-{guild.id}", mention=f"<@{guild.id}>",
+                                      voice=SimpleNamespace(channel=voice_channel))
+        self.responses: List[str] = []
+
+    @property
+    def voice_client(self) -> Optional[FakeVoiceClient]:
+        return self.guild.voice_client
+
+    async def respond(self, content: str = "", **_):
+        self.responses.append(content)
+
+    async def defer(self, **_):
+        pass
+
+    async def send_followup(self, content: str = "", **_):
+        self.responses.append(content)
+
+
+class Phase:
+    """Задержки команд одного вида и вызовы VK API за время их выполнения"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.calls = 0
+        self.failed = 0
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "нет данных"
+
+    values_ms = sorted(value * 1000 for value in values)
+
+    def at(q: float) -> float:
+        return values_ms[min(len(values_ms) - 1, int(len(values_ms) * q))]
+
+    return f"p50 {at(0.5):8.1f} мс, p95 {at(0.95):8.1f} мс, p99 {at(0.99):8.1f} мс, макс {values_ms[-1]:8.1f} мс"
+
+
+async def run_phase(name: str, standin: VKStandIn, contexts: List[FakeContext],
+                    command: Callable, spread: float) -> Phase:
+    """Вызывает команду во всех гильдиях одновременно, с разбросом старта до spread секунд"""
+    phase = Phase(name)
+    requests, calls = standin.snapshot()
+
+    async def invoke(ctx: FakeContext):
+        await asyncio.sleep(random.uniform(0, spread))
+        started = time.perf_counter()
+        try:
+            await command(ctx)
+        except Exception as e:
+            phase.failed += 1
+            print(f"{name} | {ctx.guild.name}: {e!r}")
+        phase.latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(invoke(ctx) for ctx in contexts))
+
+    requests_after, calls_after = standin.snapshot()
+    phase.requests, phase.calls = requests_after - requests, calls_after - calls
+    return phase
+
+
+async def run(args, standin: VKStandIn) -> None:
+    from bulbex.maincog import MusicCog
+
+    loop = asyncio.get_running_loop()
+    cog = MusicCog(SimpleNamespace(loop=loop))
+    await cog.on_ready()
+
+    gaps: List[float] = []
+    contexts = []
+    for i in range(args.guilds):
+        guild = FakeGuild(1000 + i)
+        voice_channel = FakeVoiceChannel(guild, args.speed, gaps, args.connect_latency)
+        contexts.append(FakeContext(guild, voice_channel, FakeTextChannel(guild.id)))
+
+    gc.collect()
+    if args.memory:
+        tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0] if args.memory else 0
+
+    phases = [
+        await run_phase("/play", standin, contexts,
+                        lambda ctx: MusicCog.play_vkontakte.callback(cog, ctx, f"song {random.randrange(args.queries)}"),
+                        args.spread),
+        await run_phase("/playlist", standin, contexts,
+                        lambda ctx: MusicCog.playlist_vkontakte.callback(
+                            cog, ctx, f"https://vk.com/music/playlist/-{ctx.guild.id}_{ctx.guild.id % 50}_abc", True),
+                        args.spread),
+    ]
+
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - baseline if args.memory else 0
+    if args.memory:
+        tracemalloc.stop()
+
+    skips = Phase("/skip")
+    for _ in range(args.skips):
+        await asyncio.sleep(args.skip_interval)
+        phase = await run_phase("/skip", standin, contexts,
+                                lambda ctx: MusicCog.skip.callback(cog, ctx), args.spread)
+        skips.latencies += phase.latencies
+        skips.requests += phase.requests
+        skips.calls += phase.calls
+        skips.failed += phase.failed
+    phases.append(skips)
+
+    # Трэки играют сами: паузы между ними копятся, пока идёт прогон
+    await asyncio.sleep(args.duration)
+
+    for ctx in contexts:
+        await MusicCog.stop.callback(cog, ctx)
+    for session in cog.sessions:
+        session.cancel_prefetch()
+    await asyncio.sleep(1)  # Уже запущенные ffmpeg дочитывают стенд до его остановки
+    await cog.close()
+
+    print(f"Гильдий: {args.guilds}, задержка стенда: {args.latency * 1000:.0f} мс, "
+          f"Too many requests: {args.rate_limit_rate:.0%}, 502: {args.fail_rate:.0%}, ускорение: x{args.speed:g}")
+    print()
+    for phase in phases:
+        commands = max(len(phase.latencies), 1)
+        print(f"{phase.name + ':':11} {percentiles(phase.latencies)}")
+        print(f"{'':11} VK: {phase.calls / commands:.2f} вызовов и {phase.requests / commands:.2f} HTTP-запросов "
+              f"на команду, ошибок команд: {phase.failed}")
+
+    print()
+    print(f"{'Паузы:':11} {percentiles(gaps)} ({len(gaps)} переходов)")
+    if args.memory:
+        print(f"{'Память:':11} {memory / args.guilds / 1024:.1f} КиБ на сессию после /play и /playlist "
+              f"({memory / 2 ** 20:.1f} МиБ всего)")
+    print(f"{'VK:':11} вызовы {dict(standin.calls)}, HTTP {dict(standin.requests)}, "
+          f"внесённые ошибки {dict(standin.errors)}")
+    print(f"{'Планировщик:':11} {cog.vk_search.scheduler.stats()}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа стенда VK, секунды")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов Too many requests")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля ответов 502")
+    parser.add_argument("--accounts", type=int, default=0,
+                        help="Аккаунтов с входом через oauth вместо одного токена VK_BYPASS_ACCESS_TOKEN")
+    parser.add_argument("--queries", type=int, default=20, help="Различных запросов /play на все гильдии")
+    parser.add_argument("--playlist-size", type=int, default=1000)
+    parser.add_argument("--tracks", type=int, default=5, help="Различных mp3-файлов у стенда")
+    parser.add_argument("--seconds", type=int, default=5, help="Длительность трэка")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение проигрывания")
+    parser.add_argument("--skips", type=int, default=3)
+    parser.add_argument("--skip-interval", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=20.0, help="Секунды проигрывания после команд")
+    parser.add_argument("--spread", type=float, default=0.5, help="Разброс старта команд, секунды")
+    parser.add_argument("--connect-latency", type=float, default=0.2, help="Подключение к голосовому каналу")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Не замерять память: tracemalloc замедляет команды")
+    args = parser.parse_args()
+
+    # Логи каждой команды в каждой гильдии заглушили бы отчёт
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    with tempfile.TemporaryDirectory() as directory:
+        standin = VKStandIn(latency=args.latency,
+                            rate_limit_rate=args.rate_limit_rate,
+                            fail_rate=args.fail_rate,
+                            track_seconds=args.seconds,
+                            audio_files=args.tracks,
+                            playlist_size=args.playlist_size)
+        await standin.start(directory)
+
+        os.environ.update(VK_API_URL=standin.api_url, VK_OAUTH_URL=standin.oauth_url)
+        if args.accounts:
+            os.environ.update(VK_BYPASS_AUTH="0", VK_LOGIN="", VK_PASSWORD="",
+                              VK_ACCOUNTS=",".join(f"bench{i}:password" for i in range(args.accounts)))
+
+        # Конфиг читается при импорте, поэтому модули бота импортируются только после настройки окружения
+        from track_gap import generate_tracks
+        generate_tracks(directory, args.tracks, args.seconds)
+
+        try:
+            await run(args, standin)
+        finally:
+            await standin.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Бенчмарк памяти: 100k трэков в очереди до и после перевода Song на __slots__.
+Во всех вариантах исполнитель интернирован, как в Song, поэтому сравниваются одинаково хранимые строки
+
+Запуск из корня репозитория:
+    python benchmarks/song_memory.py [количество]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import _env  # noqa: F401
+
+PAGE_SIZE = 100  # Трэков в одном ответе audio.search
+
+from bulbex.vkmusic import Song  # noqa: E402
+from bulbex.songqueue import SongQueue  # noqa: E402
+
+
+class LegacySong:
+    """Song до перевода на __slots__: обычный класс с __dict__ и без идентификаторов VK"""
+
+    def __init__(self, artist: str, title: str, duration: int, download_link: str):
+        self.artist = sys.intern(artist)
+        self.title = title
+        self.duration = duration
+        self.link = download_link
+
+
+class LegacySongWithIds(LegacySong):
+    """LegacySong со всеми полями нового Song: сравнение только накладных расходов"""
+
+    def __init__(self, artist: str, title: str, duration: int, download_link: str,
+                 owner_id: int, track_id: int, access_key: str, fetched_at: int):
+        super().__init__(artist, title, duration, download_link)
+        self.owner_id = owner_id
+        self.track_id = track_id
+        self.access_key = access_key
+        self.fetched_at = fetched_at
+
+
+def make_item(i: int) -> dict:
+    """Объект audio в том виде, в котором его возвращает VK API"""
+    return {
+        "artist": f"Artist {i % 500}",  # Как после json.loads: отдельная строка на каждый трэк
+        "title": f"Track title number {i}",
+        "duration": 180 + i % 120,
+        "url": f"https://cs1-23v4.vkuseraudio.net/s/v1/acmp/{i:x}/index.m3u8?extra=abcdefghijklmnop",
+        "owner_id": -2000000000 - i,
+        "id": 456239000 + i,
+        "access_key": f"{i:016x}",
+    }
+
+
+def measure(factory, count: int) -> int:
+    """
+    Возвращает объём памяти, оставшийся занятым очередью из count трэков после разбора ответов, в байтах.
+    Ответы приходят страницами по PAGE_SIZE трэков с общим временем получения
+    """
+    gc.collect()
+
+    tracemalloc.start()
+    queue = []
+    for page in range(0, count, PAGE_SIZE):
+        fetched_at = int(time.time())
+        queue.extend(factory(make_item(i), fetched_at) for i in range(page, min(page + PAGE_SIZE, count)))
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del queue
+    return size
+
+
+def legacy_factory(item: dict, fetched_at: int) -> LegacySong:
+    return LegacySong(item["artist"], item["title"], item["duration"], item["url"])
+
+
+def legacy_with_ids_factory(item: dict, fetched_at: int) -> LegacySongWithIds:
+    return LegacySongWithIds(item["artist"], item["title"], item["duration"], item["url"],
+                             item["owner_id"], item["id"], item["access_key"], fetched_at)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    results = [
+        ("До (__dict__, без id)", measure(legacy_factory, count)),
+        ("До (__dict__, с id)", measure(legacy_with_ids_factory, count)),
+        ("После (__slots__, с id)", measure(Song.from_item, count)),
+    ]
+
+    print(f"Трэков: {count}")
+    for name, size in results:
+        print(f"{name + ':':28}{size / 2 ** 20:8.2f} MiB, {size / count:6.1f} B/трэк")
+
+    baseline, with_ids, slotted = (size for _, size in results)
+    print(f"{'Экономия при тех же полях:':28}{(with_ids - slotted) / with_ids * 100:8.1f} %")
+    print(f"{'Рост против исходного Song:':28}{(slotted - baseline) / baseline * 100:8.1f} %")
+
+    fetched_at = int(time.time())
+    tracemalloc.start()
+    queue = SongQueue(Song.from_item(make_item(i), fetched_at) for i in range(count))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'SongQueue целиком:':28}{size / 2 ** 20:8.2f} MiB для {len(queue)} трэков")
+
+
+if __name__ == "__main__":
+    main()
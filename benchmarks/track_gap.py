@@ -0,0 +1,120 @@
+"""
+Бенчмарк паузы между трэками: холодный запуск ffmpeg против заранее подготовленного источника
+
+Локальный HTTP-сервер раздаёт сгенерированные ffmpeg mp3-файлы с искусственной задержкой ответа,
+имитируя CDN ВКонтакте. Пауза — время от окончания предыдущего трэка до первого Opus-пакета следующего.
+
+Запуск из корня репозитория (нужен ffmpeg в PATH или в FFMPEG):
+    python benchmarks/track_gap.py [--tracks 10] [--latency 0.2]
+"""
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+from os import path
+from typing import List
+
+import _env  # noqa: F401
+
+from aiohttp import web
+
+from bulbex.vkmusic import Song  # noqa: E402
+from bulbex.player import SourceFactory  # noqa: E402
+from bulbex.config import FFMPEG  # noqa: E402
+
+
+def generate_tracks(directory: str, count: int, seconds: int) -> List[str]:
+    """Создаёт mp3-файлы с синусоидой"""
+    names = []
+    for i in range(count):
+        name = f"track{i}.mp3"
+        subprocess.run([FFMPEG, "-loglevel", "error", "-y", "-f", "lavfi",
+                        "-i", f"sine=frequency={220 + i * 20}:duration={seconds}",
+                        "-b:a", "128k", path.join(directory, name)], check=True)
+        names.append(name)
+    return names
+
+
+async def start_server(directory: str, latency: float) -> web.AppRunner:
+    """Запускает стенд CDN: отдаёт файлы из directory с задержкой latency перед ответом"""
+    @web.middleware
+    async def delay(request, handler):
+        await asyncio.sleep(latency)
+        return await handler(request)
+
+    app = web.Application(middlewares=[delay])
+    app.router.add_static("/", directory)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+
+def first_packet(source) -> float:
+    """Время до первого пакета источника"""
+    start = time.perf_counter()
+    source.read()
+    return time.perf_counter() - start
+
+
+async def measure(songs: List[Song]) -> dict:
+    loop = asyncio.get_running_loop()
+    sources = SourceFactory()
+    cold, warm = [], []
+
+    for song in songs:
+        # Без прогрева: ffmpeg запускается, когда трэк уже нужен, и пауза включает запуск целиком
+        start = time.perf_counter()
+        prepared = await sources.prepare(song, warmup_packets=0)
+        await loop.run_in_executor(None, first_packet, prepared.source)
+        cold.append(time.perf_counter() - start)
+        prepared.source.cleanup()
+
+    for song in songs:
+        # Подготовка идёт, пока "играет" предыдущий трэк, и в паузу не входит
+        prepared = await sources.prepare(song)
+        start = time.perf_counter()
+        await loop.run_in_executor(None, first_packet, prepared.source)
+        warm.append(time.perf_counter() - start)
+        prepared.source.cleanup()
+
+    return {"холодный ffmpeg": cold, "подготовленный": warm}
+
+
+def report(results: dict) -> None:
+    for name, gaps in results.items():
+        gaps_ms = sorted(gap * 1000 for gap in gaps)
+        p95 = gaps_ms[min(len(gaps_ms) - 1, int(len(gaps_ms) * 0.95))]
+        print(f"{name + ':':20} медиана {statistics.median(gaps_ms):8.1f} мс, "
+              f"p95 {p95:8.1f} мс, макс {gaps_ms[-1]:8.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", type=int, default=10)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.2, help="Задержка ответа стенда CDN, секунды")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = generate_tracks(directory, args.tracks, args.seconds)
+        runner = await start_server(directory, args.latency)
+        port = runner.addresses[0][1]
+
+        songs = [Song(artist="Bench", title=name, duration=args.seconds,
+                      download_link=f"http://127.0.0.1:{port}/{name}", owner_id=1, track_id=i)
+                 for i, name in enumerate(names)]
+
+        try:
+            print(f"Трэков: {len(songs)}, задержка стенда: {args.latency * 1000:.0f} мс")
+            report(await measure(songs))
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
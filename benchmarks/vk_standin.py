@@ -0,0 +1,200 @@
+"""
+Локальный стенд VK API для бенчмарков: audio.search, audio.get, audio.getById, execute и oauth.vk.com/token
+
+Ответы детерминированы: один и тот же запрос или плейлист всегда возвращает одни и те же трэки.
+Задержка ответа и доли ошибок задаются при создании. Ссылки трэков указывают на /audio/ этого же стенда,
+где раздаются mp3-файлы из каталога audio_dir, если он задан.
+
+Отдельный запуск из корня репозитория:
+    python benchmarks/vk_standin.py [--port 8080] [--latency 0.05]
+"""
+import json
+import zlib
+import random
+import asyncio
+import argparse
+
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web
+
+ERROR_TOO_MANY_REQUESTS = 6
+
+
+class VKStandIn:
+    """Стенд VK API с задержкой latency (±50 %), ответами Too many requests с долей rate_limit_rate
+    и ответами 502 с долей fail_rate"""
+
+    def __init__(self,
+                 latency: float = 0.05,
+                 rate_limit_rate: float = 0.0,
+                 fail_rate: float = 0.0,
+                 track_seconds: int = 5,
+                 audio_files: int = 0,
+                 playlist_size: int = 1000,
+                 seed: int = 0):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.fail_rate = fail_rate
+        self.track_seconds = track_seconds
+        self.audio_files = audio_files
+        self.playlist_size = playlist_size
+        self.base_url = ""
+
+        self.requests: Counter = Counter()  # HTTP-запросы по путям
+        self.calls: Counter = Counter()  # Вызовы методов, в том числе внутри execute
+        self.errors: Counter = Counter()
+
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}/method"
+
+    @property
+    def oauth_url(self) -> str:
+        return f"{self.base_url}/token"
+
+    def snapshot(self) -> Tuple[int, int]:
+        """Количество HTTP-запросов и вызовов методов на текущий момент"""
+        return sum(self.requests.values()), sum(self.calls.values())
+
+    async def start(self, audio_dir: Optional[str] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        app = web.Application()
+        app.router.add_post("/method/{method}", self._method)
+        app.router.add_post("/token", self._token)
+        if audio_dir:
+            app.router.add_static("/audio/", audio_dir)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def item(self, owner_id: int, track_id: int) -> Dict[str, Any]:
+        """Объект audio в том виде, в котором его возвращает VK API"""
+        url = f"{self.base_url}/audio/track{track_id % self.audio_files}.mp3" if self.audio_files else ""
+        return {
+            "artist": f"Artist {track_id % 997}",
+            "title": f"Track {track_id}",
+            "duration": self.track_seconds,
+            "url": url,
+            "owner_id": owner_id,
+            "id": track_id,
+            "access_key": f"{track_id:016x}",
+        }
+
+    async def _delay(self) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.requests[method] += 1
+
+        await self._delay()
+
+        if self._random.random() < self.fail_rate:
+            self.errors["502"] += 1
+            return web.Response(status=502, text="<html>502 Bad Gateway</html>", content_type="text/html")
+
+        if method == "execute":
+            return web.json_response(self._execute(params["code"]))
+        return web.json_response(self._call(method, params))
+
+    async def _token(self, request: web.Request) -> web.Response:
+        params = dict(await request.post())
+        self.requests["oauth"] += 1
+
+        await self._delay()
+        return web.json_response({"access_token": f"standin-{params.get('username', '')}",
+                                  "expires_in": 0, "user_id": 1})
+
+    def _execute(self, code: str) -> Dict[str, Any]:
+        """Разбирает код execute вида return [API.method({...}),...]; и выполняет вызовы по очереди"""
+        decoder = json.JSONDecoder()
+        responses, errors = [], []
+
+        position = code.find("API.")
+        while position != -1:
+            start = code.index("(", position)
+            method = code[position + len("API."):start]
+            params, end = decoder.raw_decode(code, start + 1)
+
+            result = self._call(method, {name: str(value) for name, value in params.items()})
+            if "error" in result:
+                responses.append(False)
+                errors.append({"method": method, **result["error"]})
+            else:
+                responses.append(result["response"])
+
+            position = code.find("API.", end)
+
+        data: Dict[str, Any] = {"response": responses}
+        if errors:
+            data["execute_errors"] = errors
+        return data
+
+    def _call(self, method: str, params: Dict[str, str]) -> Dict[str, Any]:
+        self.calls[method] += 1
+
+        if self._random.random() < self.rate_limit_rate:
+            self.errors[str(ERROR_TOO_MANY_REQUESTS)] += 1
+            return {"error": {"error_code": ERROR_TOO_MANY_REQUESTS, "error_msg": "Too many requests per second"}}
+
+        if method == "audio.search":
+            count = int(params.get("count", 5))
+            first = zlib.crc32(params.get("q", "").casefold().encode()) % 1_000_000 * 10
+            items = [self.item(-1, first + i) for i in range(count)]
+            return {"response": {"count": 1000, "items": items}}
+
+        if method == "audio.get":
+            offset, count = int(params.get("offset", 0)), int(params.get("count", 100))
+            owner_id, album_id = int(params["owner_id"]), int(params["album_id"])
+            stop = min(offset + count, self.playlist_size)
+            items = [self.item(owner_id, album_id * 100_000 + i) for i in range(offset, stop)]
+            return {"response": {"count": self.playlist_size, "items": items}}
+
+        if method == "audio.getById":
+            items = []
+            for full_id in params.get("audios", "").split(","):
+                owner_id, track_id = full_id.split("_")[:2]
+                items.append(self.item(int(owner_id), int(track_id)))
+            return {"response": items}
+
+        return {"error": {"error_code": 3, "error_msg": f"Unknown method passed: {method}"}}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа, секунды")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов Too many requests")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Доля ответов 502")
+    parser.add_argument("--audio-dir", default=None, help="Каталог с track0.mp3, track1.mp3, ...")
+    parser.add_argument("--audio-files", type=int, default=0)
+    args = parser.parse_args()
+
+    standin = VKStandIn(latency=args.latency, rate_limit_rate=args.rate_limit_rate, fail_rate=args.fail_rate,
+                        audio_files=args.audio_files)
+    await standin.start(args.audio_dir, port=args.port)
+    print(f"Стенд VK API: VK_API_URL={standin.api_url} VK_OAUTH_URL={standin.oauth_url}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await standin.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
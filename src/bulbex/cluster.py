@@ -0,0 +1,81 @@
+"""
+Распределение шардов по процессам и общая статистика процессов
+"""
+import os
+import json
+import time
+
+from typing import Any, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+STATS_PREFIX = "process-"
+STATS_SUFFIX = ".json"
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """Делит шарды на processes непрерывных диапазонов почти одинакового размера"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+
+    ranges, start = [], 0
+    for i in range(processes):
+        stop = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, stop)))
+        start = stop
+    return ranges
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """Номер шарда гильдии по формуле Discord"""
+    return (guild_id >> 22) % shard_count
+
+
+def owns_guild(guild_id: int, shard_ids: Optional[Sequence[int]], shard_count: Optional[int]) -> bool:
+    """Обслуживает ли процесс с шардами shard_ids эту гильдию. Без шардов процесс обслуживает все гильдии"""
+    if not shard_count or shard_ids is None:
+        return True
+    return shard_of(guild_id, shard_count) in shard_ids
+
+
+class ClusterStats:
+    """
+    Статистика процессов через общий каталог: каждый процесс периодически перезаписывает свой файл,
+    а любой процесс может прочитать файлы всех. Файл, не обновлявшийся дольше stale_after, считается устаревшим
+    """
+
+    def __init__(self, directory: str, process_index: int, stale_after: float):
+        self.directory = directory
+        self.process_index = process_index
+        self.stale_after = stale_after
+
+        os.makedirs(directory, exist_ok=True)
+
+    def publish(self, snapshot: Dict[str, Any]) -> None:
+        """Атомарно записывает снимок статистики процесса"""
+        filepath = os.path.join(self.directory, f"{STATS_PREFIX}{self.process_index}{STATS_SUFFIX}")
+        temp = f"{filepath}.{os.getpid()}.tmp"
+
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump({"process": self.process_index, "pid": os.getpid(), "time": time.time(), **snapshot},
+                      file, ensure_ascii=False, default=str)
+        os.replace(temp, filepath)
+
+    def collect(self) -> List[Dict[str, Any]]:
+        """Снимки всех процессов по порядку, с пометкой stale у давно не обновлявшихся"""
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(STATS_PREFIX) and name.endswith(STATS_SUFFIX)):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Кластер | Не удалось прочитать {name}: {e}")
+                continue
+
+            snapshot["stale"] = time.time() - snapshot.get("time", 0) > self.stale_after
+            snapshots.append(snapshot)
+
+        return sorted(snapshots, key=lambda snapshot: snapshot["process"])
@@ -0,0 +1,110 @@
+"""
+Инкрементальная синхронизация слэш-команд с гильдиями
+"""
+import os
+import json
+import time
+import hashlib
+import asyncio
+
+from typing import Dict, Iterable, List
+
+import discord
+
+from loguru import logger
+
+
+def command_tree_hash(bot: discord.Bot) -> str:
+    """Стабильный хэш набора команд бота: меняется только при изменении самих команд"""
+    tree = sorted((command.to_dict() for command in bot.pending_application_commands),
+                  key=lambda command: (command.get("type", 1), command["name"]))
+
+    payload = json.dumps({"application": bot.application_id, "commands": tree},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SyncReport:
+    """Итог синхронизации"""
+
+    def __init__(self, updated: int, skipped: int, failed: int, elapsed: float):
+        self.updated = updated
+        self.skipped = skipped
+        self.failed = failed
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return (f"обновлено {self.updated}, пропущено {self.skipped}, ошибок {self.failed} "
+                f"за {self.elapsed:.1f} с")
+
+
+class CommandSync:
+    """
+    Синхронизирует команды только с теми гильдиями, у которых сохранённый хэш набора команд
+    отличается от текущего или которых ещё нет в состоянии. Запросы к Discord идут параллельно,
+    не больше concurrency одновременно
+    """
+
+    def __init__(self, bot: discord.Bot, state_path: str, concurrency: int):
+        self._bot = bot
+        self._state_path = state_path
+        self._concurrency = concurrency
+        self._state: Dict[str, str] = self._load()
+        self._lock = asyncio.Lock()
+
+    async def sync(self, guild_ids: Iterable[int], force: bool = False) -> SyncReport:
+        """Синхронизирует команды с гильдиями. force синхронизирует все гильдии независимо от хэша"""
+        async with self._lock:
+            started = time.monotonic()
+            guild_ids = list(guild_ids)
+            tree = command_tree_hash(self._bot)
+            commands = self._bot.pending_application_commands
+
+            # Как и sync_commands(guild_ids=...): команды становятся командами этих гильдий,
+            # поэтому взаимодействия из несинхронизированных заново гильдий тоже находят свою команду
+            for command in commands:
+                command.guild_ids = sorted(set(command.guild_ids or []) | set(guild_ids))
+
+            stale = [guild_id for guild_id in guild_ids if force or self._state.get(str(guild_id)) != tree]
+            semaphore = asyncio.Semaphore(self._concurrency)
+
+            async def sync_guild(guild_id: int) -> bool:
+                async with semaphore:
+                    try:
+                        await self._bot.register_commands(commands, guild_id=guild_id, method="bulk", force=True)
+                    except discord.HTTPException as e:
+                        logger.warning(f"Синхронизация | Гильдия {guild_id}: {e}")
+                        return False
+
+                    self._state[str(guild_id)] = tree
+                    return True
+
+            results = await asyncio.gather(*(sync_guild(guild_id) for guild_id in stale))
+
+            if stale:
+                await asyncio.get_running_loop().run_in_executor(None, self._save, dict(self._state))
+
+            report = SyncReport(updated=sum(results),
+                                skipped=len(guild_ids) - len(stale),
+                                failed=len(stale) - sum(results),
+                                elapsed=time.monotonic() - started)
+            logger.info(f"Синхронизация команд: {report}")
+            return report
+
+    def forget(self, guild_ids: List[int]) -> None:
+        """Убирает гильдии из состояния, чтобы при следующем появлении они синхронизировались заново"""
+        for guild_id in guild_ids:
+            self._state.pop(str(guild_id), None)
+
+    def _load(self) -> Dict[str, str]:
+        try:
+            with open(self._state_path, encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self, state: Dict[str, str]) -> None:
+        temp = self._state_path + ".tmp"
+        with open(temp, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(temp, self._state_path)
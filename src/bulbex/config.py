@@ -16,6 +16,8 @@ TOKEN = getenv("TOKEN")
 GUILD_ID = int(getenv("GUILD_ID"))  # ID личной гильдии для дебага
 TRUSTED_IDS = [int(user_id) for user_id in getenv("TRUSTED_IDS").split(",")]
 ON_READY_GUILD_SYNC = strtobool(getenv("ON_READY_GUILD_SYNC"))
+COMMAND_SYNC_STATE_PATH = getenv("COMMAND_SYNC_STATE_PATH", "command_sync.json")  # Хэши команд по гильдиям
+COMMAND_SYNC_CONCURRENCY = int(getenv("COMMAND_SYNC_CONCURRENCY", 5))  # Гильдий, синхронизируемых одновременно
 
 # FFMPEG
 FFMPEG = getenv("FFMPEG")  # ffmpeg alias или абсолютный путь
@@ -27,7 +29,108 @@ VK_PASSWORD = getenv("VK_PASSWORD")
 # Обход запроса на доступ если access_token уже есть
 VK_BYPASS_AUTH = strtobool(getenv("VK_BYPASS_AUTH"))
 VK_BYPASS_ACCESS_TOKEN = getenv("VK_BYPASS_ACCESS_TOKEN")
+# Дополнительные аккаунты и токены для распределения нагрузки: "login:password,login2:password2" и "token1,token2"
+VK_ACCOUNTS = [tuple(account.split(":", 1)) for account in getenv("VK_ACCOUNTS", "").split(",") if ":" in account]
+VK_ACCESS_TOKENS = [token for token in getenv("VK_ACCESS_TOKENS", "").split(",") if token]
+VK_TOKEN_QUARANTINE = float(getenv("VK_TOKEN_QUARANTINE", 60))  # Секунды карантина токена после ограничения VK
 
 # Логгер
 LOGGER_FILE_PATH = getenv("LOGGER_FILEPATH")
-LOGGER_ROTATION = getenv("LOGGER_ROTATION")
\ No newline at end of file
+LOGGER_ROTATION = getenv("LOGGER_ROTATION")
+
+# Сессии проигрывателя
+SESSION_IDLE_TIMEOUT = int(getenv("SESSION_IDLE_TIMEOUT", 600))  # Секунды простоя до вытеснения сессии
+SESSION_EVICT_INTERVAL = int(getenv("SESSION_EVICT_INTERVAL", 60))
+VOICE_IDLE_GRACE = int(getenv("VOICE_IDLE_GRACE", 120))  # Секунды простоя в голосовом канале до выхода, 0 — сразу
+
+# Кэш результатов поиска ВКонтакте
+SEARCH_CACHE_SIZE = int(getenv("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = int(getenv("SEARCH_CACHE_TTL", 1800))  # Секунды, должно быть меньше срока жизни ссылок VK
+
+# Постраничная загрузка плейлистов
+PLAYLIST_PAGE_SIZE = int(getenv("PLAYLIST_PAGE_SIZE", 200))  # Трэков в одном запросе audio.get
+PLAYLIST_REFILL_THRESHOLD = int(getenv("PLAYLIST_REFILL_THRESHOLD", 20))  # Остаток очереди для подгрузки страницы
+
+# Обновление ссылок на трэки
+LINK_MAX_AGE = int(getenv("LINK_MAX_AGE", 3600))  # Секунды, после которых ссылка VK считается устаревшей
+RESOLVE_BATCH_SIZE = int(getenv("RESOLVE_BATCH_SIZE", 50))  # Трэков в одном запросе audio.getById
+
+# Подготовка следующего трэка
+FFMPEG_BEFORE_OPTIONS = getenv("FFMPEG_BEFORE_OPTIONS", "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5")
+PREFETCH_AHEAD = int(getenv("PREFETCH_AHEAD", 20))  # Секунды до конца трэка для подготовки следующего, <0 отключает
+PREFETCH_WARMUP_PACKETS = int(getenv("PREFETCH_WARMUP_PACKETS", 5))  # Пакеты по 20 мс, читаемые заранее
+
+# Кэш перекодированных трэков на диске. Пустой путь отключает кэш
+DISK_CACHE_DIR = getenv("DISK_CACHE_DIR", "")
+DISK_CACHE_MAX_MB = int(getenv("DISK_CACHE_MAX_MB", 2048))
+
+# Пул процессов ffmpeg, общий для всех гильдий
+TRANSCODE_MAX_JOBS = int(getenv("TRANSCODE_MAX_JOBS", 32))  # Фоновые задачи ждут, пока процессов больше; проигрывание — нет
+
+# Планировщик запросов к VK API
+VK_RATE_LIMIT = float(getenv("VK_RATE_LIMIT", 3))  # Запросов в секунду на один токен
+VK_EXECUTE_MAX_CALLS = int(getenv("VK_EXECUTE_MAX_CALLS", 25))  # Вызовов в одном execute, 1 отключает пакеты
+VK_MAX_RETRIES = int(getenv("VK_MAX_RETRIES", 5))
+VK_RETRY_BACKOFF = float(getenv("VK_RETRY_BACKOFF", 0.4))  # Начальная задержка повтора, секунды
+
+# Пул HTTP-соединений с ВКонтакте
+VK_HTTP_LIMIT = int(getenv("VK_HTTP_LIMIT", 100))  # Всего соединений
+VK_HTTP_LIMIT_PER_HOST = int(getenv("VK_HTTP_LIMIT_PER_HOST", 20))
+VK_HTTP_KEEPALIVE = float(getenv("VK_HTTP_KEEPALIVE", 60))  # Секунды жизни простаивающего соединения
+VK_HTTP_DNS_TTL = int(getenv("VK_HTTP_DNS_TTL", 300))
+VK_HTTP_TIMEOUT = float(getenv("VK_HTTP_TIMEOUT", 15))
+VK_API_URL = getenv("VK_API_URL", "https://api.vk.com/method")  # Подменяется стендом в бенчмарках
+VK_OAUTH_URL = getenv("VK_OAUTH_URL", "https://oauth.vk.com/token")
+
+# HLS-ссылки ВКонтакте (index.m3u8)
+HLS_REWRITE = strtobool(getenv("HLS_REWRITE", "true"))  # Заменять на прямую ссылку на mp3, если она выводится из адреса
+HLS_READ_AHEAD = int(getenv("HLS_READ_AHEAD", 4))  # Сегментов, скачиваемых параллельно заранее. 0 — HLS читает ffmpeg
+HLS_SEGMENT_RETRIES = int(getenv("HLS_SEGMENT_RETRIES", 3))
+
+# Нормализация громкости по заранее измеренной громкости трэков. Пустой путь отключает нормализацию
+LOUDNESS_DB_PATH = getenv("LOUDNESS_DB_PATH", "")  # Файл с измерениями, дописывается по одному трэку
+LOUDNESS_TARGET = float(getenv("LOUDNESS_TARGET", -16))  # Целевая интегральная громкость, LUFS
+LOUDNESS_MAX_GAIN = float(getenv("LOUDNESS_MAX_GAIN", 9))  # Предел усиления и ослабления, дБ
+
+# Автодополнение /play
+SUGGEST_INDEX_SIZE = int(getenv("SUGGEST_INDEX_SIZE", 5000))  # Трэков в индексе подсказок
+AUTOCOMPLETE_DEBOUNCE = float(getenv("AUTOCOMPLETE_DEBOUNCE", 0.35))  # Пауза ввода перед поиском, секунды
+AUTOCOMPLETE_DEADLINE = float(getenv("AUTOCOMPLETE_DEADLINE", 2.2))  # Discord ждёт ответ не дольше 3 секунд
+AUTOCOMPLETE_RATE = float(getenv("AUTOCOMPLETE_RATE", 2))  # Поисков в секунду для подсказок на весь бот
+
+# Локальная библиотека трэков в SQLite. Пустой путь отключает библиотеку
+LIBRARY_DB_PATH = getenv("LIBRARY_DB_PATH", "")
+LIBRARY_FLUSH_INTERVAL = float(getenv("LIBRARY_FLUSH_INTERVAL", 5))  # Секунды между записями на диск
+LIBRARY_BATCH_SIZE = int(getenv("LIBRARY_BATCH_SIZE", 500))  # Записей, после которых запись идёт досрочно
+
+# Журнал очередей для восстановления после перезапуска. Пустой путь отключает журнал
+QUEUE_JOURNAL_DIR = getenv("QUEUE_JOURNAL_DIR", "")
+QUEUE_JOURNAL_FLUSH_INTERVAL = float(getenv("QUEUE_JOURNAL_FLUSH_INTERVAL", 1))  # Секунды между записями на диск
+QUEUE_JOURNAL_COMPACT_AFTER = int(getenv("QUEUE_JOURNAL_COMPACT_AFTER", 500))  # Операций до замены журнала снимком
+QUEUE_JOURNAL_TOUCH_INTERVAL = float(getenv("QUEUE_JOURNAL_TOUCH_INTERVAL", 15))  # Секунды между отметками позиции играющих гильдий
+RESUME_CONCURRENCY = int(getenv("RESUME_CONCURRENCY", 4))  # Гильдий, восстанавливаемых одновременно
+
+# Шарды и процессы. Лаунчер (src/launcher.py) задаёт SHARD_IDS и PROCESS_INDEX каждому процессу сам
+SHARDED = strtobool(getenv("SHARDED", "false"))  # AutoShardedBot вместо Bot
+SHARD_COUNT = int(getenv("SHARD_COUNT", 0))  # 0 — количество, рекомендованное Discord
+SHARD_IDS = [int(shard_id) for shard_id in getenv("SHARD_IDS", "").split(",") if shard_id]  # Пусто — все шарды
+PROCESS_INDEX = int(getenv("PROCESS_INDEX", 0))
+PROCESS_COUNT = int(getenv("PROCESS_COUNT", 1))
+CLUSTER_STATS_DIR = getenv("CLUSTER_STATS_DIR", "")  # Общий каталог статистики процессов. Пусто отключает
+CLUSTER_STATS_INTERVAL = float(getenv("CLUSTER_STATS_INTERVAL", 15))  # Секунды между публикациями статистики
+
+# Сообщение о текущем трэке
+NOW_PLAYING_EDIT_INTERVAL = float(getenv("NOW_PLAYING_EDIT_INTERVAL", 3))  # Не чаще одной правки за столько секунд
+NOW_PLAYING_PROGRESS_INTERVAL = float(getenv("NOW_PLAYING_PROGRESS_INTERVAL", 30))  # Обновление прогресса, 0 отключает
+
+# Метрики
+METRICS_ENABLED = strtobool(getenv("METRICS_ENABLED", "true"))  # Выключенные метрики почти ничего не стоят
+METRICS_PORT = int(getenv("METRICS_PORT", 0))  # Порт HTTP-эндпоинта /metrics, 0 отключает. Процесс лаунчера +номер
+METRICS_HOST = getenv("METRICS_HOST", "127.0.0.1")
+LOOP_LAG_INTERVAL = float(getenv("LOOP_LAG_INTERVAL", 0.5))  # Секунды между замерами опоздания event loop
+
+# Сторож event loop: снимки стека, когда loop занят дольше порога. Включается и на ходу через /debug_watchdog
+WATCHDOG_ENABLED = strtobool(getenv("WATCHDOG_ENABLED", "false"))
+WATCHDOG_THRESHOLD = float(getenv("WATCHDOG_THRESHOLD", 0.1))  # Секунды блокировки, после которых снимается стек
+WATCHDOG_INTERVAL = float(getenv("WATCHDOG_INTERVAL", 0.02))  # Секунды между отметками loop и снимками стека
+WATCHDOG_STACK_DEPTH = int(getenv("WATCHDOG_STACK_DEPTH", 12))  # Кадров стека в снимке
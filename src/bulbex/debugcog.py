@@ -1,14 +1,23 @@
 """
 Discord cog для дебага
 """
-from typing import List
+import os
+import asyncio
+
+from typing import List, Dict, Any
 
 import discord
-from discord.ext import commands
+from discord import Option
+from discord.ext import commands, tasks
 
 from loguru import logger
 
-from .config import GUILD_ID, TRUSTED_IDS
+from .cluster import ClusterStats
+from .metrics import METRICS, LOOP_LAG_SECONDS, Counter, Gauge, Histogram, LoopLagProbe, MetricsServer
+from .watchdog import LoopWatchdog, Offender
+from .config import (GUILD_ID, TRUSTED_IDS, PROCESS_INDEX, CLUSTER_STATS_DIR, CLUSTER_STATS_INTERVAL,
+                     METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL,
+                     WATCHDOG_ENABLED, WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL, WATCHDOG_STACK_DEPTH)
 
 GUILD_IDS = []
 if GUILD_ID:
@@ -31,23 +40,234 @@ class LinkedGuildsEmbed(discord.Embed):
             self.add_field(name=f"`#{i + 1} {guild.name}`", value=f"`{guild.id}`")
 
 
+class CacheStatsEmbed(discord.Embed):
+    """Embed со счётчиками кэша"""
+    def __init__(self, name: str, stats: Dict[str, Any], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = f"Кэш | {name}"
+        self.color = discord.Color.dark_red()
+
+        for key, value in stats.items():
+            self.add_field(name=key, value=f"`{value:.3f}`" if isinstance(value, float) else f"`{value}`")
+
+
+class TranscodeStatsEmbed(discord.Embed):
+    """Embed состояния пула ffmpeg"""
+    def __init__(self, stats: Dict[str, Any], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        running = stats["running"]
+        self.title = f"Пул ffmpeg | `{sum(running.values())}` из `{stats['max_jobs']}`, ожидают `{stats['waiting']}`"
+        self.color = discord.Color.dark_red()
+
+        for kind, totals in stats["totals"].items():
+            jobs = totals["jobs"]
+            self.add_field(name=f"`{kind}`",
+                           value=f"Сейчас: `{running[kind]}`. Завершено: `{jobs}`\n"
+                                 f"CPU: `{totals['cpu']:.1f}` с, время: `{totals['wall']:.1f}` с\n"
+                                 f"Ожидание в среднем: `{totals['waited'] / jobs if jobs else 0:.2f}` с, "
+                                 f"вытеснено: `{totals['preempted']}`",
+                           inline=False)
+
+        for kind, label, cpu_time, wall_time in stats["active"][:10]:
+            self.add_field(name=f"`{kind}` {label}", value=f"CPU `{cpu_time:.1f}` с за `{wall_time:.0f}` с")
+
+
+class VKStatsEmbed(discord.Embed):
+    """Embed нагрузки на токены ВКонтакте и планировщика запросов"""
+    def __init__(self, tokens: List[Dict[str, Any]], scheduler: Dict[str, Any], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = "ВКонтакте | токены"
+        self.color = discord.Color.dark_red()
+        self.description = " ".join(f"{key}: `{value}`" for key, value in scheduler.items())
+
+        for token in tokens:
+            if token["refreshing"]:
+                state = "обновляется"
+            elif token["quarantine"]:
+                state = f"карантин `{token['quarantine']:.0f}` с"
+            else:
+                state = "исправен" if token["healthy"] else "нет токена"
+
+            self.add_field(name=f"`{token['label']}`",
+                           value=f"Состояние: {state}\n"
+                                 f"В работе: `{token['in_flight']}`, запросов: `{token['requests']}`, "
+                                 f"ошибок: `{token['errors']}`"
+                                 + (f"\nПоследняя ошибка: `{token['last_error']}`" if token["last_error"] else ""),
+                           inline=False)
+
+
+class ClusterStatsEmbed(discord.Embed):
+    """Embed сводной статистики процессов бота"""
+    def __init__(self, snapshots: List[Dict[str, Any]], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = (f"Процессы | `{len(snapshots)}`. Гильдий: `{sum(s['guilds'] for s in snapshots)}`, "
+                      f"сессий: `{sum(s['sessions'] for s in snapshots)}`, "
+                      f"играет: `{sum(s['playing'] for s in snapshots)}`")
+        self.color = discord.Color.dark_red()
+
+        for snapshot in snapshots[:25]:
+            shards = snapshot["shards"]
+            self.add_field(name=f"`#{snapshot['process']}` pid {snapshot['pid']}"
+                                + (" (нет данных)" if snapshot["stale"] else ""),
+                           value=f"Шарды: `{f'{shards[0]}-{shards[-1]}' if shards else '-'}`, "
+                                 f"задержка: `{snapshot['latency'] * 1000:.0f}` мс\n"
+                                 f"Гильдий: `{snapshot['guilds']}`, сессий: `{snapshot['sessions']}`, "
+                                 f"играет: `{snapshot['playing']}`\n"
+                                 f"ffmpeg: `{snapshot['ffmpeg_running']}`, ожидают: `{snapshot['ffmpeg_waiting']}`\n"
+                                 f"VK: запросов `{snapshot['vk']['requests']}`, вызовов `{snapshot['vk']['calls']}`, "
+                                 f"поиск в кэше `{snapshot['search_cache']['hit_ratio']:.0%}`",
+                           inline=False)
+
+
+class MetricsEmbed(discord.Embed):
+    """Embed метрик процесса: значения, счётчики и квантили задержек"""
+    def __init__(self, metrics: Dict[str, Any], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = "Метрики"
+        self.color = discord.Color.dark_red()
+
+        gauges = []
+        for metric in metrics.values():
+            if isinstance(metric, Gauge):
+                gauges.append(f"{metric.name}: `{metric.read()}`")
+            elif isinstance(metric, Counter) and metric.values:
+                self.add_field(name=metric.name,
+                               value="\n".join(f"`{short_labels(key)}` {value:.0f}"
+                                                for key, value in list(metric.values.items())[:10]))
+            elif isinstance(metric, Histogram):
+                for key, series in list(metric.series.items())[:5]:
+                    labels = dict(key)
+                    self.add_field(name=f"{metric.name} {short_labels(key)}",
+                                   value=f"n `{series[-1]:.0f}`, среднее `{series[-2] / series[-1] * 1000:.0f}` мс\n"
+                                         f"p50 ≤ `{metric.quantile(0.5, **labels) * 1000:.0f}` мс, "
+                                         f"p95 ≤ `{metric.quantile(0.95, **labels) * 1000:.0f}` мс")
+
+        self.description = "\n".join(gauges)
+        self.remove_fields_beyond(25)
+
+    def remove_fields_beyond(self, limit: int) -> None:
+        while len(self.fields) > limit:
+            self.remove_field(-1)
+
+
+class WatchdogEmbed(discord.Embed):
+    """Embed сторожа event loop: текущее опоздание и места, чаще всего блокировавшие loop"""
+    def __init__(self, watchdog: LoopWatchdog, lag: float, offenders: List[Offender], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = "Сторож event loop"
+        self.color = discord.Color.dark_red()
+
+        lag_p95 = LOOP_LAG_SECONDS.quantile(0.95)
+        self.description = (f"{'Включён' if watchdog.running else 'Выключен'}, "
+                            f"порог `{watchdog.threshold * 1000:.0f}` мс\n"
+                            f"Опоздание loop: последнее `{lag * 1000:.1f}` мс"
+                            + (f", p95 ≤ `{lag_p95 * 1000:.0f}` мс" if lag_p95 is not None else ""))
+
+        for offender in offenders:
+            stack = "\n".join(offender.stack[-4:])[-900:]
+            self.add_field(name=f"{offender.where}"[:250],
+                           value=f"зависаний `{offender.stalls}`, худшее `{offender.worst * 1000:.0f}` мс, "
+                                 f"снимков `{offender.samples}`\n```{stack}```",
+                           inline=False)
+
+
+def short_labels(key) -> str:
+    return ",".join(f"{name}={value}" for name, value in key) or "-"
+
+
+def process_snapshot(bot: discord.Bot) -> Dict[str, Any]:
+    """Статистика текущего процесса для сводки по процессам"""
+    snapshot = {
+        "process": PROCESS_INDEX,
+        "pid": os.getpid(),
+        "shards": sorted(getattr(bot, "shards", {}) or []),
+        "latency": bot.latency if bot.latency == bot.latency else 0.0,  # NaN до подключения
+        "guilds": len(bot.guilds),
+        "sessions": 0,
+        "playing": 0,
+        "ffmpeg_running": 0,
+        "ffmpeg_waiting": 0,
+        "vk": {"requests": 0, "calls": 0},
+        "search_cache": {"hit_ratio": 0.0},
+    }
+
+    music_cog = bot.get_cog("MusicCog")
+    if music_cog:
+        pool = music_cog.sources.pool.stats()
+        snapshot.update({
+            "sessions": len(music_cog.sessions),
+            "playing": sum(session.is_playing for session in music_cog.sessions),
+            "ffmpeg_running": sum(pool["running"].values()),
+            "ffmpeg_waiting": pool["waiting"],
+            "vk": music_cog.vk_search.scheduler.stats(),
+            "search_cache": music_cog.vk_search.search_cache.stats(),
+        })
+
+    return snapshot
+
+
 class DebugCog(commands.Cog):
     """Cog с дебаг-командами"""
 
     def __init__(self, bot_: discord.Bot):
         self._bot = bot_
+        self._cluster = ClusterStats(CLUSTER_STATS_DIR,
+                                     process_index=PROCESS_INDEX,
+                                     stale_after=CLUSTER_STATS_INTERVAL * 3) if CLUSTER_STATS_DIR else None
+
+        self._watchdog = LoopWatchdog(WATCHDOG_THRESHOLD, WATCHDOG_INTERVAL, WATCHDOG_STACK_DEPTH)
+        self._lag_probe = LoopLagProbe(LOOP_LAG_INTERVAL)
+        METRICS.gauge("bulbex_loop_lag_last_seconds", "Последнее опоздание event loop", lambda: self._lag_probe.last)
+        self._metrics_server = MetricsServer(METRICS, METRICS_HOST, METRICS_PORT + PROCESS_INDEX) \
+            if METRICS.enabled and METRICS_PORT else None
+
+    def cog_unload(self):
+        self._publish_stats.cancel()
+        self._lag_probe.stop()
+        self._watchdog.stop()
+
+    async def close(self):
+        """Останавливает фоновые задачи и эндпоинт метрик. Вызывается при остановке бота"""
+        self.cog_unload()
+        if self._metrics_server:
+            await self._metrics_server.stop()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Запускает публикацию статистики процесса для остальных процессов и сбор метрик"""
+        if self._cluster and not self._publish_stats.is_running():
+            self._publish_stats.start()
+
+        if METRICS.enabled:
+            self._lag_probe.start()
+        if WATCHDOG_ENABLED:
+            self._watchdog.start()
+        if self._metrics_server:
+            await self._metrics_server.start()
+
+    @tasks.loop(seconds=CLUSTER_STATS_INTERVAL)
+    async def _publish_stats(self):
+        """Записывает статистику процесса в общий каталог"""
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._cluster.publish,
+                                                             process_snapshot(self._bot))
+        except Exception as e:
+            logger.exception(e)
 
     @commands.slash_command(name="debug_resync",
                             description="Ручная сихронизация слэш-комманд с гильдиями",
                             guild_ids=GUILD_IDS)
     @commands.check(trusted_only)
-    async def sync(self, ctx: discord.ApplicationContext):
-        """Повторная синхронизация гильдий. Занимает некоторое время"""
+    async def sync(self,
+                   ctx: discord.ApplicationContext,
+                   force: Option(bool, description="Синхронизировать все гильдии, даже без изменений",
+                                 required=False)):
+        """Повторная синхронизация гильдий, команды которых изменились. Занимает некоторое время"""
         logger.info(f"{ctx.guild.name} | Вызов /debug_resync от {ctx.author.name} в чате {ctx.channel.name}.")
 
         await ctx.respond("**Запущена повторная синхронизация...**")
-        await self._bot.sync_commands(guild_ids=[guild.id for guild in self._bot.guilds])
-        await ctx.send_followup("**Синхронизация завершена.**")
+        report = await self._bot.command_sync.sync([guild.id for guild in self._bot.guilds], force=bool(force))
+        await ctx.send_followup(f"**Синхронизация завершена: {report}.**")
 
     @commands.slash_command(name="debug_guilds",
                             description="Подключенные к боту гильдии",
@@ -58,3 +278,114 @@ class DebugCog(commands.Cog):
         logger.info(f"{ctx.guild.name} | Вызов /debug_guilds от {ctx.author.name} в чате {ctx.channel.name}.")
 
         await ctx.respond(embed=LinkedGuildsEmbed(self._bot.guilds))
+
+    @commands.slash_command(name="debug_cache",
+                            description="Счётчики кэшей поиска и трэков",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def cache(self, ctx: discord.ApplicationContext):
+        """Статистика кэшей: результатов поиска и перекодированных трэков на диске"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_cache от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        music_cog = self._bot.get_cog("MusicCog")
+        if not music_cog:
+            await ctx.respond("**MusicCog не загружен.**")
+            return
+
+        embeds = [CacheStatsEmbed("поиск ВКонтакте", music_cog.vk_search.search_cache.stats()),
+                  CacheStatsEmbed("подсказки /play", {**music_cog.autocomplete.index.stats(),
+                                                      **music_cog.autocomplete.stats()})]
+        if music_cog.sources.disk_cache:
+            embeds.append(CacheStatsEmbed("трэки на диске", music_cog.sources.disk_cache.stats()))
+        if music_cog.sources.loudness:
+            embeds.append(CacheStatsEmbed("громкость трэков", music_cog.sources.loudness.stats()))
+        if music_cog.library:
+            embeds.append(CacheStatsEmbed("библиотека", music_cog.library.stats()))
+
+        await ctx.respond(embeds=embeds)
+
+    @commands.slash_command(name="debug_ffmpeg",
+                            description="Процессы ffmpeg и затраченное ими время",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def ffmpeg(self, ctx: discord.ApplicationContext):
+        """Состояние пула ffmpeg и учёт CPU/времени по типам задач"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_ffmpeg от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        music_cog = self._bot.get_cog("MusicCog")
+        if not music_cog:
+            await ctx.respond("**MusicCog не загружен.**")
+            return
+
+        await ctx.respond(embed=TranscodeStatsEmbed(music_cog.sources.pool.stats()))
+
+    @commands.slash_command(name="debug_vk",
+                            description="Нагрузка на токены ВКонтакте",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def vk(self, ctx: discord.ApplicationContext):
+        """Состояние пула токенов и счётчики планировщика запросов ВКонтакте"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_vk от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        music_cog = self._bot.get_cog("MusicCog")
+        if not music_cog:
+            await ctx.respond("**MusicCog не загружен.**")
+            return
+
+        vk_search = music_cog.vk_search
+        await ctx.respond(embed=VKStatsEmbed(vk_search.tokens.stats(), vk_search.scheduler.stats()))
+
+    @commands.slash_command(name="debug_cluster",
+                            description="Сводная статистика всех процессов бота",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def cluster(self, ctx: discord.ApplicationContext):
+        """Статистика процессов лаунчера. Без общего каталога статистики — только текущий процесс"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_cluster от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        snapshot = process_snapshot(self._bot)
+        if not self._cluster:
+            await ctx.respond(embed=ClusterStatsEmbed([{**snapshot, "stale": False}]))
+            return
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._cluster.publish, snapshot)
+        await ctx.respond(embed=ClusterStatsEmbed(await loop.run_in_executor(None, self._cluster.collect)))
+
+    @commands.slash_command(name="debug_stats",
+                            description="Метрики процесса: задержки, очереди, ошибки",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def stats(self, ctx: discord.ApplicationContext):
+        """Счётчики и гистограммы задержек VK, запуска трэков, подключения к голосу и event loop"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_stats от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        if not METRICS.enabled:
+            await ctx.respond("**Метрики отключены (METRICS_ENABLED).**")
+            return
+
+        await ctx.respond(embed=MetricsEmbed(METRICS.metrics))
+
+    @commands.slash_command(name="debug_watchdog",
+                            description="Сторож event loop: включение и отчёт о блокирующем коде",
+                            guild_ids=GUILD_IDS)
+    @commands.check(trusted_only)
+    async def watchdog(self,
+                       ctx: discord.ApplicationContext,
+                       action: Option(str, description="Что сделать перед отчётом",
+                                      choices=["on", "off", "reset"], required=False),
+                       threshold: Option(int, description="Порог блокировки в миллисекундах",
+                                         min_value=10, required=False)):
+        """Включает, выключает или сбрасывает сторожа и показывает места, дольше всего державшие event loop"""
+        logger.info(f"{ctx.guild.name} | Вызов /debug_watchdog от {ctx.author.name} в чате {ctx.channel.name}.")
+
+        if threshold:
+            self._watchdog.threshold = threshold / 1000
+        if action == "on":
+            self._watchdog.start()
+        elif action == "off":
+            self._watchdog.stop()
+        elif action == "reset":
+            self._watchdog.reset()
+
+        await ctx.respond(embed=WatchdogEmbed(self._watchdog, self._lag_probe.last, self._watchdog.report(5)))
@@ -0,0 +1,245 @@
+"""
+Кэш перекодированных в Ogg/Opus трэков на диске
+"""
+import os
+import asyncio
+
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from loguru import logger
+
+from .vkmusic import Song
+from .loudness import LoudnessMeter, volume_filter
+from .transcode import JobKind, TranscodeJob, TranscodePool
+from .config import FFMPEG, BITRATE, FFMPEG_BEFORE_OPTIONS
+
+CACHE_SUFFIX = ".opus"
+MEASURE_SUFFIX = ".flac"
+TEMP_SUFFIX = ".tmp"
+
+
+class OpusDiskCache:
+    """
+    LRU-кэш трэков по идентификатору ВКонтакте.
+    Перекодирование выполняется один раз фоновым обработчиком, файл пишется во временный и атомарно
+    переименовывается, поэтому после падения в кэше не остаётся недописанных трэков.
+    С loudness усиление до целевой громкости записывается в сам файл, и при проигрывании из кэша
+    пакеты по-прежнему только копируются. Громкость ещё не измеренного трэка измеряется при скачивании
+    в промежуточный FLAC, из которого затем кодируется Opus, так что трэк скачивается один раз
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int,
+                 pool: Optional[TranscodePool] = None,
+                 loudness: Optional[LoudnessMeter] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pool = pool
+        self.loudness = loudness
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._jobs: "asyncio.Queue[Song]" = asyncio.Queue()
+        self._pending: Set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @property
+    def size(self) -> int:
+        """Занятое место в байтах"""
+        return self._size
+
+    def start(self) -> None:
+        """Запускает фоновое перекодирование"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_event_loop().create_task(self._work())
+
+    def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def get(self, song: Song) -> Optional[str]:
+        """Возвращает путь к перекодированному трэку, если он есть в кэше"""
+        if song.key not in self._entries:
+            self.misses += 1
+            return None
+
+        filepath = self._path(song.key)
+        try:
+            os.utime(filepath)  # Порядок LRU переживает перезапуск через mtime
+        except FileNotFoundError:
+            self._forget(song.key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(song.key)
+        self.hits += 1
+        return filepath
+
+    def schedule(self, song: Song) -> None:
+        """Ставит трэк в очередь на перекодирование, если его ещё нет в кэше"""
+        if song.key in self._entries or song.key in self._pending:
+            return
+
+        self._pending.add(song.key)
+        self._jobs.put_nowait(song)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики кэша"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending": len(self._pending),
+        }
+
+    async def _work(self) -> None:
+        while True:
+            song = await self._jobs.get()
+            self._pending.discard(song.key)
+            if song.key in self._entries:
+                continue
+
+            try:
+                if song.is_stale:
+                    logger.debug(f"Кэш | Ссылка устарела, трэк {song.key} не перекодирован")
+                else:
+                    await self._transcode(song)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+
+    def transcode_args(self, source: str, output: str, gain: Optional[float] = None, remote: bool = True) -> list:
+        """Аргументы ffmpeg для перекодирования ссылки или локального файла в Ogg/Opus с усилением gain дБ"""
+        volume = volume_filter(gain)
+        return [FFMPEG, "-nostdin", "-loglevel", "error", *(FFMPEG_BEFORE_OPTIONS.split() if remote else []),
+                "-i", source, "-vn", "-map_metadata", "-1", *(["-af", volume] if volume else []),
+                "-c:a", "libopus", "-b:a", f"{BITRATE}k", "-f", "ogg", "-y", output]
+
+    def measure_args(self, song: Song, output: str) -> list:
+        """Аргументы ffmpeg для скачивания трэка в FLAC с измерением громкости фильтром ebur128"""
+        return [FFMPEG, "-nostdin", "-hide_banner", "-nostats", *FFMPEG_BEFORE_OPTIONS.split(),
+                "-i", song.link, "-vn", "-map_metadata", "-1", "-af", "ebur128=framelog=quiet",
+                "-c:a", "flac", "-f", "flac", "-y", output]
+
+    async def _transcode(self, song: Song) -> None:
+        """Перекодирует трэк во временный файл и атомарно переносит его в кэш"""
+        job = await self.pool.acquire(JobKind.CACHE_FILL, f"{song.artist} - {song.title}") if self.pool else None
+        temp = self._path(song.key) + TEMP_SUFFIX
+        measured = os.path.join(self.directory, song.key + MEASURE_SUFFIX + TEMP_SUFFIX)
+
+        try:
+            gain = self.loudness.gain(song) if self.loudness else None
+            if self.loudness and gain is None:
+                returncode, output = await self._run(job, self.measure_args(song, measured))
+                if returncode == 0:
+                    await self.loudness.record(song, output)
+                    # Без сводки ebur128 трэк кэшируется как есть, с нулевым усилением
+                    returncode, output = await self._run(job, self.transcode_args(
+                        measured, temp, self.loudness.gain(song), remote=False))
+            else:
+                returncode, output = await self._run(job, self.transcode_args(song.link, temp, gain))
+        except asyncio.CancelledError:
+            self._remove(temp)
+            raise
+        finally:
+            self._remove(measured)
+            if job:
+                self.pool.release(job)
+
+        if job and job.preempted:
+            # Слот понадобился для проигрывания: перекодируем позже
+            self._remove(temp)
+            self.schedule(song)
+            return
+
+        if returncode != 0:
+            self._remove(temp)
+            logger.warning(f"Кэш | ffmpeg завершился с кодом {returncode} для {song.key}: {output.strip()[-300:]}")
+            return
+
+        size = await asyncio.get_running_loop().run_in_executor(None, self._commit, song.key, temp)
+        self._add(song.key, size)
+        self._evict()
+
+        logger.debug(f"Кэш | Сохранён {song.artist} - {song.title}. Занято {self._size} байт")
+
+    @staticmethod
+    async def _run(job: Optional[TranscodeJob], args: list) -> Tuple[int, str]:
+        """Запускает ffmpeg в слоте job. Возвращает код завершения и stderr"""
+        process = await asyncio.create_subprocess_exec(*args,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        if job:
+            job.pid = process.pid
+            job.preempt = process.kill
+
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+
+        if job:
+            # Между проходами вытеснять уже некого
+            job.preempt = None
+        return process.returncode, stderr.decode(errors="replace")
+
+    def _commit(self, key: str, temp: str) -> int:
+        """Сбрасывает файл на диск и переименовывает его в итоговый. Возвращает размер файла"""
+        with open(temp, "rb") as file:
+            os.fsync(file.fileno())
+
+        filepath = self._path(key)
+        os.replace(temp, filepath)
+        return os.path.getsize(filepath)
+
+    def _scan(self) -> None:
+        """Восстанавливает индекс кэша с диска и удаляет недописанные файлы"""
+        files = []
+        for name in os.listdir(self.directory):
+            filepath = os.path.join(self.directory, name)
+            if name.endswith(TEMP_SUFFIX):
+                self._remove(filepath)
+            elif name.endswith(CACHE_SUFFIX):
+                stat = os.stat(filepath)
+                files.append((stat.st_mtime, name[:-len(CACHE_SUFFIX)], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._add(key, size)
+
+        self._evict()
+
+    def _add(self, key: str, size: int) -> None:
+        self._forget(key)
+        self._entries[key] = size
+        self._size += size
+
+    def _forget(self, key: str) -> None:
+        self._size -= self._entries.pop(key, 0)
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self._remove(self._path(key))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    @staticmethod
+    def _remove(filepath: str) -> None:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
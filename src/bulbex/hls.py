@@ -0,0 +1,235 @@
+"""
+HLS-ссылки ВКонтакте: сегменты скачиваются заранее и параллельно и подаются в ffmpeg одним непрерывным потоком
+"""
+import re
+import queue
+import asyncio
+
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from urllib.parse import urljoin
+
+from aiohttp import ClientSession
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from loguru import logger
+
+from .metrics import HLS_SEGMENT_SECONDS, HLS_UNDERRUNS
+from .config import VK_RETRY_BACKOFF
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class Segment:
+    """Сегмент HLS-плейлиста"""
+
+    __slots__ = ("uri", "duration", "sequence", "key_uri", "iv")
+
+    def __init__(self, uri: str, duration: float, sequence: int, key_uri: Optional[str], iv: Optional[bytes]):
+        self.uri = uri
+        self.duration = duration
+        self.sequence = sequence
+        self.key_uri = key_uri  # AES-128 ключ сегмента, None для незашифрованных
+        self.iv = iv
+
+
+def parse_attributes(line: str) -> Dict[str, str]:
+    return {name: value.strip('"') for name, value in ATTRIBUTE_PATTERN.findall(line.split(":", 1)[1])}
+
+
+def parse_playlist(text: str, base_url: str) -> List[Segment]:
+    """Сегменты медиаплейлиста. Для мастер-плейлиста возвращается пустой список"""
+    segments = []
+    sequence, duration = 0, 0.0
+    key_uri, iv = None, None
+
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif line.startswith("#EXT-X-KEY:"):
+            attributes = parse_attributes(line)
+            if attributes.get("METHOD") == "AES-128":
+                key_uri = urljoin(base_url, attributes["URI"])
+                iv = bytes.fromhex(attributes["IV"][2:]) if "IV" in attributes else None
+            else:
+                key_uri, iv = None, None
+        elif line and not line.startswith("#"):
+            segments.append(Segment(urljoin(base_url, line), duration, sequence, key_uri, iv))
+            sequence += 1
+
+    return segments
+
+
+def variant_url(text: str, base_url: str) -> Optional[str]:
+    """Первый вариант мастер-плейлиста"""
+    lines = [line.strip() for line in text.splitlines()]
+    for i, line in enumerate(lines):
+        if line.startswith("#EXT-X-STREAM-INF") and i + 1 < len(lines):
+            return urljoin(base_url, lines[i + 1])
+    return None
+
+
+def decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """Расшифровывает сегмент AES-128-CBC с дополнением PKCS#7"""
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    return unpadder.update(decryptor.update(data) + decryptor.finalize()) + unpadder.finalize()
+
+
+class HLSStream:
+    """
+    Поток байт HLS-плейлиста для stdin ffmpeg.
+    Сегменты скачиваются через общий пул соединений по read_ahead штук одновременно и отдаются строго по порядку.
+    Скачивание идёт на event loop, а read() вызывается из потока, который пишет в ffmpeg:
+    в очереди между ними не больше read_ahead сегментов, так что скачивание не убегает далеко вперёд проигрывания
+    """
+
+    def __init__(self, url: str, session: ClientSession, read_ahead: int, retries: int):
+        self.url = url
+        self.underruns = 0  # Сколько раз ffmpeg ждал ещё не скачанный сегмент
+        self.fetched = 0
+
+        self._session = session
+        self._read_ahead = read_ahead
+        self._retries = retries
+        self._keys: Dict[str, asyncio.Future] = {}
+        self._chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._credit: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._buffer = b""
+        self._offset = 0
+        self._started = False
+        self._finished = False
+
+    async def open(self, position: float = 0.0) -> float:
+        """
+        Загружает плейлист и начинает скачивание с сегмента, в который попадает position.
+        Возвращает позицию внутри этого сегмента, которую остаётся пропустить ffmpeg
+        """
+        self._loop = asyncio.get_running_loop()
+        self._credit = asyncio.Semaphore(self._read_ahead)
+
+        text = await self._get_text(self.url)
+        segments = parse_playlist(text, self.url)
+        if not segments:
+            variant = variant_url(text, self.url)
+            if variant:
+                segments = parse_playlist(await self._get_text(variant), variant)
+        if not segments:
+            raise ValueError(f"В HLS-плейлисте нет сегментов: {self.url}")
+
+        skipped = 0.0
+        while segments and skipped + segments[0].duration <= position:
+            skipped += segments.pop(0).duration
+
+        self._task = self._loop.create_task(self._fetch_all(segments))
+        return max(position - skipped, 0.0)
+
+    def read(self, size: int = -1) -> bytes:
+        """Блокирующее чтение для потока, пишущего в ffmpeg. Пустой результат означает конец потока"""
+        if self._offset >= len(self._buffer):
+            if self._finished:
+                return b""
+
+            try:
+                chunk = self._chunks.get_nowait()
+            except queue.Empty:
+                if self._started:
+                    self.underruns += 1
+                    HLS_UNDERRUNS.inc()
+                chunk = self._chunks.get()
+
+            if chunk is None:
+                self._finished = True
+                return b""
+
+            self._started = True
+            self._buffer, self._offset = chunk, 0
+            self._call_soon(self._credit.release)
+
+        end = len(self._buffer) if size < 0 else self._offset + size
+        data = self._buffer[self._offset:end]
+        self._offset += len(data)
+        return data
+
+    def close(self) -> None:
+        """Останавливает скачивание. Можно вызывать из любого потока"""
+        if self._task:
+            self._call_soon(self._task.cancel)
+        self._chunks.put(None)
+
+    def _call_soon(self, callback) -> None:
+        try:
+            self._loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # Event loop уже закрыт при остановке бота
+            pass
+
+    async def _fetch_all(self, segments: List[Segment]) -> None:
+        fetching: Deque[asyncio.Task] = deque()
+        upcoming = iter(segments)
+
+        def fill():
+            while len(fetching) < self._read_ahead:
+                segment = next(upcoming, None)
+                if segment is None:
+                    return
+                fetching.append(self._loop.create_task(self._fetch(segment)))
+
+        try:
+            fill()
+            while fetching:
+                data = await fetching.popleft()
+                fill()
+                await self._credit.acquire()
+                self._chunks.put(data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"HLS | {self.url}: {e!r}")
+        finally:
+            for task in [*fetching, *self._keys.values()]:
+                task.cancel()
+            self._chunks.put(None)
+
+    async def _fetch(self, segment: Segment) -> bytes:
+        # Ключ скачивается одновременно с сегментом, а не после него
+        key = self._key(segment.key_uri) if segment.key_uri else None
+
+        with HLS_SEGMENT_SECONDS.time():
+            data = await self._get(segment.uri)
+        self.fetched += 1
+
+        if key is None:
+            return data
+
+        iv = segment.iv or segment.sequence.to_bytes(16, "big")
+        return await self._loop.run_in_executor(None, decrypt, data, await asyncio.shield(key), iv)
+
+    def _key(self, uri: str) -> asyncio.Future:
+        """Ключ шифрования. Запрашивается один раз на плейлист, даже если нужен нескольким сегментам сразу"""
+        future = self._keys.get(uri)
+        if future is None:
+            future = self._keys[uri] = self._loop.create_task(self._get(uri))
+        return future
+
+    async def _get(self, url: str) -> bytes:
+        for attempt in range(self._retries + 1):
+            try:
+                async with self._session.get(url, ssl=False) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if attempt == self._retries:
+                    raise
+                await asyncio.sleep(VK_RETRY_BACKOFF * 2 ** attempt)
+
+    async def _get_text(self, url: str) -> str:
+        return (await self._get(url)).decode("utf-8", errors="replace")
@@ -0,0 +1,300 @@
+"""
+Журнал очередей гильдий для восстановления после перезапуска
+"""
+import os
+import json
+import time
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+from loguru import logger
+
+from .vkmusic import Song
+from .songqueue import SongQueue
+from .session import GuildSession
+
+JOURNAL_SUFFIX = ".jsonl"
+TEMP_SUFFIX = ".tmp"
+
+
+def song_to_row(song: Song) -> list:
+    return [song.artist, song.title, song.duration, song.link,
+            song.owner_id, song.track_id, song.access_key, song.fetched_at]
+
+
+def song_from_row(row: list) -> Song:
+    return Song(*row)
+
+
+class SavedSession:
+    """Состояние сессии, восстановленное из журнала"""
+
+    def __init__(self,
+                 queue: SongQueue,
+                 now_playing: Optional[Song],
+                 position: float,
+                 voice_channel_id: Optional[int],
+                 text_channel_id: Optional[int]):
+        self.queue = queue
+        self.now_playing = now_playing
+        self.position = position
+        self.voice_channel_id = voice_channel_id
+        self.text_channel_id = text_channel_id
+
+
+class QueueJournal:
+    """
+    Журнал изменений очередей: по файлу на гильдию, в который дописываются операции SongQueue.
+    Записи копятся в памяти и дописываются пачками в отдельном потоке; когда операций с последнего
+    снимка становится больше compact_after, файл атомарно заменяется снимком текущего состояния.
+    Файлы играющих гильдий, в которые давно ничего не писалось, раз в touch_interval секунд получают свежий mtime:
+    по нему после падения считается позиция трэка.
+    Оборванная при падении последняя строка при чтении пропускается
+    """
+
+    def __init__(self, directory: str, flush_interval: float, compact_after: int, touch_interval: float):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self.touch_interval = touch_interval
+        self.written = 0
+        self.compactions = 0
+
+        self._sessions: Dict[int, GuildSession] = {}
+        self._playing: Dict[int, dict] = {}
+        self._pending: Dict[int, List[str]] = {}
+        self._operations: Dict[int, int] = {}
+        self._snapshot: Set[int] = set()
+        self._touched: Dict[int, float] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._worker: Optional[asyncio.Task] = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self) -> None:
+        """Запускает фоновую запись"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_event_loop().create_task(self._work())
+
+    async def close(self) -> None:
+        """Дописывает накопленное. Время остановки сохраняется в mtime файлов играющих гильдий"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+        await self.flush(touch_all=True)
+        self._executor.shutdown(wait=True)
+
+    def saved_guilds(self, owned: Callable[[int], bool] = lambda guild_id: True) -> List[int]:
+        """
+        Гильдии из owned, для которых есть журнал, и удаление их недописанных снимков.
+        Файлы не читаются, поэтому вызов быстрый при любом их количестве
+        """
+        guilds = []
+        for entry in os.scandir(self.directory):
+            name = entry.name[:-len(TEMP_SUFFIX)] if entry.name.endswith(TEMP_SUFFIX) else entry.name
+            if not name.endswith(JOURNAL_SUFFIX) or not name[:-len(JOURNAL_SUFFIX)].isdigit():
+                continue
+
+            guild_id = int(name[:-len(JOURNAL_SUFFIX)])
+            if not owned(guild_id):
+                continue
+
+            if entry.name.endswith(TEMP_SUFFIX):
+                self._remove(entry.path)
+            else:
+                guilds.append(guild_id)
+        return guilds
+
+    def load(self, guild_id: int) -> Optional[SavedSession]:
+        """Повторяет операции журнала гильдии на пустой очереди. Блокирующий вызов, выполняется в executor"""
+        filepath = self._path(guild_id)
+        try:
+            with open(filepath, encoding="utf-8") as file:
+                lines = file.readlines()
+            stopped_at = os.path.getmtime(filepath)
+        except FileNotFoundError:
+            return None
+
+        queue = SongQueue()
+        playing = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+                operation, args = record[0], record[1:]
+
+                if operation == "snapshot":
+                    queue = SongQueue(song_from_row(row) for row in args[0])
+                    playing = args[1]
+                elif operation == "play":
+                    playing = args[0]
+                elif operation == "extend":
+                    queue.extend(song_from_row(row) for row in args[0])
+                elif operation == "appendleft":
+                    queue.appendleft(song_from_row(args[0]))
+                elif operation == "popleft":
+                    queue.popleft()
+                elif operation == "remove_at":
+                    queue.remove_at(args[0])
+                elif operation == "remove":
+                    queue.remove(args[0])
+                elif operation == "move":
+                    queue.move(args[0], args[1])
+                elif operation == "dedup":
+                    queue.dedup()
+                elif operation == "clear":
+                    queue.clear()
+            except (ValueError, IndexError, KeyError, TypeError):
+                # Оборванная при падении строка
+                continue
+
+        if playing is None:
+            return SavedSession(queue, None, 0.0, None, None)
+
+        return SavedSession(queue,
+                            now_playing=song_from_row(playing["song"]),
+                            position=max(stopped_at - playing["started"], 0.0),
+                            voice_channel_id=playing["voice"],
+                            text_channel_id=playing["text"])
+
+    def attach(self, session: GuildSession) -> None:
+        """Начинает журналировать очередь сессии. Первой записью в журнал ляжет снимок текущего состояния"""
+        if self._sessions.get(session.guild_id) is session:
+            return
+
+        self._sessions[session.guild_id] = session
+        self._snapshot.add(session.guild_id)
+        session.queue.listener = lambda operation, *args: self._record(session.guild_id, operation, *args)
+
+    def playing(self, session: GuildSession, song: Song, position: float = 0.0) -> None:
+        """Записывает запуск трэка и голосовой канал, в котором он играет"""
+        playing = {
+            "song": song_to_row(song),
+            "started": time.time() - position,
+            "voice": session.voice_client.channel.id if session.voice_client else None,
+            "text": session.text_channel.id if session.text_channel else None,
+        }
+        self._playing[session.guild_id] = playing
+        self._append(session.guild_id, ["play", playing])
+
+    def drop(self, guild_id: int) -> None:
+        """Забывает сессию и удаляет её журнал: проигрывание закончено"""
+        session = self._sessions.pop(guild_id, None)
+        if session:
+            session.queue.listener = None
+
+        self._playing.pop(guild_id, None)
+        self._pending.pop(guild_id, None)
+        self._operations.pop(guild_id, None)
+        self._snapshot.discard(guild_id)
+        self._touched.pop(guild_id, None)
+
+        # Через тот же поток, что и запись, чтобы удаление не обогнало уже начатую запись
+        self._executor.submit(self._remove, self._path(guild_id))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._sessions),
+            "pending": sum(len(lines) for lines in self._pending.values()),
+            "written": self.written,
+            "compactions": self.compactions,
+        }
+
+    async def flush(self, touch_all: bool = False) -> None:
+        """
+        Дописывает накопленные операции или заменяет журналы снимками в отдельном потоке.
+        С touch_all mtime обновляется у всех играющих гильдий, а не только у давно не тронутых
+        """
+        appends, snapshots = {}, {}
+        for guild_id, lines in self._pending.items():
+            if guild_id in self._snapshot or self._operations.get(guild_id, 0) > self.compact_after:
+                snapshots[guild_id] = self._snapshot_line(guild_id)
+                self._operations[guild_id] = 0
+            else:
+                appends[guild_id] = lines
+
+        for guild_id in self._snapshot - snapshots.keys():
+            snapshots[guild_id] = self._snapshot_line(guild_id)
+
+        self._pending = {}
+        self._snapshot = set()
+
+        # Запись в файл сама обновляет его mtime
+        now = time.monotonic()
+        for guild_id in (*appends, *snapshots):
+            self._touched[guild_id] = now
+
+        playing = [guild_id for guild_id, session in self._sessions.items()
+                   if session.is_playing and (touch_all or now - self._touched.get(guild_id, 0.0) >= self.touch_interval)
+                   and guild_id not in appends and guild_id not in snapshots]
+        for guild_id in playing:
+            self._touched[guild_id] = now
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, appends, snapshots, playing)
+        self.written += sum(len(lines) for lines in appends.values()) + len(snapshots)
+        self.compactions += len(snapshots)
+
+    def _record(self, guild_id: int, operation: str, *args) -> None:
+        if operation == "reset":
+            self._snapshot.add(guild_id)
+            self._pending.setdefault(guild_id, [])
+            return
+
+        if operation == "extend":
+            args = ([song_to_row(song) for song in args[0]],)
+        elif operation == "appendleft":
+            args = (song_to_row(args[0]),)
+
+        self._append(guild_id, [operation, *args])
+
+    def _append(self, guild_id: int, record: list) -> None:
+        self._pending.setdefault(guild_id, []).append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._operations[guild_id] = self._operations.get(guild_id, 0) + 1
+
+    def _snapshot_line(self, guild_id: int) -> str:
+        session = self._sessions.get(guild_id)
+        songs = [song_to_row(song) for song in session.queue] if session else []
+        return json.dumps(["snapshot", songs, self._playing.get(guild_id)], ensure_ascii=False, separators=(",", ":"))
+
+    def _write(self, appends: Dict[int, List[str]], snapshots: Dict[int, str], playing: List[int]) -> None:
+        for guild_id, lines in appends.items():
+            with open(self._path(guild_id), "a", encoding="utf-8") as file:
+                file.write("\n".join(lines) + "\n")
+
+        for guild_id, line in snapshots.items():
+            temp = self._path(guild_id) + TEMP_SUFFIX
+            with open(temp, "w", encoding="utf-8") as file:
+                file.write(line + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, self._path(guild_id))
+
+        # mtime журнала — момент, когда трэк точно ещё играл: по нему считается позиция после падения.
+        # После падения трэк продолжится не больше чем на touch_interval секунд раньше, чем оборвался
+        for guild_id in playing:
+            try:
+                os.utime(self._path(guild_id))
+            except FileNotFoundError:
+                pass
+
+    async def _work(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+
+    def _path(self, guild_id: int) -> str:
+        return os.path.join(self.directory, f"{guild_id}{JOURNAL_SUFFIX}")
+
+    @staticmethod
+    def _remove(filepath: str) -> None:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
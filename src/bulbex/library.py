@@ -0,0 +1,232 @@
+"""
+Локальная библиотека трэков и история проигрывания в SQLite
+"""
+import time
+import sqlite3
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .vkmusic import Song
+from .suggest import split_words
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    key TEXT PRIMARY KEY,
+    owner_id INTEGER NOT NULL,
+    track_id INTEGER NOT NULL,
+    access_key TEXT NOT NULL DEFAULT '',
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    link TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS plays (
+    guild_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    last_played REAL NOT NULL,
+    PRIMARY KEY (guild_id, key)
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    artist, title, content='tracks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts(rowid, artist, title) VALUES (new.rowid, new.artist, new.title);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title) VALUES ('delete', old.rowid, old.artist, old.title);
+END;
+
+CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE OF artist, title ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title) VALUES ('delete', old.rowid, old.artist, old.title);
+    INSERT INTO tracks_fts(rowid, artist, title) VALUES (new.rowid, new.artist, new.title);
+END;
+"""
+
+UPSERT_TRACK = """
+INSERT INTO tracks (key, owner_id, track_id, access_key, artist, title, duration, link, fetched_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    access_key = excluded.access_key,
+    artist = excluded.artist,
+    title = excluded.title,
+    duration = excluded.duration,
+    link = excluded.link,
+    fetched_at = excluded.fetched_at
+WHERE excluded.fetched_at > tracks.fetched_at
+"""
+
+UPSERT_PLAY = """
+INSERT INTO plays (guild_id, key, count, last_played) VALUES (?, ?, ?, ?)
+ON CONFLICT (guild_id, key) DO UPDATE SET
+    count = count + excluded.count,
+    last_played = max(last_played, excluded.last_played)
+"""
+
+SONG_COLUMNS = "t.artist, t.title, t.duration, t.link, t.owner_id, t.track_id, t.access_key, t.fetched_at"
+
+
+def fts_query(query: str) -> Optional[str]:
+    """Запрос FTS5, в котором каждое слово ищется как префикс"""
+    words = split_words(query)
+    if not words:
+        return None
+    return " AND ".join(f'"{word}"*' for word in words)
+
+
+class LibraryStore:
+    """
+    Библиотека всех найденных трэков с полнотекстовым поиском и счётчиками проигрываний по гильдиям.
+    Записи копятся в памяти и сбрасываются пачками в отдельном потоке, поэтому event loop не ждёт диск.
+    Поиск читает базу напрямую: в режиме WAL чтение не блокируется записью и занимает доли миллисекунды
+    """
+
+    def __init__(self, filepath: str, flush_interval: float, batch_size: int):
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+
+        self._tracks: Dict[str, Song] = {}
+        self._plays: Dict[Tuple[int, str], List[float]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library")
+        self._flushed = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._reader = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.filepath, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @property
+    def pending(self) -> int:
+        return len(self._tracks) + len(self._plays)
+
+    def start(self) -> None:
+        """Запускает фоновую запись"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_event_loop().create_task(self._work())
+
+    async def close(self) -> None:
+        """Сбрасывает накопленные записи и закрывает базу"""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+        await self.flush()
+        self._executor.shutdown(wait=True)
+        self._writer.close()
+        self._reader.close()
+
+    def record(self, songs: List[Song]) -> None:
+        """Добавляет трэки в библиотеку"""
+        for song in songs:
+            self._tracks[song.key] = song
+        self._wake()
+
+    def record_play(self, guild_id: int, song: Song) -> None:
+        """Учитывает проигрывание трэка в гильдии"""
+        self._tracks[song.key] = song
+
+        play = self._plays.setdefault((guild_id, song.key), [0, 0.0])
+        play[0] += 1
+        play[1] = time.time()
+        self._wake()
+
+    def search(self, query: str, guild_id: int, limit: int) -> List[Song]:
+        """Трэки библиотеки по словам запроса, сначала часто играемые в гильдии"""
+        match = fts_query(query)
+        if not match:
+            return []
+
+        rows = self._reader.execute(f"""
+            SELECT {SONG_COLUMNS}
+            FROM tracks_fts f
+            JOIN tracks t ON t.rowid = f.rowid
+            LEFT JOIN plays p ON p.key = t.key AND p.guild_id = ?
+            WHERE tracks_fts MATCH ?
+            ORDER BY coalesce(p.count, 0) DESC, f.rank
+            LIMIT ?
+        """, (guild_id, match, limit)).fetchall()
+
+        if rows:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return [Song(*row) for row in rows]
+
+    def most_played(self, limit: int) -> List[Song]:
+        """Самые проигрываемые трэки по всем гильдиям"""
+        rows = self._reader.execute(f"""
+            SELECT {SONG_COLUMNS}
+            FROM tracks t
+            JOIN (SELECT key, sum(count) AS total FROM plays GROUP BY key) p ON p.key = t.key
+            ORDER BY p.total DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+        return [Song(*row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        tracks, = self._reader.execute("SELECT count(*) FROM tracks").fetchone()
+        return {
+            "tracks": tracks,
+            "pending": self.pending,
+            "written": self.written,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def flush(self) -> None:
+        """Записывает накопленное в базу в отдельном потоке"""
+        if not self.pending:
+            return
+
+        tracks = [(song.key, song.owner_id, song.track_id, song.access_key, song.artist, song.title,
+                   song.duration, song.link, song.fetched_at) for song in self._tracks.values()]
+        plays = [(guild_id, key, count, last_played) for (guild_id, key), (count, last_played) in self._plays.items()]
+        self._tracks, self._plays = {}, {}
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, tracks, plays)
+        self.written += len(tracks) + len(plays)
+
+    def _write(self, tracks: list, plays: list) -> None:
+        with self._writer:
+            self._writer.executemany(UPSERT_TRACK, tracks)
+            self._writer.executemany(UPSERT_PLAY, plays)
+
+    def _wake(self) -> None:
+        if self.pending >= self.batch_size:
+            self._flushed.set()
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flushed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flushed.clear()
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
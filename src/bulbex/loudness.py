@@ -0,0 +1,182 @@
+"""
+Нормализация громкости: громкость трэка измеряется один раз и хранится по идентификатору ВКонтакте
+"""
+import os
+import re
+import json
+import asyncio
+
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from .vkmusic import Song
+from .transcode import JobKind, TranscodePool
+from .config import FFMPEG, FFMPEG_BEFORE_OPTIONS
+
+INTEGRATED_PATTERN = re.compile(r"Integrated loudness:\s+I:\s+(-?[\d.]+|-inf) LUFS")
+
+
+def volume_filter(gain: Optional[float]) -> Optional[str]:
+    """Фильтр ffmpeg со статическим усилением. Для нулевого или неизвестного усиления фильтр не нужен"""
+    if gain is None or abs(gain) < 0.1:
+        return None
+    return f"volume={gain:.1f}dB"
+
+
+class LoudnessMeter:
+    """
+    Интегральная громкость трэков (EBU R128) по идентификатору ВКонтакте.
+    Без кэша на диске неизвестные трэки измеряются в фоне отдельным проходом ffmpeg без кодирования, с самым
+    низким приоритетом в пуле ffmpeg, а с кэшем — тем же ffmpeg, что перекодирует трэк в кэш (record).
+    Результаты дописываются в файл и переживают перезапуск. При проигрывании вместо loudnorm в реальном
+    времени применяется статическое усиление до target, не больше max_gain по модулю
+    """
+
+    def __init__(self, filepath: str, target: float, max_gain: float, pool: Optional[TranscodePool] = None):
+        self.filepath = filepath
+        self.target = target
+        self.max_gain = max_gain
+        self.pool = pool
+        self.measured = 0
+        self.failed = 0
+
+        self._loudness: Dict[str, Optional[float]] = {}  # None — измерить не удалось, трэк играет без усиления
+        self._jobs: "asyncio.Queue[Song]" = asyncio.Queue()
+        self._pending: Set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+        self._load()
+
+    def start(self) -> None:
+        """Запускает фоновое измерение"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_event_loop().create_task(self._work())
+
+    def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    def known(self, song: Song) -> bool:
+        return song.key in self._loudness
+
+    def gain(self, song: Song) -> Optional[float]:
+        """Усиление в дБ для трэка или None, если громкость ещё не измерена"""
+        if song.key not in self._loudness:
+            return None
+
+        loudness = self._loudness[song.key]
+        if loudness is None:
+            return 0.0
+        return max(-self.max_gain, min(self.max_gain, self.target - loudness))
+
+    def schedule(self, song: Song) -> None:
+        """Ставит трэк в очередь на измерение, если его громкость неизвестна"""
+        if song.key in self._loudness or song.key in self._pending:
+            return
+
+        self._pending.add(song.key)
+        self._jobs.put_nowait(song)
+
+    async def record(self, song: Song, output: str) -> None:
+        """Запоминает громкость трэка по сводке фильтра ebur128 из stderr успешно завершившегося ffmpeg"""
+        match = INTEGRATED_PATTERN.search(output)
+        if match is None:
+            self.failed += 1
+            logger.warning(f"Громкость | Нет сводки ebur128 для {song.key}: {output.strip()[-300:]}")
+
+        # Тишина (-inf) и трэки без сводки играют без усиления
+        loudness = float(match.group(1)) if match and match.group(1) != "-inf" else None
+        self._loudness[song.key] = loudness
+        self.measured += 1
+        await asyncio.get_running_loop().run_in_executor(None, self._append, song.key, loudness)
+
+        logger.debug(f"Громкость | {song.artist} - {song.title}: {loudness} LUFS, усиление {self.gain(song):.1f} дБ")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._loudness),
+            "measured": self.measured,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
+
+    async def _work(self) -> None:
+        while True:
+            song = await self._jobs.get()
+            self._pending.discard(song.key)
+
+            try:
+                if not self.known(song):
+                    await self._measure(song)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+
+    def analysis_args(self, song: Song) -> list:
+        """Аргументы ffmpeg для измерения громкости: только декодирование и фильтр ebur128"""
+        return [FFMPEG, "-nostdin", "-hide_banner", "-nostats", *FFMPEG_BEFORE_OPTIONS.split(),
+                "-i", song.link, "-vn", "-af", "ebur128=framelog=quiet", "-f", "null", "-"]
+
+    async def _measure(self, song: Song) -> None:
+        if song.is_stale:
+            logger.debug(f"Громкость | Ссылка устарела, трэк {song.key} не измерен")
+            return
+
+        job = await self.pool.acquire(JobKind.ANALYSIS, f"{song.artist} - {song.title}") if self.pool else None
+        try:
+            process = await asyncio.create_subprocess_exec(*self.analysis_args(song),
+                                                           stdout=asyncio.subprocess.DEVNULL,
+                                                           stderr=asyncio.subprocess.PIPE)
+            if job:
+                job.pid = process.pid
+                job.preempt = process.kill
+
+            try:
+                _, stderr = await process.communicate()
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+        finally:
+            if job:
+                self.pool.release(job)
+
+        if job and job.preempted:
+            # Слот понадобился для проигрывания: измерим позже
+            self.schedule(song)
+            return
+
+        output = stderr.decode(errors="replace")
+        if process.returncode != 0:
+            # Ошибка сети или ссылки: трэк измерится при следующем проигрывании
+            self.failed += 1
+            logger.warning(f"Громкость | Не удалось измерить {song.key}, ffmpeg завершился с кодом "
+                           f"{process.returncode}: {output.strip()[-300:]}")
+            return
+
+        await self.record(song, output)
+
+    def _append(self, key: str, loudness: Optional[float]) -> None:
+        with open(self.filepath, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"key": key, "lufs": loudness}) + "\n")
+
+    def _load(self) -> None:
+        """Читает измерения с диска. Повреждённые строки, например недописанная последняя, пропускаются"""
+        directory = os.path.dirname(self.filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        try:
+            with open(self.filepath, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self._loudness[entry["key"]] = entry["lufs"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+        logger.info(f"Громкость | Загружено измерений: {len(self._loudness)}")
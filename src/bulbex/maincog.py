@@ -1,26 +1,59 @@
 """
 Discord cog с основным функционалом
 """
-from typing import List, Callable
+import os
+import time
+import asyncio
 
-from random import shuffle
+from typing import Dict, List, Callable, Optional, Set
 
 import discord
 from discord import Option
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from aiohttp.web import HTTPNotFound
 
 from loguru import logger
 
-from .vkmusic import VKMusicSearch, KateMobile, AccessCredentials, Song
-from .config import GUILD_ID, FFMPEG, BITRATE
+from .vkmusic import VKMusicSearch, KateMobile, VKAccounts, VKAccessTokens, Song
+from .session import GuildSession, SessionRegistry, PlaylistLoader
+from .songqueue import SongQueue
+from .player import SourceFactory
+from .diskcache import OpusDiskCache
+from .transcode import JobKind, TranscodePool
+from .loudness import LoudnessMeter
+from .suggest import SuggestionIndex, Autocompleter
+from .library import LibraryStore
+from .journal import QueueJournal
+from .cluster import owns_guild
+from .nowplaying import NowPlayingMessage
+from .voice import VoiceManager
+from .metrics import METRICS, TRACK_START_SECONDS, TRACKS_STARTED, ERRORS
+from .config import (GUILD_ID, SESSION_IDLE_TIMEOUT, SESSION_EVICT_INTERVAL, VOICE_IDLE_GRACE,
+                     PLAYLIST_REFILL_THRESHOLD, RESOLVE_BATCH_SIZE, PREFETCH_AHEAD,
+                     DISK_CACHE_DIR, DISK_CACHE_MAX_MB, TRANSCODE_MAX_JOBS,
+                     SUGGEST_INDEX_SIZE, AUTOCOMPLETE_DEBOUNCE, AUTOCOMPLETE_DEADLINE, AUTOCOMPLETE_RATE,
+                     LIBRARY_DB_PATH, LIBRARY_FLUSH_INTERVAL, LIBRARY_BATCH_SIZE,
+                     QUEUE_JOURNAL_DIR, QUEUE_JOURNAL_FLUSH_INTERVAL, QUEUE_JOURNAL_COMPACT_AFTER,
+                     QUEUE_JOURNAL_TOUCH_INTERVAL, RESUME_CONCURRENCY,
+                     PROCESS_INDEX, PROCESS_COUNT, NOW_PLAYING_EDIT_INTERVAL, NOW_PLAYING_PROGRESS_INTERVAL,
+                     LOUDNESS_DB_PATH, LOUDNESS_TARGET, LOUDNESS_MAX_GAIN)
 
 GUILD_IDS = []
 if GUILD_ID:
     GUILD_IDS.append(GUILD_ID)
 
 
+# Значение подсказки автодополнения: выбранный трэк проигрывается по идентификатору, без повторного поиска
+SUGGESTION_PREFIX = "vk:"
+SUGGESTION_LIMIT = 10
+
+SEARCH_RESULTS = 5
+
+# Трэк, до конца которого при восстановлении оставалось меньше этого числа секунд, не перезапускается
+RESUME_SKIP_TAIL = 5
+
+
 def seconds_to_time(seconds: int) -> str:
     """Превращает секунды в строку"""
     m, s = divmod(seconds, 60)
@@ -32,36 +65,66 @@ def seconds_to_time(seconds: int) -> str:
         return f"{m:02d}:{s:02d}"
 
 
+def time_to_seconds(text: str) -> Optional[int]:
+    """Превращает строку вида 90, 1:30 или 1:02:03 в секунды. None, если строка некорректна"""
+    parts = text.strip().split(":")
+    if len(parts) > 3 or not all(part.isdigit() for part in parts):
+        return None
+
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def progress_bar(position: float, duration: int, width: int = 16) -> str:
+    """Полоса прогресса трэка"""
+    filled = int(width * position / duration) if duration else 0
+    return "▬" * filled + "🔘" + "▬" * (width - filled)
+
+
 class StartingToPlayEmbed(discord.Embed):
-    """Embed запуска проигрывателя"""
+    """Embed запуска проигрывателя. Редактируется по ходу трэка, показывая прогресс"""
 
-    def __init__(self, ctx: discord.ApplicationContext, song: Song, *args, **kwargs):
+    def __init__(self,
+                 song: Song,
+                 requester: discord.abc.User,
+                 position: float = 0.0,
+                 upcoming: int = 0,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.title = "ВКонтакте | Запуск"
         self.color = discord.Color.dark_red()
 
         self.add_field(name="Трэк:", value=f"`{song.artist} - {song.title}`")
-        self.add_field(name="Запрос от:", value=f"{ctx.author.mention}")
+        self.add_field(name="Запрос от:", value=f"{requester.mention}")
         self.add_field(name="Длительность:", value=f"{seconds_to_time(song.duration)}.")
+        self.add_field(name="Прогресс:",
+                       value=f"{progress_bar(position, song.duration)} "
+                             f"`{seconds_to_time(int(position))} / {seconds_to_time(song.duration)}`",
+                       inline=False)
+        if upcoming:
+            self.add_field(name="Далее в очереди:", value=f"`{upcoming}`")
 
 
 class QueueEmbed(discord.Embed):
     """Embed для списка очереди трэков"""
 
-    def __init__(self, queue: List[Song], *args, **kwargs):
+    def __init__(self, queue: SongQueue, pending: int = 0, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.title = f"Очередь | Всего: `{len(queue)}`"
+        if pending:
+            self.title += f" | Подгружается: `{pending}`"
         self.color = discord.Color.dark_red()
 
         self._add_fields(queue)
 
-    def _add_fields(self, elements: list[Song]):
+    def _add_fields(self, queue: SongQueue):
         """Добавляет поля с трэками в Embed"""
-        _elements = elements[:25] if len(elements) > 25 else elements
-        for i, song in enumerate(_elements):
+        for i, song in enumerate(queue.slice(0, 25)):
             if i == 24:
-                self.add_field(name=f"`И ещё {len(elements) - 25}`...", value="", inline=False)
+                self.add_field(name=f"`И ещё {len(queue) - 24}`...", value="", inline=False)
                 return
             self.add_field(name=f"`#{i + 1}`", value=f"`{song.artist} - {song.title}`", inline=False)
 
@@ -102,9 +165,10 @@ class SearchView(discord.ui.View):
 
     def __init__(self,
                  ctx: discord.ApplicationContext,
-                 queue: List[Song],
+                 session: GuildSession,
                  songs: List[Song],
                  _play_next,
+                 _release,
                  *args,
                  **kwargs
                  ):
@@ -115,8 +179,9 @@ class SearchView(discord.ui.View):
         self._ctx = ctx
         self._message = ctx.message
         self._songs = songs
-        self._queue = queue
+        self._session = session
         self._play_next = _play_next
+        self._release = _release
 
         for i, song in enumerate(self._songs):
             self.add_item(SearchVariantButton(label=f"{i + 1}",
@@ -125,69 +190,347 @@ class SearchView(discord.ui.View):
                                               callback_=self.btn_callback))
 
     async def on_timeout(self):
-        """Выходит с голосового канала если трэк не выбран и бот не проигрывает трэки"""
-        if self._ctx.voice_client and not self._ctx.voice_client.is_playing():
-            await self._ctx.voice_client.disconnect(force=True)
+        """Отпускает голосовой канал, если трэк не выбран и бот ничего не проигрывает"""
+        if self._session.is_idle:
+            self._release(self._session)
 
         self.disable_all_items()
         await self._message.edit(view=self)
 
     async def btn_callback(self, song: Song):
         """Callback для кнопки выбора трэка"""
-        self._queue.append(song)
+        self._session.queue.append(song)
 
-        if self._ctx.voice_client and self._ctx.voice_client.is_playing():
+        if self._session.is_playing:
             await self._ctx.respond(f"**Добавлено в очередь `{song.artist} - {song.title}`. "
-                                    f"Трэков впереди: `{len(self._queue)}`**")
+                                    f"Трэков впереди: `{len(self._session.queue)}`**")
 
-        await self._play_next(self._ctx)
+        await self._play_next(self._session)
 
         self.disable_all_items()
 
 
+async def song_autocomplete(ctx: discord.AutocompleteContext) -> List[discord.OptionChoice]:
+    """Подсказки трэков для опции song команды /play"""
+    songs = await ctx.cog.autocomplete.suggest(ctx.interaction.user.id, ctx.value or "", SUGGESTION_LIMIT)
+
+    return [discord.OptionChoice(name=f"{song.artist} - {song.title} ({seconds_to_time(song.duration)})"[:100],
+                                 value=SUGGESTION_PREFIX + song.full_id)
+            for song in songs]
+
+
 class MusicCog(commands.Cog):
     """Cog музыкального плеера"""
 
     def __init__(self, bot_: discord.Bot):
         self._bot = bot_
-        self._vk_search = VKMusicSearch(KateMobile, AccessCredentials)
-        self._queue: List[Song] = []
+        self._vk_search = VKMusicSearch(KateMobile, VKAccounts, VKAccessTokens)
+        self._sessions = SessionRegistry(idle_timeout=SESSION_IDLE_TIMEOUT, setup=self._setup_session)
+        self._voice = VoiceManager(grace=VOICE_IDLE_GRACE)
+
+        pool = TranscodePool(max_jobs=TRANSCODE_MAX_JOBS)
+        loudness = LoudnessMeter(LOUDNESS_DB_PATH,
+                                 target=LOUDNESS_TARGET,
+                                 max_gain=LOUDNESS_MAX_GAIN,
+                                 pool=pool) if LOUDNESS_DB_PATH else None
+        disk_cache = None
+        if DISK_CACHE_DIR:
+            # Процессы лаунчера не делят каталог кэша: вытеснение и недописанные файлы у каждого свои
+            directory = DISK_CACHE_DIR if PROCESS_COUNT == 1 else os.path.join(DISK_CACHE_DIR, f"p{PROCESS_INDEX}")
+            disk_cache = OpusDiskCache(directory, DISK_CACHE_MAX_MB * 2 ** 20 // PROCESS_COUNT,
+                                       pool=pool, loudness=loudness)
+        self._sources = SourceFactory(disk_cache=disk_cache, pool=pool, http=lambda: self._vk_search.session,
+                                      loudness=loudness)
+
+        self._library = LibraryStore(LIBRARY_DB_PATH,
+                                     flush_interval=LIBRARY_FLUSH_INTERVAL,
+                                     batch_size=LIBRARY_BATCH_SIZE) if LIBRARY_DB_PATH else None
+
+        self._journal = QueueJournal(QUEUE_JOURNAL_DIR,
+                                     flush_interval=QUEUE_JOURNAL_FLUSH_INTERVAL,
+                                     compact_after=QUEUE_JOURNAL_COMPACT_AFTER,
+                                     touch_interval=QUEUE_JOURNAL_TOUCH_INTERVAL) if QUEUE_JOURNAL_DIR else None
+        self._unrestored: Set[int] = set()
+        self._restoring: Dict[int, asyncio.Task] = {}
+        self._restore_task: Optional[asyncio.Task] = None
+
+        self._suggestions = SuggestionIndex(maxsize=SUGGEST_INDEX_SIZE)
+        self._autocomplete = Autocompleter(self._suggestions,
+                                           search=lambda query, count: self._vk_search.all(query, count=count),
+                                           debounce=AUTOCOMPLETE_DEBOUNCE,
+                                           deadline=AUTOCOMPLETE_DEADLINE,
+                                           rate=AUTOCOMPLETE_RATE)
+
+        self._register_gauges()
+
+    def _register_gauges(self):
+        """Значения для метрик, вычисляемые при чтении"""
+        METRICS.gauge("bulbex_sessions", "Сессии проигрывателя", lambda: len(self._sessions))
+        METRICS.gauge("bulbex_voice_playing", "Голосовые клиенты, проигрывающие трэк",
+                      lambda: sum(session.is_playing for session in self._sessions))
+        METRICS.gauge("bulbex_queue_depth", "Трэки во всех очередях",
+                      lambda: sum(len(session.queue) for session in self._sessions))
+        METRICS.gauge("bulbex_ffmpeg_running", "Запущенные процессы ffmpeg", lambda: self._sources.pool.running)
+        METRICS.gauge("bulbex_ffmpeg_waiting", "Задачи ffmpeg в очереди пула", lambda: self._sources.pool.waiting)
+        METRICS.gauge("bulbex_vk_pending", "Вызовы VK API, ожидающие отправки",
+                      lambda: self._vk_search.scheduler.stats()["pending"])
+        METRICS.gauge("bulbex_vk_tokens_healthy", "Исправные токены ВКонтакте",
+                      lambda: sum(token["healthy"] for token in self._vk_search.tokens.stats()))
+
+    @property
+    def vk_search(self) -> VKMusicSearch:
+        return self._vk_search
+
+    @property
+    def autocomplete(self) -> Autocompleter:
+        return self._autocomplete
+
+    @property
+    def library(self) -> Optional[LibraryStore]:
+        return self._library
+
+    @property
+    def sources(self) -> SourceFactory:
+        return self._sources
+
+    @property
+    def sessions(self) -> SessionRegistry:
+        return self._sessions
+
+    def cog_unload(self):
+        self._stop_background()
+
+    async def close(self):
+        """Останавливает фоновые задачи и закрывает соединения с ВКонтакте. Вызывается при остановке бота"""
+        self._stop_background()
+        await self._voice.close()
+        if self._journal:
+            await self._journal.close()
+        if self._library:
+            await self._library.close()
+        await self._vk_search.close()
+
+    def _stop_background(self):
+        self._evict_sessions.cancel()
+        if self._restore_task:
+            self._restore_task.cancel()
+        self._sources.pool.stop()
+        if self._sources.disk_cache:
+            self._sources.disk_cache.stop()
+        if self._sources.loudness:
+            self._sources.loudness.stop()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Открывает соединения с ВКонтакте и запускает фоновые задачи"""
+        await self._vk_search.start()
+
+        if not self._evict_sessions.is_running():
+            self._evict_sessions.start()
+
+        self._sources.pool.start()
+        if self._sources.disk_cache:
+            self._sources.disk_cache.start()
+        if self._sources.loudness:
+            self._sources.loudness.start()
+
+        if self._library:
+            self._library.start()
+            if not len(self._suggestions):
+                # Подсказки после перезапуска начинаются с самых проигрываемых трэков
+                self._suggestions.add(self._library.most_played(SUGGEST_INDEX_SIZE)[::-1])
+
+        if self._journal:
+            self._journal.start()
+            # on_ready приходит и после переподключения к шлюзу, восстановление нужно только после запуска
+            if self._restore_task is None:
+                self._restore_task = self._bot.loop.create_task(self._restore_all())
+
+    @commands.Cog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        """Восстанавливает сессию гильдии, которая была недоступна при запуске"""
+        if self._journal and self._restore_task:
+            self._claim_restore(guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        """Удаляет журнал гильдии, из которой бота удалили до восстановления её сессии"""
+        if self._journal and guild.id in self._unrestored:
+            self._unrestored.discard(guild.id)
+            self._journal.drop(guild.id)
+
+    @tasks.loop(seconds=SESSION_EVICT_INTERVAL)
+    async def _evict_sessions(self):
+        """Удаляет сессии гильдий, простаивающие дольше SESSION_IDLE_TIMEOUT"""
+        for session in self._sessions.evict_idle():
+            if session.panel:
+                session.panel.stop()
+            await self._voice.leave(session.guild)
+
+            if self._journal:
+                self._journal.drop(session.guild_id)
+
+            logger.info(f"{session.guild.name} | Сессия проигрывателя вытеснена по простою.")
+
+    async def _restore_all(self):
+        """
+        Восстанавливает сохранённые в журнале сессии в фоне, не больше RESUME_CONCURRENCY одновременно.
+        Гильдия, в которой вызвали команду раньше своей очереди, восстанавливается сразу
+        """
+        loop = asyncio.get_running_loop()
+        # Каталог журнала общий для процессов лаунчера: каждый восстанавливает только гильдии своих шардов
+        shard_ids, shard_count = getattr(self._bot, "shard_ids", None), self._bot.shard_count
+        self._unrestored.update(await loop.run_in_executor(
+            None, self._journal.saved_guilds, lambda guild_id: owns_guild(guild_id, shard_ids, shard_count)))
+        logger.info(f"Журнал | Сохранённых сессий: {len(self._unrestored)}")
+
+        semaphore = asyncio.Semaphore(RESUME_CONCURRENCY)
+
+        async def restore(guild_id: int):
+            async with semaphore:
+                task = self._claim_restore(guild_id)
+                if task:
+                    await task
+
+        await asyncio.gather(*(restore(guild_id) for guild_id in list(self._unrestored)))
+
+    def _claim_restore(self, guild_id: int) -> Optional[asyncio.Task]:
+        """Запускает восстановление гильдии, если оно ещё не запущено, и возвращает его задачу"""
+        task = self._restoring.get(guild_id)
+        if task is None and guild_id in self._unrestored:
+            self._unrestored.discard(guild_id)
+            task = self._restoring[guild_id] = self._bot.loop.create_task(self._restore(guild_id))
+            task.add_done_callback(lambda _: self._restoring.pop(guild_id, None))
+        return task
+
+    async def _restore(self, guild_id: int):
+        """
+        Возвращает бота в голосовой канал и продолжает проигрывание с сохранённой позиции.
+        Журнал недоступной гильдии остаётся до on_guild_available, а удаляется только если восстанавливать нечего
+        """
+        try:
+            guild = self._bot.get_guild(guild_id)
+            if guild is None:
+                # После on_ready бот знает все свои гильдии: этой среди них нет, бота из неё удалили
+                self._journal.drop(guild_id)
+                return
+
+            if guild.unavailable:
+                # Discord ещё не прислал гильдию, восстановление продолжится в on_guild_available
+                self._unrestored.add(guild_id)
+                return
+
+            saved = await asyncio.get_running_loop().run_in_executor(None, self._journal.load, guild_id)
+
+            voice_channel = guild.get_channel(saved.voice_channel_id) if saved and saved.voice_channel_id else None
+            text_channel = guild.get_channel(saved.text_channel_id) if saved and saved.text_channel_id else None
+            listeners = voice_channel and any(not member.bot for member in voice_channel.members)
+
+            if not listeners or not text_channel or not (saved.now_playing or saved.queue):
+                self._journal.drop(guild_id)
+                return
+
+            session = self._sessions.get(guild)
+            now_playing, position = saved.now_playing, saved.position
+            if now_playing and position > now_playing.duration - RESUME_SKIP_TAIL:
+                now_playing, position = None, 0.0
+
+            session.queue.extend(saved.queue)
+            if now_playing:
+                session.queue.appendleft(now_playing)
+                session.resume_position = position
+
+            session.text_channel = text_channel
+            session.requester = guild.me
+            self._journal.attach(session)
+
+            session.voice_client = await self._voice.join(guild, voice_channel)
+            logger.info(f"{guild.name} | Сессия восстановлена. Трэков в очереди: {len(session.queue)}, "
+                        f"позиция: {seconds_to_time(int(position))}.")
+
+            await self._play_next(session)
+        except Exception as e:
+            logger.exception(e)
+
+    async def _join(self, ctx: discord.ApplicationContext) -> Optional[GuildSession]:
+        """Подключает бота к голосовому каналу автора и привязывает сессию гильдии к контексту"""
+        requestor_channel = ctx.author.voice.channel if ctx.author.voice else None
+
+        if not requestor_channel:
+            await ctx.respond("**Вы не находитесь в голосовом канале!**")
+            return None
+
+        restoring = self._claim_restore(ctx.guild.id) if self._journal else None
+        if restoring:
+            await restoring
+
+        session = self._sessions.get(ctx.guild)
+        if self._journal:
+            self._journal.attach(session)
+
+        voice_client = ctx.guild.voice_client
+        if voice_client and voice_client.is_connected() and voice_client.channel != requestor_channel \
+                and session.is_playing and any(not member.bot for member in voice_client.channel.members):
+            # Переезд оборвал бы музыку тем, кто её сейчас слушает
+            await ctx.respond(f"**Бот уже играет в канале `{voice_client.channel}`!**")
+            return None
+
+        session.voice_client = await self._voice.join(ctx.guild, requestor_channel)
+        session.text_channel = ctx.channel
+        if not session.is_playing:
+            session.requester = ctx.author
+
+        return session
 
     @commands.slash_command(name="play", description="Проигрывает музыку из ВКонтакте", guild_ids=GUILD_IDS)
-    async def play_vkontakte(self, ctx: discord.ApplicationContext, song: Option(str, "Название трэка")):
+    async def play_vkontakte(self,
+                             ctx: discord.ApplicationContext,
+                             song: Option(str, "Название трэка", autocomplete=song_autocomplete)):
         """Находит и запускает проигрывание трэка из ВКонтакте"""
         requestor_channel = ctx.author.voice.channel if ctx.author.voice else None
-        voice_client = ctx.voice_client
 
         logger.info(f"{ctx.guild.name} | Вызов /play от {ctx.author.name} в чате {ctx.channel.name}. "
                     f"{f'Голосовой канал: {requestor_channel}. ' if requestor_channel else ''}Запрос: {song}.")
 
-        if not requestor_channel:
-            await ctx.respond("**Вы не находитесь в голосовом канале!**")
+        session = await self._join(ctx)
+        if not session:
             return
 
-        if not voice_client or not voice_client.is_connected():
-            voice_client = await requestor_channel.connect()
-
-        if voice_client and voice_client.channel != requestor_channel:
-            await voice_client.disconnect(force=True)
-
         try:
-            song = await self._vk_search.first_match(query=song)
+            song = await self._resolve(song, ctx.guild.id)
         except Exception as e:
             logger.exception(e)
             await ctx.respond("**Сервис ВКонтакте сейчас не работает**")
             return
 
-        self._queue.append(song)
+        session.queue.append(song)
 
-        if voice_client.is_playing():
+        if session.is_playing:
             await ctx.respond(f"**Добавлено в очередь `{song.artist} - {song.title}`. "
-                              f"Трэков впереди: `{len(self._queue)}`**")
+                              f"Трэков впереди: `{len(session.queue)}`**")
         else:
             await ctx.respond(f"**Запрошен трэк `{song.artist} - {song.title}`**")
 
-        await self._play_next(ctx)
+        await self._play_next(session)
+
+    async def _resolve(self, query: str, guild_id: int) -> Song:
+        """Трэк по выбранной подсказке, из локальной библиотеки или первый найденный во ВКонтакте"""
+        if query.startswith(SUGGESTION_PREFIX):
+            full_id = query[len(SUGGESTION_PREFIX):]
+            song = self._suggestions.get("_".join(full_id.split("_")[:2])) or await self._vk_search.by_id(full_id)
+            if song:
+                return song
+
+        if self._library:
+            found = self._library.search(query, guild_id, limit=1)
+            if found:
+                return found[0]
+
+        song = await self._vk_search.first_match(query=query)
+        self._suggestions.add([song])
+        if self._library:
+            self._library.record([song])
+        return song
 
     @commands.slash_command(name="playlist",
                             description="Проигрывает плейлист из ВКонтакте по URL",
@@ -198,25 +541,19 @@ class MusicCog(commands.Cog):
                                  shuffle_: Option(bool, name="shuffle", description="Перемешать трэки", required=False)):
         """Запускает плейлист по URL из ВКонтакте"""
         requestor_channel = ctx.author.voice.channel if ctx.author.voice else None
-        voice_client = ctx.voice_client
 
         logger.info(f"{ctx.guild.name} | Вызов /playlist от {ctx.author.name} в чате {ctx.channel.name}. "
                     f"{f'Голосовой канал: {requestor_channel}. ' if requestor_channel else ''}Запрос: {url}.")
 
-        if not requestor_channel:
-            await ctx.respond("**Вы не находитесь в голосовом канале!**")
+        session = await self._join(ctx)
+        if not session:
             return
 
-        if not voice_client or not voice_client.is_connected():
-            voice_client = await requestor_channel.connect()
-
-        if voice_client and voice_client.channel != requestor_channel:
-            await voice_client.disconnect(force=True)
-
         await ctx.defer()
 
+        pages = self._vk_search.playlist(url, shuffle=bool(shuffle_))
         try:
-            songs, count = await self._vk_search.playlist(url)
+            songs, count = await pages.__anext__()
         except ValueError:
             await ctx.respond("**Некорректный URL.**")
             return
@@ -225,110 +562,341 @@ class MusicCog(commands.Cog):
             await ctx.respond("**Плейлист приватный или не существует.**")
             return
 
-        if shuffle_:
-            shuffle(songs)
-
-        self._queue.extend(songs)
+        # Первая страница ставится в очередь сразу, если не ждёт окончания подгрузки предыдущего плейлиста
+        session.loaders.append(PlaylistLoader(pages, total=count, buffered=songs))
+        await self._refill(session)
 
-        if voice_client.is_playing():
-            await ctx.respond(f"**Плейлист добавлен в очередь. Доступно трэков `{len(songs)}` из `{count}`. "
-                              f"Трэков впереди: `{len(self._queue)}`**")
+        if session.is_playing:
+            await ctx.respond(f"**Плейлист добавлен в очередь. Трэков в плейлисте: `{count}`. "
+                              f"Трэков впереди: `{len(session.queue) + session.pending}`**")
         else:
-            await ctx.respond(f"**Запрошен плейлист. Доступно трэков `{len(songs)}` из `{count}`**")
+            await ctx.respond(f"**Запрошен плейлист. Трэков в плейлисте: `{count}`**")
 
-        await self._play_next(ctx)
+        await self._play_next(session)
 
     @commands.slash_command(name="queue", description="Список трэков в очереди", guild_ids=GUILD_IDS)
     async def queue(self, ctx: discord.ApplicationContext):
         """Выводит трэки в очереди"""
         logger.info(f"{ctx.guild.name} | Вызов /queue от {ctx.author.name} в чате {ctx.channel.name}")
-        if len(self._queue) == 0:
+
+        session = self._sessions.find(ctx.guild.id)
+        if not session or (len(session.queue) == 0 and not session.loaders):
             await ctx.respond("**Очередь пустая.**")
             return
 
-        await ctx.respond(embed=QueueEmbed(self._queue))
+        await ctx.respond(embed=QueueEmbed(session.queue, pending=session.pending))
+
+    @commands.slash_command(name="remove", description="Убрать трэк из очереди", guild_ids=GUILD_IDS)
+    async def remove(self, ctx: discord.ApplicationContext, position: Option(int, "Номер трэка в очереди", min_value=1)):
+        """Удаляет трэк из очереди по номеру"""
+        logger.info(f"{ctx.guild.name} | Вызов /remove от {ctx.author.name} в чате {ctx.channel.name}. "
+                    f"Позиция: {position}.")
+
+        session = self._sessions.find(ctx.guild.id)
+        if not session or position > len(session.queue):
+            await ctx.respond("**В очереди нет трэка с таким номером.**")
+            return
+
+        song = session.queue.remove_at(position - 1)
+        await ctx.respond(f"**Из очереди убран `{song.artist} - {song.title}`.**")
+
+    @commands.slash_command(name="move", description="Переместить трэк в очереди", guild_ids=GUILD_IDS)
+    async def move(self,
+                   ctx: discord.ApplicationContext,
+                   source: Option(int, name="from", description="Текущий номер трэка", min_value=1),
+                   destination: Option(int, name="to", description="Новый номер трэка", min_value=1)):
+        """Перемещает трэк в очереди на другую позицию"""
+        logger.info(f"{ctx.guild.name} | Вызов /move от {ctx.author.name} в чате {ctx.channel.name}. "
+                    f"Позиции: {source} -> {destination}.")
+
+        session = self._sessions.find(ctx.guild.id)
+        if not session or source > len(session.queue):
+            await ctx.respond("**В очереди нет трэка с таким номером.**")
+            return
+
+        song = session.queue.move(source - 1, destination - 1)
+        await ctx.respond(f"**Трэк `{song.artist} - {song.title}` перемещён на позицию "
+                          f"`{min(destination, len(session.queue))}`.**")
+
+    @commands.slash_command(name="dedup", description="Убрать повторы трэков из очереди", guild_ids=GUILD_IDS)
+    async def dedup(self, ctx: discord.ApplicationContext):
+        """Удаляет повторяющиеся трэки из очереди"""
+        logger.info(f"{ctx.guild.name} | Вызов /dedup от {ctx.author.name} в чате {ctx.channel.name}")
+
+        session = self._sessions.find(ctx.guild.id)
+        if not session or len(session.queue) == 0:
+            await ctx.respond("**Очередь пустая.**")
+            return
+
+        removed = session.queue.dedup()
+        await ctx.respond(f"**Убрано повторов: `{removed}`. Трэков в очереди: `{len(session.queue)}`**")
 
     @commands.slash_command(name="search", description="Поиск музыки во ВКонтакте", guild_ids=GUILD_IDS)
     async def search_vkontakte(self, ctx: discord.ApplicationContext, song: Option(str, "Название трэка")):
         """Поиск музыки во ВКонтакте"""
         requestor_channel = ctx.author.voice.channel if ctx.author.voice else None
-        voice_client = ctx.voice_client
 
         logger.info(f"{ctx.guild.name} | Вызов /search от {ctx.author.name} в чате {ctx.channel.name}. "
                     f"{f'Голосовой канал: {requestor_channel}. ' if requestor_channel else ''}Запрос: {song}.")
 
-        if not requestor_channel:
-            await ctx.respond("**Вы не находитесь в голосовом канале!**")
+        session = await self._join(ctx)
+        if not session:
             return
 
-        if not voice_client:
-            await requestor_channel.connect()
+        await ctx.defer()
 
-        if voice_client and voice_client.channel != requestor_channel:
-            await voice_client.disconnect(force=True)
+        songs = self._library.search(song, ctx.guild.id, limit=SEARCH_RESULTS) if self._library else []
 
-        await ctx.defer()
+        if len(songs) < SEARCH_RESULTS:
+            try:
+                found = await self._vk_search.all(query=song, count=SEARCH_RESULTS)
+            except Exception as e:
+                logger.exception(e)
+                if not songs:
+                    await ctx.respond("**Очередь пуста**")
+                    return
+                found = []
 
-        try:
-            songs = await self._vk_search.all(query=song)
-        except Exception as e:
-            logger.exception(e)
-            await ctx.respond("**Очередь пуста**")
-            return
+            if self._library:
+                self._library.record(found)
+
+            # Трэки из библиотеки идут первыми, результаты ВКонтакте дополняют их
+            keys = {song_.key for song_ in songs}
+            songs = (songs + [song_ for song_ in found if song_.key not in keys])[:SEARCH_RESULTS]
 
-        await ctx.respond("", embed=SearchEmbed(songs), view=SearchView(ctx, self._queue, songs, self._play_next))
+        self._suggestions.add(songs)
+
+        await ctx.respond("", embed=SearchEmbed(songs), view=SearchView(ctx, session, songs, self._play_next, self._release))
 
     @commands.slash_command(name="skip", description="Пропустить текущий трэк", guild_ids=GUILD_IDS)
     async def skip(self, ctx: discord.ApplicationContext):
         """Пропускает текущий трэк в проигрывателе"""
         logger.info(f"{ctx.guild.name} | Вызов /skip от {ctx.author.name} в чате {ctx.channel.name}")
 
-        if not ctx.voice_client:
+        session = self._sessions.find(ctx.guild.id)
+        if not session or not session.voice_client or not session.voice_client.is_connected():
             await ctx.respond("**Бот не находится в голосовом канале!**")
             return
 
-        if ctx.voice_client and not ctx.voice_client.is_playing():
+        if not session.is_playing:
             await ctx.respond("**Очередь пуста!**")
             return
 
-        ctx.voice_client.stop()
+        session.touch()
+        session.voice_client.stop()
         await ctx.respond("**Текущий трэк пропущен.**")
 
+    @commands.slash_command(name="seek", description="Перемотать текущий трэк", guild_ids=GUILD_IDS)
+    async def seek(self,
+                   ctx: discord.ApplicationContext,
+                   time_: Option(str, name="time", description="Позиция: секунды, мм:сс или чч:мм:сс")):
+        """Перезапускает текущий трэк с указанной позиции"""
+        logger.info(f"{ctx.guild.name} | Вызов /seek от {ctx.author.name} в чате {ctx.channel.name}. "
+                    f"Позиция: {time_}.")
+
+        session = self._sessions.find(ctx.guild.id)
+        if not session or not session.voice_client or not session.voice_client.is_connected():
+            await ctx.respond("**Бот не находится в голосовом канале!**")
+            return
+
+        position = time_to_seconds(time_)
+        if position is None:
+            await ctx.respond("**Некорректная позиция. Примеры: `90`, `1:30`, `1:02:03`.**")
+            return
+
+        async with session.play_lock:
+            song = session.now_playing
+            if not session.is_playing or not song:
+                await ctx.respond("**Сейчас ничего не играет!**")
+                return
+
+            if position >= song.duration:
+                await ctx.respond(f"**Трэк длится всего `{seconds_to_time(song.duration)}`.**")
+                return
+
+            # Трэк запустится заново из _play_next: ffmpeg начнёт с позиции, не скачивая пропущенное
+            session.touch()
+            session.resume_position = float(position)
+            session.replaying = True
+            session.queue.appendleft(song)
+            session.voice_client.stop()
+
+        await ctx.respond(f"**Трэк `{song.artist} - {song.title}` перемотан на `{seconds_to_time(position)}`.**")
+
     @commands.slash_command(name="stop", description="Отключить проигрыватель", guild_ids=GUILD_IDS)
     async def stop(self, ctx: discord.ApplicationContext):
         """Отключает проигрыватель и очищает очередь"""
         logger.info(f"{ctx.guild.name} | Вызов /stop от {ctx.author.name} в чате {ctx.channel.name}")
 
-        if not ctx.voice_client:
+        session = self._sessions.find(ctx.guild.id)
+        if not session or not session.voice_client or not session.voice_client.is_connected():
             await ctx.respond("**Бот не находится в голосовом канале!**")
             return
 
-        ctx.voice_client.stop()
-        self._queue.clear()
+        await session.clear()
+        session.voice_client.stop()
         await ctx.respond("**Проигрыватель отключён.**")
 
-    async def _play_next(self, ctx: discord.ApplicationContext):
-        """Запускает проигрывание трэка из очереди"""
-        if len(self._queue) == 0:
-            if ctx.voice_client:
-                await ctx.voice_client.disconnect(force=True)
+    def _release(self, session: GuildSession):
+        """Выходит из голосового канала сессии после VOICE_IDLE_GRACE секунд простоя"""
+        self._voice.release(session.guild)
+
+    async def _refill(self, session: GuildSession):
+        """Подгружает страницы плейлистов, пока очередь сессии короче PLAYLIST_REFILL_THRESHOLD"""
+        async with session.refill_lock:
+            while session.loaders and len(session.queue) <= PLAYLIST_REFILL_THRESHOLD:
+                loader = session.loaders[0]
+                try:
+                    songs = await loader.next_page()
+                except Exception as e:
+                    logger.exception(e)
+                    songs = []
+                    await loader.close()
+
+                if loader.exhausted:
+                    session.loaders.popleft()
+
+                session.queue.extend(songs)
+                if self._library:
+                    self._library.record(songs)
+
+    def _schedule_refill(self, session: GuildSession):
+        """Запускает фоновую подгрузку плейлиста, если очередь подходит к концу"""
+        if not session.loaders or len(session.queue) > PLAYLIST_REFILL_THRESHOLD:
+            return
+
+        if session.refill_task and not session.refill_task.done():
+            return
+
+        session.refill_task = self._bot.loop.create_task(self._refill(session))
+
+    async def _refresh_links(self, session: GuildSession, song: Song):
+        """Одним audio.getById обновляет устаревшую ссылку трэка и ближайших к нему трэков очереди"""
+        if not song.is_stale:
+            return
+
+        try:
+            refreshed = await self._vk_search.refresh_links([song, *session.queue.slice(0, RESOLVE_BATCH_SIZE - 1)])
+            logger.info(f"{session.guild.name} | Обновлено ссылок на трэки: {refreshed}")
+        except Exception as e:
+            logger.exception(e)
+
+    def _setup_session(self, session: GuildSession):
+        session.queue.head_listener = lambda: self._head_changed(session)
 
-            await ctx.send("**Проигрыватель закончил свою работу.**")
+    def _head_changed(self, session: GuildSession):
+        """
+        Перезапускает подготовку следующего трэка, если голова очереди сменилась, пока играет трэк:
+        трэк добавили в пустую очередь, подгрузился плейлист, очередь перемешали или убрали следующий трэк
+        """
+        if session.replaying or not session.now_playing or not session.is_playing:
+            return
 
-            logger.info(f"{ctx.guild.name} | Сессия проигрывателя закончена.")
+        self._schedule_prefetch(session, session.now_playing, session.position)
 
+    def _schedule_prefetch(self, session: GuildSession, current: Song, position: float = 0.0):
+        """Планирует подготовку следующего трэка за PREFETCH_AHEAD секунд до конца текущего"""
+        session.cancel_prefetch()
+        if PREFETCH_AHEAD < 0:
             return
 
-        if ctx.voice_client and ctx.voice_client.is_playing():
+        delay = max(current.duration - position - PREFETCH_AHEAD, 0)
+        session.prefetch_task = self._bot.loop.create_task(self._prefetch(session, delay))
+
+    async def _prefetch(self, session: GuildSession, delay: float):
+        """Готовит источник для трэка в голове очереди, пока играет текущий"""
+        await asyncio.sleep(delay)
+
+        upcoming = session.queue.slice(0, 1)
+        if not upcoming:
             return
 
-        song = self._queue.pop(0)
+        song = upcoming[0]
+        await self._refresh_links(session, song)
 
-        logger.info(f"{ctx.guild.name} | Запущен трэк {song.artist} - {song.title} в канале {ctx.author.voice.channel}")
+        try:
+            session.prefetched = await self._sources.prepare(song, kind=JobKind.PREFETCH)
+        except Exception as e:
+            logger.exception(e)
+
+    def _now_playing(self, session: GuildSession) -> NowPlayingMessage:
+        """Сообщение о текущем трэке сессии"""
+        if session.panel is None:
+            def render() -> Optional[discord.Embed]:
+                if not session.now_playing:
+                    return None
+                return StartingToPlayEmbed(session.now_playing, session.requester,
+                                           position=session.position,
+                                           upcoming=len(session.queue) + session.pending)
+
+            session.panel = NowPlayingMessage(render,
+                                              interval=NOW_PLAYING_EDIT_INTERVAL,
+                                              progress_interval=NOW_PLAYING_PROGRESS_INTERVAL)
+        return session.panel
+
+    async def _play_next(self, session: GuildSession):
+        """Запускает проигрывание трэка из очереди сессии"""
+        async with session.play_lock:
+            try:
+                with TRACK_START_SECONDS.time():
+                    await self._start_next(session)
+            except Exception:
+                ERRORS.inc(where="play_next")
+                raise
+
+    async def _start_next(self, session: GuildSession):
+        """Извлекает трэк из очереди и запускает его. Вызывается только под session.play_lock"""
+        session.touch()
+        voice_client = session.voice_client
+
+        if len(session.queue) == 0 and session.loaders:
+            await self._refill(session)
+
+        if len(session.queue) == 0:
+            session.now_playing = None
+            session.cancel_prefetch()
+
+            self._release(session)
+
+            if session.panel:
+                session.panel.stop()
+            await session.text_channel.send("**Проигрыватель закончил свою работу.**")
+
+            if self._journal:
+                self._journal.drop(session.guild_id)
+
+            logger.info(f"{session.guild.name} | Сессия проигрывателя закончена.")
+
+            return
+
+        if session.is_playing:
+            return
 
-        ctx.voice_client.play(
-            source=discord.FFmpegOpusAudio(song.link, bitrate=BITRATE, executable=FFMPEG),
-            after=lambda _: self._bot.loop.create_task(self._play_next(ctx))
+        song = session.queue.popleft()
+        if not session.replaying:
+            self._suggestions.record_play(song)
+            if self._library:
+                self._library.record_play(session.guild_id, song)
+        session.now_playing = song
+        session.replaying = False
+        self._schedule_refill(session)
+
+        position, session.resume_position = session.resume_position, 0.0
+        source = session.take_prefetched(song) if not position else None
+        if source is None:
+            await self._refresh_links(session, song)
+            source = (await self._sources.prepare(song, warmup_packets=0, position=position)).source
+
+        logger.info(f"{session.guild.name} | Запущен трэк {song.artist} - {song.title} в канале {voice_client.channel}")
+
+        voice_client.play(
+            source=source,
+            after=lambda _: self._bot.loop.create_task(self._play_next(session))
         )
+        session.track_started = time.monotonic() - position
+        TRACKS_STARTED.inc()
+        self._schedule_prefetch(session, song, position)
+        if self._journal:
+            self._journal.playing(session, song, position)
 
-        await ctx.send(embed=StartingToPlayEmbed(ctx, song))
+        self._now_playing(session).invalidate(session.text_channel)
@@ -0,0 +1,254 @@
+"""
+Метрики бота: счётчики, гистограммы задержек и значения, вычисляемые при чтении
+"""
+import time
+import asyncio
+
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from loguru import logger
+
+from .config import METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def label_key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Счётчик событий с метками"""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    """Распределение значений по корзинам: задержки в секундах"""
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.series: Dict[Labels, List[float]] = {}  # Счётчики корзин, затем +Inf, сумма и количество
+
+    def observe(self, value: float, **labels) -> None:
+        key = label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0.0] * (len(self.buckets) + 3)
+
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def time(self, **labels) -> "Timer":
+        """Контекстный менеджер, замеряющий время блока"""
+        return Timer(self, labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля по верхним границам корзин"""
+        series = self.series.get(label_key(labels))
+        if not series or not series[-1]:
+            return None
+
+        rank, seen = q * series[-1], 0.0
+        for bound, count in zip((*self.buckets, float("inf")), series):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, series in self.series.items():
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', str(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Значение, которое вычисляется в момент чтения метрик"""
+
+    def __init__(self, name: str, description: str, read: Callable[[], float]):
+        self.name = name
+        self.description = description
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.warning(f"Метрики | {self.name}: {e}")
+            return []
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Timer:
+    """Замер времени блока кода для гистограммы"""
+
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+
+
+class NullMetric:
+    """Метрика при отключённых метриках: все вызовы ничего не делают"""
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        pass
+
+    def observe(self, value: float, **labels) -> None:
+        pass
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        return None
+
+    def time(self, **labels) -> "NullMetric":
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class Registry:
+    """Реестр метрик процесса. При enabled=False раздаёт заглушки, и инструментирование почти ничего не стоит"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.metrics: Dict[str, Any] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._register(Counter(name, description)) if self.enabled else NULL_METRIC
+
+    def histogram(self, name: str, description: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, buckets)) if self.enabled else NULL_METRIC
+
+    def gauge(self, name: str, description: str, read: Callable[[], float]) -> None:
+        if self.enabled:
+            self.metrics[name] = Gauge(name, description, read)
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+
+METRICS = Registry(enabled=METRICS_ENABLED)
+
+VK_REQUEST_SECONDS = METRICS.histogram("bulbex_vk_request_seconds", "Время вызова метода VK API")
+VK_ERRORS = METRICS.counter("bulbex_vk_errors_total", "Ошибки вызовов VK API")
+TRACK_START_SECONDS = METRICS.histogram("bulbex_track_start_seconds", "Время от конца трэка до запуска следующего")
+TRACKS_STARTED = METRICS.counter("bulbex_tracks_started_total", "Запущенные трэки")
+VOICE_CONNECT_SECONDS = METRICS.histogram("bulbex_voice_connect_seconds", "Время подключения к голосовому каналу")
+VOICE_JOINS = METRICS.counter("bulbex_voice_joins_total", "Входы в голосовой канал: новое подключение, переезд, повтор")
+ERRORS = METRICS.counter("bulbex_errors_total", "Ошибки по месту возникновения")
+HLS_SEGMENT_SECONDS = METRICS.histogram("bulbex_hls_segment_seconds", "Время скачивания сегмента HLS")
+HLS_UNDERRUNS = METRICS.counter("bulbex_hls_underruns_total", "Ожидания ffmpeg ещё не скачанного сегмента HLS")
+LOOP_STALLS = METRICS.counter("bulbex_loop_stalls_total", "Зависания event loop, пойманные сторожем")
+LOOP_LAG_SECONDS = METRICS.histogram("bulbex_loop_lag_seconds", "Опоздание event loop относительно таймера",
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+class LoopLagProbe:
+    """Замеряет опоздание event loop: насколько позже срабатывает таймер на interval секунд"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._probe())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _probe(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(loop.time() - started - self.interval, 0.0)
+            LOOP_LAG_SECONDS.observe(self.last)
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics в формате Prometheus"""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        if self._runner:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики | Эндпоинт http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, _: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
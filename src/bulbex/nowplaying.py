@@ -0,0 +1,96 @@
+"""
+Сообщение "сейчас играет", которое редактируется вместо отправки нового на каждый трэк
+"""
+import time
+import asyncio
+
+from typing import Callable, Optional
+
+import discord
+
+from loguru import logger
+
+
+class NowPlayingMessage:
+    """
+    Одно сообщение о текущем трэке на сессию.
+    Изменения только помечают сообщение устаревшим: правка уходит не чаще раза в interval
+    и показывает последнее состояние, поэтому серия быстрых пропусков стоит одного запроса.
+    Прогресс трэка обновляется по таймеру раз в progress_interval
+    """
+
+    def __init__(self,
+                 render: Callable[[], Optional[discord.Embed]],
+                 interval: float,
+                 progress_interval: float):
+        self.channel: Optional[discord.abc.Messageable] = None
+        self.message: Optional[discord.Message] = None
+        self.edits = 0
+        self.coalesced = 0
+
+        self._render = render
+        self._interval = interval
+        self._progress_interval = progress_interval
+        self._dirty = False
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._progress_task: Optional[asyncio.Task] = None
+
+    def invalidate(self, channel: Optional[discord.abc.Messageable] = None) -> None:
+        """Отмечает сообщение устаревшим. Новый канал означает новое сообщение в нём"""
+        if channel is not None and channel != self.channel:
+            self.channel = channel
+            self.message = None
+
+        if self._dirty:
+            self.coalesced += 1
+        self._dirty = True
+
+        loop = asyncio.get_event_loop()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush())
+        if self._progress_interval > 0 and (self._progress_task is None or self._progress_task.done()):
+            self._progress_task = loop.create_task(self._progress())
+
+    def stop(self) -> None:
+        """Останавливает обновления. Сообщение остаётся в канале"""
+        for task in (self._flush_task, self._progress_task):
+            if task and not task.done():
+                task.cancel()
+        self._flush_task = self._progress_task = None
+        self._dirty = False
+
+    async def _flush(self) -> None:
+        while self._dirty:
+            delay = self._last_edit + self._interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self._dirty = False
+            self._last_edit = time.monotonic()
+
+            embed = self._render()
+            if embed is None or self.channel is None:
+                continue
+
+            try:
+                await self._show(embed)
+            except discord.HTTPException as e:
+                logger.warning(f"Сообщение проигрывателя | Не удалось обновить: {e}")
+
+    async def _show(self, embed: discord.Embed) -> None:
+        if self.message:
+            try:
+                await self.message.edit(embed=embed)
+                self.edits += 1
+                return
+            except discord.NotFound:
+                # Сообщение удалили, отправляем заново
+                self.message = None
+
+        self.message = await self.channel.send(embed=embed)
+
+    async def _progress(self) -> None:
+        while True:
+            await asyncio.sleep(self._progress_interval)
+            self.invalidate()
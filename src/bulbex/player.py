@@ -0,0 +1,234 @@
+"""
+Источники звука для проигрывателя
+"""
+import time
+import asyncio
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Optional, Tuple
+
+import discord
+
+from aiohttp import ClientSession
+
+from loguru import logger
+
+from .hls import HLSStream
+from .loudness import LoudnessMeter, volume_filter
+from .vkmusic import Song, is_hls
+from .diskcache import OpusDiskCache
+from .transcode import JobKind, TranscodeJob, TranscodePool
+from .config import FFMPEG, BITRATE, FFMPEG_BEFORE_OPTIONS, PREFETCH_WARMUP_PACKETS, HLS_READ_AHEAD, HLS_SEGMENT_RETRIES
+
+
+class WarmSource(discord.AudioSource):
+    """
+    Источник с заранее прочитанными пакетами.
+    Первые пакеты читаются до переключения трэка, поэтому запуск ffmpeg, TLS-рукопожатие с CDN ВКонтакте
+    и начальная буферизация происходят, пока играет предыдущий трэк.
+    Закрытие источника освобождает его слот в пуле ffmpeg
+    """
+
+    def __init__(self,
+                 source: discord.FFmpegOpusAudio,
+                 job: Optional[TranscodeJob] = None,
+                 pool: Optional[TranscodePool] = None,
+                 stream: Optional[HLSStream] = None):
+        self._source = source
+        self._buffer: Deque[bytes] = deque()
+        self._job = job
+        self._pool = pool
+        self._stream = stream
+
+        process = getattr(source, "_process", None)
+        if job and process:
+            job.pid = process.pid
+            # Подготовку заранее проигрывание может вытеснить: источник тогда не используется
+            job.preempt = process.kill
+
+    @property
+    def preempted(self) -> bool:
+        return bool(self._job and self._job.preempted)
+
+    def promote(self) -> None:
+        """Отмечает подготовленный заранее источник как проигрываемый"""
+        if self._job:
+            self._job.kind = JobKind.PLAYBACK
+
+    def warmup(self, packets: int) -> None:
+        """Читает первые пакеты источника. Блокирующий вызов, выполняется в executor"""
+        for _ in range(packets):
+            packet = self._source.read()
+            if not packet:
+                break
+            self._buffer.append(packet)
+
+    def read(self) -> bytes:
+        if self._buffer:
+            return self._buffer.popleft()
+        return self._source.read()
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self) -> None:
+        # Вызывается и из потока проигрывателя discord, поэтому слот освобождается через release_threadsafe
+        self._buffer.clear()
+        if self._job:
+            self._job.sample()
+        self._source.cleanup()
+        if self._stream:
+            self._stream.close()
+        if self._job and self._pool:
+            self._pool.release_threadsafe(self._job)
+
+
+class PreparedSource:
+    """Подготовленный заранее источник для конкретного трэка"""
+
+    def __init__(self, song: Song, source: WarmSource):
+        self.song = song
+        self.source = source
+        self.created_at = time.monotonic()
+
+
+class SourceFactory:
+    """
+    Создаёт источники звука для трэков: из кэша на диске без перекодирования или по ссылке ВКонтакте.
+    HLS-ссылки при заданном http скачиваются HLSStream через общий пул соединений, а не самим ffmpeg.
+    С loudness к трэкам по ссылке применяется статическое усиление, а неизмеренные трэки ставятся на измерение
+    """
+
+    def __init__(self,
+                 disk_cache: Optional[OpusDiskCache] = None,
+                 pool: Optional[TranscodePool] = None,
+                 http: Optional[Callable[[], Optional[ClientSession]]] = None,
+                 loudness: Optional[LoudnessMeter] = None):
+        self.disk_cache = disk_cache
+        self.pool = pool
+        self.http = http
+        self.loudness = loudness
+        # Прогрев блокирует поток до первых пакетов ffmpeg. В общем executor одновременные прогревы
+        # занимали бы все потоки и задерживали всё остальное, что в нём выполняется. Фоновых подготовок
+        # не больше max_jobs, так что проигрыванию всегда остаётся не меньше max_jobs потоков
+        self._executor = ThreadPoolExecutor(max_workers=2 * pool.max_jobs if pool else None,
+                                            thread_name_prefix="ffmpeg")
+
+    def _gain(self, song: Song, cached: Optional[str]) -> Optional[float]:
+        """Усиление для трэка по ссылке. В кэше на диске усиление уже записано в файл"""
+        if cached or not self.loudness:
+            return None
+
+        gain = self.loudness.gain(song)
+        if gain is None and not self.disk_cache:
+            # С кэшем на диске громкость измерит перекодирование в кэш, не скачивая трэк ещё раз
+            self.loudness.schedule(song)
+        return gain
+
+    def _cached_path(self, song: Song) -> Optional[str]:
+        """Путь к трэку в кэше на диске. Отсутствующий трэк ставится на перекодирование"""
+        if not self.disk_cache:
+            return None
+
+        cached = self.disk_cache.get(song)
+        if not cached:
+            self.disk_cache.schedule(song)
+        return cached
+
+    @staticmethod
+    def _spawn(song: Song,
+               cached: Optional[str],
+               position: float = 0.0,
+               stream: Optional[HLSStream] = None,
+               gain: Optional[float] = None) -> discord.FFmpegOpusAudio:
+        """
+        Запускает процесс ffmpeg с позиции position секунд и усилением gain дБ.
+        Не трогает состояние event loop, поэтому может выполняться в executor
+        """
+        seek = f"-ss {position:.2f} " if position > 0 else ""
+        volume = volume_filter(gain)
+        volume = f"-af {volume}" if volume else ""
+
+        if stream:
+            # Сегменты MPEG-TS идут подряд через stdin. Поток не перематывается, поэтому -ss стоит после -i
+            return discord.FFmpegOpusAudio(stream, pipe=True, bitrate=BITRATE, executable=FFMPEG,
+                                           before_options="-f mpegts", options=(seek + volume).strip() or None)
+
+        if cached:
+            # Файл уже в Ogg/Opus: ffmpeg только перепаковывает пакеты (-c:a copy)
+            return discord.FFmpegOpusAudio(cached, codec="opus", executable=FFMPEG, before_options=seek or None)
+
+        return discord.FFmpegOpusAudio(song.link,
+                                       bitrate=BITRATE,
+                                       executable=FFMPEG,
+                                       before_options=seek + FFMPEG_BEFORE_OPTIONS,
+                                       options=volume or None)
+
+    async def prepare(self,
+                      song: Song,
+                      warmup_packets: int = PREFETCH_WARMUP_PACKETS,
+                      kind: JobKind = JobKind.PLAYBACK,
+                      position: float = 0.0) -> PreparedSource:
+        """Занимает слот в пуле ffmpeg, запускает ffmpeg для трэка и дожидается первых пакетов, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        job = await self.pool.acquire(kind, f"{song.artist} - {song.title}") if self.pool else None
+
+        cached = self._cached_path(song)
+        try:
+            stream, position = await self._open_hls(song, cached, position)
+        except BaseException:
+            self._release(job)
+            raise
+
+        creating = loop.run_in_executor(self._executor, self._spawn, song, cached, position, stream, self._gain(song, cached))
+        try:
+            source = WarmSource(await asyncio.shield(creating), job=job, pool=self.pool, stream=stream)
+        except asyncio.CancelledError:
+            # ffmpeg всё равно будет запущен в executor, его нужно закрыть
+            creating.add_done_callback(lambda future: future.exception() is None and future.result().cleanup())
+            if stream:
+                stream.close()
+            self._release(job)
+            raise
+        except Exception:
+            if stream:
+                stream.close()
+            self._release(job)
+            raise
+
+        try:
+            await loop.run_in_executor(self._executor, source.warmup, warmup_packets)
+        except BaseException:
+            source.cleanup()
+            raise
+
+        logger.debug(f"Подготовлен источник для {song.artist} - {song.title}")
+        return PreparedSource(song, source)
+
+    async def _open_hls(self,
+                        song: Song,
+                        cached: Optional[str],
+                        position: float) -> Tuple[Optional[HLSStream], float]:
+        """
+        Открывает HLSStream для HLS-ссылки. Возвращает поток и позицию, которую остаётся пропустить ffmpeg.
+        Если плейлист не открылся, ссылку как раньше читает сам ffmpeg
+        """
+        session = self.http() if self.http else None
+        if cached or not session or HLS_READ_AHEAD <= 0 or not is_hls(song.link):
+            return None, position
+
+        stream = HLSStream(song.link, session, read_ahead=HLS_READ_AHEAD, retries=HLS_SEGMENT_RETRIES)
+        try:
+            return stream, await stream.open(position)
+        except asyncio.CancelledError:
+            stream.close()
+            raise
+        except Exception as e:
+            stream.close()
+            logger.warning(f"HLS | Не удалось открыть плейлист {song.artist} - {song.title}, читает ffmpeg: {e!r}")
+            return None, position
+
+    def _release(self, job: Optional[TranscodeJob]) -> None:
+        if job and self.pool:
+            self.pool.release(job)
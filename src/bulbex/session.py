@@ -0,0 +1,187 @@
+"""
+Сессии проигрывателя по гильдиям
+"""
+import time
+import asyncio
+
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Iterator, Tuple
+
+import discord
+
+from .vkmusic import Song
+from .songqueue import SongQueue
+from .player import PreparedSource
+
+
+class PlaylistLoader:
+    """Постраничная подгрузка плейлиста в очередь сессии"""
+
+    def __init__(self, pages: AsyncIterator[Tuple[List[Song], int]], total: int, buffered: Optional[List[Song]] = None):
+        self.total = total
+        self.loaded = 0
+        self.exhausted = False
+        self._pages = pages
+        self._buffered = buffered
+
+    @property
+    def pending(self) -> int:
+        """Примерное количество ещё не загруженных трэков"""
+        return max(self.total - self.loaded, 0)
+
+    async def next_page(self) -> List[Song]:
+        """Возвращает следующую страницу трэков или пустой список, если плейлист закончился"""
+        if self._buffered is not None:
+            songs, self._buffered = self._buffered, None
+        else:
+            try:
+                songs, _ = await self._pages.__anext__()
+            except StopAsyncIteration:
+                self.exhausted = True
+                return []
+
+        self.loaded += len(songs)
+        return songs
+
+    async def close(self) -> None:
+        """Закрывает генератор страниц"""
+        self.exhausted = True
+        await self._pages.aclose()
+
+
+class GuildSession:
+    """Состояние проигрывателя одной гильдии"""
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        self.queue = SongQueue()
+        self.voice_client: Optional[discord.VoiceClient] = None
+        self.text_channel: Optional[discord.abc.Messageable] = None
+        self.requester: Optional[discord.abc.User] = None
+        self.now_playing: Optional[Song] = None
+        self.loaders: Deque[PlaylistLoader] = deque()
+        self.refill_task: Optional[asyncio.Task] = None
+        self.refill_lock = asyncio.Lock()
+        self.play_lock = asyncio.Lock()
+        self.prefetched: Optional[PreparedSource] = None
+        self.prefetch_task: Optional[asyncio.Task] = None
+        self.resume_position = 0.0  # Позиция, с которой запустится следующий трэк после восстановления или перемотки
+        self.replaying = False  # Следующий трэк — текущий, перезапущенный перемоткой, а не новое прослушивание
+        self.track_started = time.monotonic()  # Момент, соответствующий началу текущего трэка
+        self.panel = None  # NowPlayingMessage, создаётся при первом трэке
+        self.last_active = time.monotonic()
+
+    @property
+    def guild_id(self) -> int:
+        return self.guild.id
+
+    @property
+    def is_playing(self) -> bool:
+        """Проигрывает ли сессия трэк прямо сейчас"""
+        return bool(self.voice_client and self.voice_client.is_connected() and self.voice_client.is_playing())
+
+    @property
+    def is_idle(self) -> bool:
+        """Сессия ничего не проигрывает и очередь пуста"""
+        return not self.is_playing and len(self.queue) == 0 and not self.loaders
+
+    @property
+    def position(self) -> float:
+        """Секунды от начала текущего трэка"""
+        if not self.now_playing:
+            return 0.0
+        return min(time.monotonic() - self.track_started, float(self.now_playing.duration))
+
+    @property
+    def pending(self) -> int:
+        """Количество трэков плейлистов, ещё не загруженных в очередь"""
+        return sum(loader.pending for loader in self.loaders)
+
+    def take_prefetched(self, song: Song) -> Optional[discord.AudioSource]:
+        """Забирает заранее подготовленный источник, если он подготовлен именно для этого трэка"""
+        prefetched, self.prefetched = self.prefetched, None
+        if prefetched is None:
+            return None
+
+        if prefetched.song is not song or prefetched.source.preempted:
+            prefetched.source.cleanup()
+            return None
+
+        prefetched.source.promote()
+        return prefetched.source
+
+    def cancel_prefetch(self) -> None:
+        """Останавливает подготовку следующего трэка и закрывает подготовленный источник"""
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+
+        if self.prefetched:
+            self.prefetched.source.cleanup()
+            self.prefetched = None
+
+    async def clear(self) -> None:
+        """Очищает очередь и останавливает подгрузку плейлистов"""
+        self.queue.clear()
+        self.replaying = False
+        self.cancel_prefetch()
+
+        if self.refill_task and not self.refill_task.done():
+            self.refill_task.cancel()
+        self.refill_task = None
+
+        # Ждём, пока текущая подгрузка отпустит генератор страниц, иначе его нельзя закрыть
+        async with self.refill_lock:
+            while self.loaders:
+                await self.loaders.popleft().close()
+
+    def touch(self) -> None:
+        """Отмечает активность сессии"""
+        self.last_active = time.monotonic()
+
+    def idle_for(self) -> float:
+        """Секунды с последней активности"""
+        return time.monotonic() - self.last_active
+
+
+class SessionRegistry:
+    """Реестр сессий: создаёт сессии по запросу и вытесняет простаивающие. Новая сессия передаётся в setup"""
+
+    def __init__(self, idle_timeout: float, setup: Optional[Callable[[GuildSession], None]] = None):
+        self._idle_timeout = idle_timeout
+        self._setup = setup
+        self._sessions: Dict[int, GuildSession] = {}
+
+    def get(self, guild: discord.Guild) -> GuildSession:
+        """Возвращает сессию гильдии, создавая её при необходимости"""
+        session = self._sessions.get(guild.id)
+        if session is None:
+            session = self._sessions[guild.id] = GuildSession(guild)
+            if self._setup:
+                self._setup(session)
+        session.touch()
+        return session
+
+    def find(self, guild_id: int) -> Optional[GuildSession]:
+        """Возвращает сессию гильдии, если она существует"""
+        return self._sessions.get(guild_id)
+
+    def remove(self, guild_id: int) -> Optional[GuildSession]:
+        """Удаляет сессию гильдии из реестра"""
+        return self._sessions.pop(guild_id, None)
+
+    def evict_idle(self) -> List[GuildSession]:
+        """Удаляет и возвращает сессии, простаивающие дольше idle_timeout"""
+        expired = [session for session in self._sessions.values()
+                   if session.is_idle and session.idle_for() > self._idle_timeout]
+
+        for session in expired:
+            del self._sessions[session.guild_id]
+
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self) -> Iterator[GuildSession]:
+        return iter(list(self._sessions.values()))
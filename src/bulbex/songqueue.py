@@ -0,0 +1,202 @@
+"""
+Очередь трэков с индексом по идентификатору ВКонтакте
+"""
+import random
+
+from collections import OrderedDict
+from itertools import count, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from .vkmusic import Song
+
+
+class SongQueue:
+    """
+    Очередь трэков.
+
+    Записи хранятся в OrderedDict (двусвязный список на C) под уникальными порядковыми ключами,
+    поэтому извлечение из головы и удаление записи выполняются за O(1).
+    Дополнительный индекс song.key -> ключ записи (или множество ключей для повторов)
+    даёт O(1) проверку наличия и удаление трэка.
+
+    Каждое изменение сообщается listener в виде (операция, *аргументы), чтобы его можно было записать в журнал
+    и повторить на пустой очереди при восстановлении. Смена трэка в голове очереди отдельно сообщается
+    head_listener без аргументов
+    """
+
+    def __init__(self, songs: Iterable[Song] = ()):
+        self._entries: "OrderedDict[int, Song]" = OrderedDict()
+        self._index: Dict[str, Union[int, Set[int]]] = {}
+        self._counter = count()
+        self.listener: Optional[Callable[..., None]] = None
+        self.head_listener: Optional[Callable[[], None]] = None
+        self._head: Optional[int] = None
+
+        self.extend(songs)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __iter__(self) -> Iterator[Song]:
+        return iter(self._entries.values())
+
+    def __contains__(self, item: Union[Song, str]) -> bool:
+        key = item.key if isinstance(item, Song) else item
+        return key in self._index
+
+    def append(self, song: Song) -> None:
+        """Добавляет трэк в конец очереди"""
+        self._append(song)
+        self._changed("extend", [song])
+
+    def _append(self, song: Song) -> None:
+        entry = next(self._counter)
+        self._entries[entry] = song
+
+        key = song.key
+        indexed = self._index.get(key)
+        if indexed is None:
+            self._index[key] = entry
+        elif isinstance(indexed, int):
+            self._index[key] = {indexed, entry}
+        else:
+            indexed.add(entry)
+
+    def extend(self, songs: Iterable[Song]) -> None:
+        """Добавляет трэки в конец очереди"""
+        songs = list(songs)
+        for song in songs:
+            self._append(song)
+        if songs:
+            self._changed("extend", songs)
+
+    def appendleft(self, song: Song) -> None:
+        """Добавляет трэк в начало очереди"""
+        self._append(song)
+        self._entries.move_to_end(next(reversed(self._entries)), last=False)
+        self._changed("appendleft", song)
+
+    def popleft(self) -> Song:
+        """Извлекает трэк из начала очереди"""
+        if not self._entries:
+            raise IndexError("Очередь пуста")
+
+        entry, song = self._entries.popitem(last=False)
+        self._unindex(song.key, entry)
+        self._changed("popleft")
+        return song
+
+    def slice(self, start: int, stop: int) -> List[Song]:
+        """Возвращает трэки с позиций [start, stop) без копирования всей очереди"""
+        return list(islice(self._entries.values(), start, stop))
+
+    def remove_at(self, position: int) -> Song:
+        """Удаляет трэк по позиции в очереди (с нуля)"""
+        entry = self._entry_at(position)
+        song = self._entries.pop(entry)
+        self._unindex(song.key, entry)
+        self._changed("remove_at", position)
+        return song
+
+    def remove(self, key: str) -> int:
+        """Удаляет все вхождения трэка по его ключу. Возвращает количество удалённых записей"""
+        indexed = self._index.pop(key, None)
+        if indexed is None:
+            return 0
+
+        entries = (indexed,) if isinstance(indexed, int) else indexed
+        for entry in entries:
+            del self._entries[entry]
+        self._changed("remove", key)
+        return len(entries)
+
+    def move(self, source: int, destination: int) -> Song:
+        """Перемещает трэк с позиции source на позицию destination (с нуля)"""
+        entry = self._entry_at(source)
+        destination = max(0, min(destination, len(self._entries) - 1))
+
+        # Ставим запись к ближайшему краю и проталкиваем за неё соседей, чтобы не обходить всю очередь
+        if destination < len(self._entries) - destination:
+            self._entries.move_to_end(entry, last=False)
+            before = list(islice(self._entries, 1, destination + 1))
+            for key in reversed(before):
+                self._entries.move_to_end(key, last=False)
+        else:
+            self._entries.move_to_end(entry)
+            tail = len(self._entries) - 1 - destination
+            after = list(islice(reversed(self._entries), 1, tail + 1))
+            for key in reversed(after):
+                self._entries.move_to_end(key)
+
+        self._changed("move", source, destination)
+        return self._entries[entry]
+
+    def shuffle(self) -> None:
+        """Перемешивает очередь на месте, не пересоздавая записи"""
+        entries = list(self._entries)
+        random.shuffle(entries)
+        for entry in entries:
+            self._entries.move_to_end(entry)
+        # Порядок случайный и не повторяется при восстановлении, поэтому журналу нужна вся очередь
+        self._changed("reset")
+
+    def dedup(self) -> int:
+        """Удаляет повторы трэков, оставляя первое вхождение. Возвращает количество удалённых записей"""
+        duplicated = {key for key, indexed in self._index.items() if isinstance(indexed, set)}
+        if not duplicated:
+            return 0
+
+        removed = 0
+        seen = set()
+        for entry, song in list(self._entries.items()):
+            if song.key not in duplicated:
+                continue
+
+            if song.key in seen:
+                del self._entries[entry]
+                self._unindex(song.key, entry)
+                removed += 1
+            else:
+                seen.add(song.key)
+
+        self._changed("dedup")
+        return removed
+
+    def clear(self) -> None:
+        """Очищает очередь"""
+        self._entries.clear()
+        self._index.clear()
+        self._changed("clear")
+
+    def _changed(self, operation: str, *args) -> None:
+        if self.listener:
+            self.listener(operation, *args)
+
+        head = next(iter(self._entries), None)
+        if head != self._head:
+            self._head = head
+            if self.head_listener:
+                self.head_listener()
+
+    def _entry_at(self, position: int) -> int:
+        """Возвращает ключ записи по позиции, обходя очередь с ближайшего края"""
+        size = len(self._entries)
+        if not 0 <= position < size:
+            raise IndexError("Позиция вне очереди")
+
+        if position < size // 2:
+            return next(islice(self._entries, position, None))
+        return next(islice(reversed(self._entries), size - 1 - position, None))
+
+    def _unindex(self, key: str, entry: int) -> None:
+        indexed = self._index[key]
+        if isinstance(indexed, int):
+            del self._index[key]
+            return
+
+        indexed.discard(entry)
+        if len(indexed) == 1:
+            self._index[key] = indexed.pop()
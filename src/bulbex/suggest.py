@@ -0,0 +1,204 @@
+"""
+Подсказки трэков для автодополнения /play
+"""
+import re
+import asyncio
+
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .vkmusic import Song, TokenBucket, normalize_query
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def split_words(text: str) -> List[str]:
+    """Разбивает строку на слова в нижнем регистре без знаков препинания"""
+    return WORD_PATTERN.findall(text.casefold())
+
+
+class SuggestionIndex:
+    """
+    Префиксный индекс недавно найденных и проигранных трэков.
+    Слова "исполнитель название" хранятся в отсортированном списке, поэтому поиск по префиксу — это bisect,
+    а не перебор всех трэков. При переполнении вытесняются давно не встречавшиеся трэки
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._songs: "OrderedDict[str, Song]" = OrderedDict()
+        self._words: List[Tuple[str, str]] = []
+        self._plays: Dict[str, int] = {}
+        self._seen: Dict[str, int] = {}
+        self._counter = count()
+
+    def __len__(self) -> int:
+        return len(self._songs)
+
+    def get(self, key: str) -> Optional[Song]:
+        """Трэк по идентификатору owner_id_id"""
+        return self._songs.get(key)
+
+    def add(self, songs: List[Song]) -> None:
+        """Добавляет трэки из результатов поиска"""
+        for song in songs:
+            if song.key not in self._songs:
+                for word in set(split_words(f"{song.artist} {song.title}")):
+                    insort(self._words, (word, song.key))
+
+            # Свежий объект несёт свежую ссылку
+            self._songs[song.key] = song
+            self._songs.move_to_end(song.key)
+            self._seen[song.key] = next(self._counter)
+
+        while len(self._songs) > self.maxsize:
+            self._forget(next(iter(self._songs)))
+
+    def record_play(self, song: Song) -> None:
+        """Учитывает проигрывание трэка: часто играемые трэки поднимаются в подсказках"""
+        self.add([song])
+        self._plays[song.key] = self._plays.get(song.key, 0) + 1
+
+    def search(self, query: str, limit: int) -> List[Song]:
+        """Трэки, в которых каждое слово запроса является началом какого-либо слова"""
+        words = split_words(query)
+        if not words:
+            keys = list(self._songs)
+        else:
+            # Кандидаты берутся по самому длинному слову запроса, остальные слова проверяются у кандидатов
+            longest = max(words, key=len)
+            keys = set()
+            for i in range(bisect_left(self._words, (longest, "")), len(self._words)):
+                word, key = self._words[i]
+                if not word.startswith(longest):
+                    break
+                keys.add(key)
+
+            rest = [word for word in words if word != longest]
+            if rest:
+                keys = [key for key in keys if self._matches(self._songs[key], rest)]
+
+        found = sorted(keys, key=lambda key: (self._plays.get(key, 0), self._seen[key]), reverse=True)[:limit]
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return [self._songs[key] for key in found]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "songs": len(self._songs),
+            "words": len(self._words),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def _matches(song: Song, words: List[str]) -> bool:
+        song_words = split_words(f"{song.artist} {song.title}")
+        return all(any(song_word.startswith(word) for song_word in song_words) for word in words)
+
+    def _forget(self, key: str) -> None:
+        song = self._songs.pop(key)
+        self._plays.pop(key, None)
+        self._seen.pop(key, None)
+
+        for word in set(split_words(f"{song.artist} {song.title}")):
+            i = bisect_left(self._words, (word, key))
+            if i < len(self._words) and self._words[i] == (word, key):
+                del self._words[i]
+
+
+class Autocompleter:
+    """
+    Подсказки для автодополнения: сначала из локального индекса, а при нехватке — поиском во ВКонтакте.
+    Поиск запускается только для последнего введённого пользователем запроса после паузы debounce,
+    одинаковые запросы разных пользователей объединяются, а частота поисков ограничена.
+    Ответ укладывается в deadline: не успевший поиск всё равно пополнит индекс для следующих нажатий
+    """
+
+    def __init__(self,
+                 index: SuggestionIndex,
+                 search: Callable[[str, int], Awaitable[List[Song]]],
+                 debounce: float,
+                 deadline: float,
+                 rate: float,
+                 min_length: int = 3):
+        self.index = index
+        self._search = search
+        self._debounce = debounce
+        self._deadline = deadline
+        self._bucket = TokenBucket(rate=rate, capacity=max(rate, 1))
+        self._min_length = min_length
+
+        self._latest: Dict[int, str] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        self.searches = 0
+        self.superseded = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+    async def suggest(self, user_id: int, query: str, limit: int) -> List[Song]:
+        """Подсказки для запроса пользователя"""
+        found = self.index.search(query, limit)
+        query = normalize_query(query)
+        if len(found) >= limit or len(query) < self._min_length:
+            return found
+
+        self._latest[user_id] = query
+        await asyncio.sleep(self._debounce)
+
+        if self._latest.get(user_id) != query:
+            # Пользователь продолжил печатать, этот ответ Discord уже не покажет
+            self.superseded += 1
+            return found
+        del self._latest[user_id]
+
+        task = self._inflight.get(query)
+        if task is None:
+            if not self._bucket.try_take():
+                self.throttled += 1
+                return found
+
+            task = asyncio.get_running_loop().create_task(self._fetch(query, limit))
+            self._inflight[query] = task
+
+        try:
+            songs = await asyncio.wait_for(asyncio.shield(task), self._deadline - self._debounce)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return found
+
+        keys = {song.key for song in found}
+        return (found + [song for song in songs if song.key not in keys])[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "searches": self.searches,
+            "superseded": self.superseded,
+            "throttled": self.throttled,
+            "timeouts": self.timeouts,
+            "in_flight": len(self._inflight),
+        }
+
+    async def _fetch(self, query: str, limit: int) -> List[Song]:
+        self.searches += 1
+        try:
+            songs = await self._search(query, limit)
+            self.index.add(songs)
+            return songs
+        except Exception as e:
+            logger.warning(f"Автодополнение | Ошибка поиска '{query}': {e}")
+            return []
+        finally:
+            self._inflight.pop(query, None)
@@ -0,0 +1,134 @@
+"""
+Пул токенов доступа ВКонтакте
+"""
+import time
+import asyncio
+
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional
+
+from loguru import logger
+
+# Коды ошибок VK API
+VK_AUTH_FAILED = 5
+VK_TOO_MANY_REQUESTS = 6
+VK_FLOOD_CONTROL = 9
+VK_RATE_LIMIT_REACHED = 29
+
+RATE_LIMIT_ERRORS = {VK_TOO_MANY_REQUESTS, VK_FLOOD_CONTROL, VK_RATE_LIMIT_REACHED}
+
+
+class VKToken:
+    """Токен доступа с учётом нагрузки и состояния"""
+
+    def __init__(self, label: str, value: Optional[str] = None, credentials=None):
+        self.label = label
+        self.value = value
+        self.credentials = credentials  # Логин и пароль для обновления токена, если они есть
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_error = ""
+        self.quarantined_until = 0.0
+        self.refreshing: Optional[asyncio.Task] = None
+
+    @property
+    def quarantined(self) -> bool:
+        return time.monotonic() < self.quarantined_until
+
+    @property
+    def healthy(self) -> bool:
+        return bool(self.value) and not self.quarantined
+
+
+class TokenPool:
+    """
+    Распределяет запросы по токенам нескольких аккаунтов.
+    Запрос получает наименее нагруженный исправный токен; токены, упёршиеся в ограничения VK,
+    отправляются в карантин, а отозванные токены обновляются в фоне по логину и паролю
+    """
+
+    def __init__(self,
+                 tokens: List[VKToken],
+                 refresh: Callable[[Any], Awaitable[str]],
+                 quarantine: float):
+        self.tokens = tokens
+        self._refresh = refresh
+        self._quarantine = quarantine
+
+    def start(self) -> None:
+        """Запрашивает токены для аккаунтов, у которых их ещё нет"""
+        for token in self.tokens:
+            if not token.value:
+                self.refresh(token)
+
+    async def acquire(self, exclude: Collection[VKToken] = ()) -> Optional[VKToken]:
+        """Возвращает наименее нагруженный исправный токен. Если исправных нет, дожидается обновления"""
+        while True:
+            healthy = [token for token in self.tokens if token.healthy and token not in exclude]
+            if healthy:
+                token = min(healthy, key=lambda token_: (token_.in_flight, token_.requests))
+                token.in_flight += 1
+                token.requests += 1
+                return token
+
+            for token in self.tokens:
+                if not token.value and not token.quarantined:
+                    self.refresh(token)
+
+            refreshing = [token.refreshing for token in self.tokens
+                          if token.refreshing and not token.refreshing.done() and token not in exclude]
+            if not refreshing:
+                return None
+
+            await asyncio.wait(refreshing, return_when=asyncio.FIRST_COMPLETED)
+
+    def release(self, token: VKToken, data: Optional[dict] = None) -> None:
+        """Возвращает токен в пул и разбирает ошибку ответа, если она есть"""
+        token.in_flight -= 1
+
+        error = data.get("error") if data else None
+        if not isinstance(error, dict):
+            return
+
+        token.errors += 1
+        token.last_error = f"{error.get('error_code')}: {error.get('error_msg', '')}"
+
+        if error.get("error_code") in RATE_LIMIT_ERRORS:
+            self.quarantine(token, self._quarantine)
+        elif error.get("error_code") == VK_AUTH_FAILED:
+            self.quarantine(token, self._quarantine)
+            self.refresh(token)
+
+    def quarantine(self, token: VKToken, seconds: float) -> None:
+        token.quarantined_until = max(token.quarantined_until, time.monotonic() + seconds)
+        logger.warning(f"VK | Токен {token.label} в карантине на {seconds:.0f} с. Ошибка: {token.last_error}")
+
+    def refresh(self, token: VKToken) -> None:
+        """Запускает фоновое обновление токена аккаунта"""
+        if not token.credentials or (token.refreshing and not token.refreshing.done()):
+            return
+
+        token.refreshing = asyncio.get_event_loop().create_task(self._refresh_token(token))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Нагрузка и состояние каждого токена"""
+        now = time.monotonic()
+        return [{
+            "label": token.label,
+            "healthy": token.healthy,
+            "in_flight": token.in_flight,
+            "requests": token.requests,
+            "errors": token.errors,
+            "last_error": token.last_error,
+            "quarantine": max(token.quarantined_until - now, 0.0),
+            "refreshing": bool(token.refreshing and not token.refreshing.done()),
+        } for token in self.tokens]
+
+    async def _refresh_token(self, token: VKToken) -> None:
+        try:
+            token.value = await self._refresh(token.credentials)
+            token.quarantined_until = 0.0
+            logger.info(f"VK | Токен {token.label} обновлён")
+        except Exception as e:
+            token.last_error = str(e)
+            self.quarantine(token, self._quarantine * 5)
@@ -0,0 +1,207 @@
+"""
+Общий для всех гильдий пул процессов ffmpeg
+"""
+import os
+import time
+import heapq
+import asyncio
+
+from collections import deque
+from enum import IntEnum
+from itertools import count
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 0
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    """Процессорное время процесса (user + system) в секундах по /proc. None, если недоступно"""
+    if not CLOCK_TICKS:
+        return None
+
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            stat = file.read()
+    except OSError:
+        return None
+
+    # Имя процесса в скобках может содержать пробелы, поэтому поля считаются после последней скобки
+    fields = stat[stat.rfind(b")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+class JobKind(IntEnum):
+    """Тип задачи ffmpeg. Меньшее значение — более высокий приоритет"""
+    PLAYBACK = 0
+    PREFETCH = 1
+    CACHE_FILL = 2
+    ANALYSIS = 3
+
+
+class TranscodeJob:
+    """Слот пула, занятый одним процессом ffmpeg"""
+
+    def __init__(self, kind: JobKind, label: str):
+        self.kind = kind
+        self.label = label
+        self.pid: Optional[int] = None
+        self.cpu_time = 0.0
+        self.waited = 0.0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.preempt: Optional[Callable[[], None]] = None  # Прерывает фоновую задачу ради проигрывания
+        self.preempted = False
+
+    @property
+    def wall_time(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def sample(self) -> None:
+        """Обновляет процессорное время задачи. Безопасно вызывать из любого потока"""
+        if self.pid is not None:
+            cpu_time = process_cpu_time(self.pid)
+            if cpu_time is not None:
+                self.cpu_time = cpu_time
+
+
+class TranscodePool:
+    """
+    Ограничивает число одновременно работающих процессов ffmpeg.
+    Проигрывание запускается сразу и никогда не ждёт: иначе музыка одной гильдии стояла бы, пока у других
+    не закончатся трэки. Фоновые задачи (подготовка, заполнение кэша, измерение громкости) запускаются,
+    только пока всего процессов меньше max_jobs, по приоритету JobKind. Проигрывание сверх max_jobs
+    вытесняет наименее важную фоновую задачу
+    """
+
+    def __init__(self, max_jobs: int, sample_interval: float = 2.0):
+        self.max_jobs = max_jobs
+        self.sample_interval = sample_interval
+
+        self._running: Set[TranscodeJob] = set()
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._counter = count()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sampler: Optional[asyncio.Task] = None
+
+        self._totals: Dict[JobKind, Dict[str, float]] = {
+            kind: {"jobs": 0, "cpu": 0.0, "wall": 0.0, "waited": 0.0, "preempted": 0} for kind in JobKind
+        }
+        self.recent: Deque[TranscodeJob] = deque(maxlen=20)
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def start(self) -> None:
+        """Запускает периодический замер процессорного времени задач"""
+        self._loop = asyncio.get_event_loop()
+        if self._sampler is None or self._sampler.done():
+            self._sampler = self._loop.create_task(self._sample())
+
+    def stop(self) -> None:
+        if self._sampler:
+            self._sampler.cancel()
+            self._sampler = None
+
+    async def acquire(self, kind: JobKind, label: str) -> TranscodeJob:
+        """Занимает слот пула, дожидаясь своей очереди по приоритету"""
+        self._loop = asyncio.get_running_loop()
+        requested = time.monotonic()
+
+        if kind == JobKind.PLAYBACK:
+            if len(self._running) >= self.max_jobs:
+                self._preempt_one()
+            job = self._start(kind, label)
+        elif len(self._running) < self.max_jobs and not self._waiters:
+            job = self._start(kind, label)
+        else:
+            future = self._loop.create_future()
+            heapq.heappush(self._waiters, (kind, next(self._counter), label, future))
+            try:
+                job = await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release(future.result())
+                else:
+                    self._waiters = [waiter for waiter in self._waiters if waiter[3] is not future]
+                    heapq.heapify(self._waiters)
+                raise
+
+        job.waited = time.monotonic() - requested
+        return job
+
+    def release(self, job: TranscodeJob) -> None:
+        """Освобождает слот задачи и передаёт его следующей по приоритету"""
+        if job not in self._running:
+            return
+
+        job.sample()
+        job.finished = time.monotonic()
+        self._running.discard(job)
+
+        totals = self._totals[job.kind]
+        totals["jobs"] += 1
+        totals["cpu"] += job.cpu_time
+        totals["wall"] += job.wall_time
+        totals["waited"] += job.waited
+        totals["preempted"] += job.preempted
+        self.recent.append(job)
+
+        self._wake()
+
+    def release_threadsafe(self, job: TranscodeJob) -> None:
+        """release для вызова из потока проигрывателя discord"""
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.release, job)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние пула и накопленные затраты по типам задач"""
+        for job in self._running:
+            job.sample()
+
+        running = {kind.name: 0 for kind in JobKind}
+        for job in self._running:
+            running[job.kind.name] += 1
+
+        return {
+            "max_jobs": self.max_jobs,
+            "running": running,
+            "waiting": len(self._waiters),
+            "totals": {kind.name: dict(totals) for kind, totals in self._totals.items()},
+            "active": [(job.kind.name, job.label, job.cpu_time, job.wall_time) for job in self._running],
+        }
+
+    def _start(self, kind: JobKind, label: str) -> TranscodeJob:
+        job = TranscodeJob(kind, label)
+        self._running.add(job)
+        return job
+
+    def _wake(self) -> None:
+        while self._waiters and len(self._running) < self.max_jobs:
+            kind, _, label, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(self._start(JobKind(kind), label))
+
+    def _preempt_one(self) -> None:
+        """Прерывает одну фоновую задачу, начиная с наименее важной, чтобы освободить место проигрыванию"""
+        for job in sorted(self._running, key=lambda job: job.kind, reverse=True):
+            if job.kind != JobKind.PLAYBACK and job.preempt and not job.preempted:
+                logger.debug(f"Пул ffmpeg | Вытеснена задача {job.label}")
+                job.preempted = True
+                job.preempt()
+                return
+
+    async def _sample(self) -> None:
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            for job in self._running:
+                job.sample()
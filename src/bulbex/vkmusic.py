@@ -2,20 +2,47 @@
 Поисковик музыки во ВКонтакте
 """
 import re
+import sys
+import json
+import time
+import random
 import asyncio
 
-from typing import List, Tuple
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, Iterable, List, Optional, Set, Tuple
 
 from urllib.parse import urlparse
 
 import aiohttp.web
-from aiohttp import ClientSession, TCPConnector
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from aiohttp.web import HTTPNotFound
 
-from .config import VK_LOGIN, VK_PASSWORD, VK_BYPASS_AUTH, VK_BYPASS_ACCESS_TOKEN
+from .cache import TTLCache
+from .tokenpool import TokenPool, VKToken, VK_TOO_MANY_REQUESTS
+from .metrics import VK_REQUEST_SECONDS, VK_ERRORS
+from .config import (VK_LOGIN, VK_PASSWORD, VK_BYPASS_AUTH, VK_BYPASS_ACCESS_TOKEN, VK_ACCOUNTS, VK_ACCESS_TOKENS,
+                     VK_TOKEN_QUARANTINE,
+                     SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, PLAYLIST_PAGE_SIZE,
+                     LINK_MAX_AGE, RESOLVE_BATCH_SIZE,
+                     VK_RATE_LIMIT, VK_EXECUTE_MAX_CALLS, VK_MAX_RETRIES, VK_RETRY_BACKOFF,
+                     VK_HTTP_LIMIT, VK_HTTP_LIMIT_PER_HOST, VK_HTTP_KEEPALIVE, VK_HTTP_DNS_TTL, VK_HTTP_TIMEOUT,
+                     VK_API_URL, VK_OAUTH_URL, HLS_REWRITE)
 
 PLAYLIST_ID_PATTERN = r"(?<=_)\d+(?=_)"
 PLAYLIST_OWNER_PATTERN = r"-?\d+(?=_)"
+HLS_TO_MP3_PATTERN = re.compile(r"/[0-9a-f]+(/audios)?/([0-9a-f]+)/index\.m3u8")
+
+# Минимальное количество трэков, запрашиваемое при поиске. first_match и all с одинаковым запросом
+# используют один и тот же ответ VK и, соответственно, одну запись кэша
+SEARCH_MIN_COUNT = 5
+
+# Параметры, общие для всех методов VK API
+VK_COMMON_PARAMS = [
+    ("https", 1),
+    ("lang", "ru"),
+    ("extended", 1),
+    ("v", "5.131"),
+]
 
 
 def parse_playlist_url(url: str) -> Tuple[str, str]:
@@ -35,6 +62,26 @@ def parse_playlist_url(url: str) -> Tuple[str, str]:
     raise ValueError("Переданный url некорректный.")
 
 
+def is_hls(url: str) -> bool:
+    """Ссылка на HLS-плейлист, а не на файл"""
+    return urlparse(url).path.endswith(".m3u8")
+
+
+def direct_link(url: str) -> str:
+    """
+    Ссылка на mp3 вместо HLS-плейлиста, если адрес плейлиста известного вида: .../<хэш>/<id>/index.m3u8
+    превращается в .../<id>.mp3. Остальные ссылки возвращаются как есть
+    """
+    if not HLS_REWRITE or not is_hls(url):
+        return url
+    return HLS_TO_MP3_PATTERN.sub(r"\1/\2.mp3", url, count=1)
+
+
+def normalize_query(query: str) -> str:
+    """Приводит поисковый запрос к виду для ключа кэша"""
+    return " ".join(query.casefold().split())
+
+
 class Credentials:
     """Логин и пароль для доступа во ВКонтакте"""
 
@@ -53,121 +100,457 @@ class Client:
 
 
 class Song:
-    """Трэк"""
+    """
+    Трэк. Хранится без __dict__, так как в очередях гильдий их могут быть сотни тысяч.
+    Время получения ссылки хранится в целых секундах, и трэки одного ответа VK делят один объект int
+    """
 
-    def __init__(self, artist: str, title: str, duration: int, download_link: str):
-        self.artist = artist
+    __slots__ = ("artist", "title", "duration", "link", "owner_id", "track_id", "access_key", "fetched_at")
+
+    def __init__(self, artist: str, title: str, duration: int, download_link: str,
+                 owner_id: int = 0, track_id: int = 0, access_key: str = "", fetched_at: Optional[int] = None):
+        self.artist = sys.intern(artist)
         self.title = title
         self.duration = duration
         self.link = download_link
+        self.owner_id = owner_id
+        self.track_id = track_id
+        self.access_key = access_key
+        self.fetched_at = int(time.time()) if fetched_at is None else int(fetched_at)  # Время получения ссылки
+
+    @classmethod
+    def from_item(cls, item: dict, fetched_at: Optional[int] = None) -> "Song":
+        """Создаёт трэк из объекта audio ответа VK API, полученного в момент fetched_at"""
+        return cls(artist=item["artist"],
+                   title=item["title"],
+                   duration=item["duration"],
+                   download_link=direct_link(item["url"]),
+                   owner_id=item["owner_id"],
+                   track_id=item["id"],
+                   access_key=item.get("access_key", ""),
+                   fetched_at=fetched_at)
+
+    @property
+    def key(self) -> str:
+        """Идентификатор трэка во ВКонтакте в формате owner_id_id"""
+        return f"{self.owner_id}_{self.track_id}"
+
+    @property
+    def is_stale(self) -> bool:
+        """Подписанная ссылка VK могла истечь и её нужно запросить заново"""
+        return time.time() - self.fetched_at > LINK_MAX_AGE
+
+    def update_link(self, download_link: str) -> None:
+        """Обновляет ссылку на скачивание"""
+        self.link = direct_link(download_link)
+        self.fetched_at = int(time.time())
+
+    @property
+    def full_id(self) -> str:
+        """Идентификатор трэка для audio.getById, включая access_key если он есть"""
+        if self.access_key:
+            return f"{self.key}_{self.access_key}"
+        return self.key
 
     def __repr__(self):
         return f"{self.artist} - {self.title}. Duration: {self.duration}s. Download: {self.link}"
 
 
+class TokenBucket:
+    """Ограничение частоты запросов: rate запросов в секунду с запасом capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    async def take(self) -> None:
+        """Дожидается и забирает один токен"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def try_take(self) -> bool:
+        """Забирает токен, если он есть, не дожидаясь пополнения"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+class VKRequest:
+    """Вызов метода VK API, ожидающий отправки"""
+
+    __slots__ = ("method", "params", "future", "attempt")
+
+    def __init__(self, method: str, params: List[Tuple[str, Any]], future: asyncio.Future):
+        self.method = method
+        self.params = params
+        self.future = future
+        self.attempt = 0
+
+
+def is_rate_limited(data: dict) -> bool:
+    """Ответ VK с ошибкой Too many requests per second"""
+    error = data.get("error")
+    return isinstance(error, dict) and error.get("error_code") == VK_TOO_MANY_REQUESTS
+
+
+class VKRequestScheduler:
+    """
+    Планировщик запросов к VK API.
+    Ограничивает частоту запросов для каждого токена, склеивает одинаковые запросы в полёте,
+    упаковывает накопившиеся независимые вызовы в execute до VK_EXECUTE_MAX_CALLS штук
+    и повторяет запросы, упёршиеся в Too many requests per second
+    """
+
+    def __init__(self,
+                 session: Optional[ClientSession] = None,
+                 rate: float = VK_RATE_LIMIT,
+                 max_batch: int = VK_EXECUTE_MAX_CALLS,
+                 max_retries: int = VK_MAX_RETRIES):
+        self.session = session
+        self._rate = rate
+        self._max_batch = max_batch
+        self._max_retries = max_retries
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._pending: Dict[str, Deque[VKRequest]] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        self._sending: Set[asyncio.Task] = set()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+        self.requests = 0  # HTTP-запросы к api.vk.com
+        self.calls = 0  # Вызовы методов, в том числе внутри execute
+        self.coalesced = 0
+        self.retries = 0
+
+    async def call(self, method: str, params: List[Tuple[str, Any]], access_token: str) -> dict:
+        """Вызывает метод VK API. Возвращает ответ целиком: {"response": ...} или {"error": ...}"""
+        key = (access_token, method, tuple(params))
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self._enqueue(access_token, VKRequest(method, params, future))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "pending": sum(len(pending) for pending in self._pending.values()),
+        }
+
+    async def close(self) -> None:
+        """Отменяет отправку запросов. Ожидающие ответа вызовы получают CancelledError"""
+        tasks = [*self._flushers.values(), *self._sending]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._flushers.clear()
+        self._sending.clear()
+        self._pending.clear()
+
+        for future in list(self._in_flight.values()):
+            future.cancel()
+
+    def _enqueue(self, access_token: str, request: VKRequest) -> None:
+        self._pending.setdefault(access_token, deque()).append(request)
+
+        flusher = self._flushers.get(access_token)
+        if flusher is None or flusher.done():
+            self._flushers[access_token] = asyncio.get_event_loop().create_task(self._flush(access_token))
+
+    async def _flush(self, access_token: str) -> None:
+        """Отправляет накопившиеся запросы токена, соблюдая ограничение частоты"""
+        bucket = self._buckets.setdefault(access_token, TokenBucket(self._rate, capacity=self._rate))
+        pending = self._pending[access_token]
+
+        while pending:
+            # Пока ждём токен, запросы копятся и уходят одним execute
+            await bucket.take()
+            batch = [pending.popleft() for _ in range(min(len(pending), self._max_batch))]
+            # Ссылка на задачу не даёт сборщику мусора удалить её посреди запроса
+            task = asyncio.get_running_loop().create_task(self._send(access_token, batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, access_token: str, batch: List[VKRequest]) -> None:
+        try:
+            if len(batch) == 1:
+                results = [await self._post_method(batch[0].method, batch[0].params, access_token)]
+            else:
+                results = await self._execute(batch, access_token)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        self.calls += len(batch)
+        loop = asyncio.get_running_loop()
+
+        for request, result in zip(batch, results):
+            if is_rate_limited(result) and request.attempt < self._max_retries:
+                self.retries += 1
+                request.attempt += 1
+                delay = VK_RETRY_BACKOFF * 2 ** (request.attempt - 1) * (1 + random.random())
+                loop.call_later(delay, self._enqueue, access_token, request)
+            elif not request.future.done():
+                request.future.set_result(result)
+
+    async def _execute(self, batch: List[VKRequest], access_token: str) -> List[dict]:
+        """Выполняет несколько методов одним запросом execute"""
+        code = "return [" + ",".join(f"API.{request.method}({json.dumps(dict(request.params), ensure_ascii=False)})"
+                                     for request in batch) + "];"
+        data = await self._post_method("execute", [("code", code)], access_token)
+
+        if "error" in data:
+            return [data] * len(batch)
+
+        # Неудачные вызовы возвращают false, их ошибки лежат в execute_errors по порядку
+        errors = iter(data.get("execute_errors", []))
+        results = []
+        for response in data["response"]:
+            if response is False:
+                results.append({"error": next(errors, {"error_code": 0, "error_msg": "execute call failed"})})
+            else:
+                results.append({"response": response})
+
+        return results
+
+    async def _post_method(self, method: str, params: List[Tuple[str, Any]], access_token: str) -> dict:
+        data = [("access_token", access_token), *VK_COMMON_PARAMS, *params]
+
+        self.requests += 1
+        async with self.session.post(f"{VK_API_URL}/{method}", data=data, ssl=False) as response:
+            return await response.json()
+
+
 class VKMusicSearch:
     """Поисковик трэков"""
 
-    def __init__(self, client: Client, credentials: Credentials):
+    def __init__(self, client: Client, credentials: List[Credentials], access_tokens: List[str] = ()):
         self._client = client
-        self._creds = credentials
 
-        if VK_BYPASS_AUTH and VK_BYPASS_ACCESS_TOKEN:
-            self._access_token = VK_BYPASS_ACCESS_TOKEN
-        else:
-            self._access_token = self._update_access_token()
-
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-
-        self.session = ClientSession(headers={"User-Agent": self._client.user_agent}, loop=loop)
+        tokens = [VKToken(label=f"токен #{i + 1}", value=token) for i, token in enumerate(access_tokens)]
+        tokens += [VKToken(label=creds.login, credentials=creds) for creds in credentials]
+        if not tokens:
+            raise ValueError("Не задано ни одного аккаунта или токена ВКонтакте")
+
+        self.tokens = TokenPool(tokens, refresh=self._update_access_token, quarantine=VK_TOKEN_QUARANTINE)
+
+        self.session: Optional[ClientSession] = None
+        self.scheduler = VKRequestScheduler()
+        self.search_cache: TTLCache[List[Song]] = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+    async def start(self) -> None:
+        """
+        Открывает общий пул соединений с ВКонтакте. Вызывается при запуске бота, повторный вызов ничего не делает.
+        Соединения переиспользуются между запросами (keep-alive), поэтому TLS-рукопожатие не повторяется на каждый поиск
+        """
+        if self.session and not self.session.closed:
+            return
+
+        connector = TCPConnector(limit=VK_HTTP_LIMIT,
+                                 limit_per_host=VK_HTTP_LIMIT_PER_HOST,
+                                 keepalive_timeout=VK_HTTP_KEEPALIVE,
+                                 ttl_dns_cache=VK_HTTP_DNS_TTL,
+                                 enable_cleanup_closed=True)
+
+        self.session = ClientSession(connector=connector,
+                                     headers={"User-Agent": self._client.user_agent},
+                                     timeout=ClientTimeout(total=VK_HTTP_TIMEOUT))
+        self.scheduler.session = self.session
+        self.tokens.start()
+
+    async def close(self) -> None:
+        """Закрывает пул соединений. Вызывается при остановке бота"""
+        await self.scheduler.close()
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
 
     async def first_match(self, query: str) -> Song:
         """Возвращает первый найденный трэк по запросу"""
-        response = await self._search(query, count=1)
-        content = response["response"]["items"][0]
+        songs = await self._cached_search(query, count=1)
 
-        return Song(artist=content["artist"],
-                    title=content["title"],
-                    duration=content["duration"],
-                    download_link=content["url"])
+        return songs[0]
 
     async def all(self, query: str, count: int = 5) -> List[Song]:
         """Возвращает список трэков по запросу и количеству"""
-        content = await self._search(query, count=count)
-        songs = []
+        return await self._cached_search(query, count=count)
+
+    async def by_id(self, full_id: str) -> Optional[Song]:
+        """Возвращает трэк по идентификатору owner_id_id[_access_key]"""
+        content = await self._get_by_id([full_id])
+        items = [item for item in content["response"] if item.get("url")]
+
+        return Song.from_item(items[0]) if items else None
+
+    async def _cached_search(self, query: str, count: int) -> List[Song]:
+        """Ищет трэки, используя кэш результатов по нормализованному запросу и количеству"""
+        fetch_count = max(count, SEARCH_MIN_COUNT)
+        key = (normalize_query(query), fetch_count)
+
+        songs = self.search_cache.get(key)
+        if songs is None:
+            content = await self._search(query, count=fetch_count)
+            fetched_at = int(time.time())
+            songs = [Song.from_item(item, fetched_at) for item in content["response"]["items"]]
+            if songs:
+                self.search_cache.set(key, songs)
+
+        return songs[:count]
+
+    async def playlist(self,
+                       playlist_url: str,
+                       shuffle: bool = False,
+                       page_size: int = PLAYLIST_PAGE_SIZE) -> AsyncIterator[Tuple[List[Song], int]]:
+        """
+        Постранично возвращает трэки плейлиста по url вместе с общим количеством трэков в нём.
+        Следующая страница запрашивается только когда её попросят, поэтому в памяти держится одна страница.
+        При shuffle страницы после первой запрашиваются в случайном порядке, а трэки перемешиваются внутри страницы
+        """
+        playlist_id, owner_id = parse_playlist_url(playlist_url)
+        content = await self._playlist(owner_id, playlist_id, offset=0, count=page_size)
+        initial_tracks_count = content["response"]["count"]
 
-        for item in content["response"]["items"]:
-            songs.append(Song(artist=item["artist"],
-                              title=item["title"],
-                              duration=item["duration"],
-                              download_link=item["url"]))
+        # Смещения оставшихся страниц в обратном порядке: pop() с конца выдаёт их по возрастанию
+        offsets = list(range(page_size, initial_tracks_count, page_size))[::-1]
+        if shuffle:
+            random.shuffle(offsets)
 
-        return songs
+        while True:
+            fetched_at = int(time.time())
+            songs = [Song.from_item(item, fetched_at) for item in content["response"]["items"] if item["url"]]
+            if shuffle:
+                random.shuffle(songs)
 
-    async def playlist(self, playlist_url: str) -> Tuple[List[Song], int]:
-        """Возвращает плейлист с трэками по url"""
-        playlist_id, owner_id = parse_playlist_url(playlist_url)
-        content = await self._playlist(owner_id, playlist_id)
-        initial_tracks_count = content["response"]["count"]
-        songs = []
+            yield songs, initial_tracks_count
+
+            if not offsets:
+                return
+
+            content = await self._playlist(owner_id, playlist_id, offset=offsets.pop(), count=page_size)
 
-        for item in content["response"]["items"]:
-            if not item["url"]:
-                continue
+    async def refresh_links(self, songs: Iterable[Song], batch_size: int = RESOLVE_BATCH_SIZE) -> int:
+        """
+        Обновляет устаревшие ссылки трэков через audio.getById, по batch_size трэков за запрос.
+        Возвращает количество обновлённых трэков
+        """
+        stale = {}
+        for song in songs:
+            if song.is_stale:
+                stale.setdefault(song.key, []).append(song)
 
-            songs.append(Song(artist=item["artist"],
-                              title=item["title"],
-                              duration=item["duration"],
-                              download_link=item["url"]))
+        ids = [songs_[0].full_id for songs_ in stale.values()]
+        refreshed = 0
 
-        return songs, initial_tracks_count
+        for start in range(0, len(ids), batch_size):
+            content = await self._get_by_id(ids[start:start + batch_size])
+            for item in content["response"]:
+                if not item.get("url"):
+                    continue
 
-    async def _update_access_token(self) -> None:
-        """Обновляет токен доступа"""
-        content = await self._request_auth()
-        if "error" in content.keys() and "Flood control" in content["error"]:
+                for song in stale.get(f"{item['owner_id']}_{item['id']}", ()):
+                    song.update_link(item["url"])
+                    refreshed += 1
+
+        return refreshed
+
+    async def _call(self, method: str, params: List[Tuple[str, Any]]) -> dict:
+        """Вызывает метод VK API, учитывая время вызова и ошибки в метриках"""
+        await self.start()
+
+        try:
+            with VK_REQUEST_SECONDS.time(method=method):
+                data = await self._call_balanced(method, params)
+        except Exception:
+            VK_ERRORS.inc(method=method, code="exception")
+            raise
+
+        if isinstance(data.get("error"), dict):
+            VK_ERRORS.inc(method=method, code=data["error"].get("error_code"))
+        return data
+
+    async def _call_balanced(self, method: str, params: List[Tuple[str, Any]]) -> dict:
+        """
+        Вызывает метод через наименее нагруженный исправный токен.
+        При ограничении частоты или ошибке авторизации запрос повторяется на следующем токене
+        """
+        tried = []
+        last_data: Optional[dict] = None  # Ответ последнего токена, ушедшего в карантин
+        while True:
+            token = await self.tokens.acquire(exclude=tried)
+            if token is None:
+                if last_data is not None:
+                    return last_data
+                raise aiohttp.web.HTTPServiceUnavailable(text="Нет доступных токенов ВКонтакте")
+
+            data = None
+            try:
+                data = await self.scheduler.call(method, params, token.value)
+            finally:
+                self.tokens.release(token, data)
+
+            if not token.quarantined:
+                return data
+
+            tried.append(token)
+            last_data = data
+
+    async def _update_access_token(self, credentials: Credentials) -> str:
+        """Запрашивает новый токен доступа для аккаунта"""
+        content = await self._request_auth(credentials)
+        if "error" in content.keys() and "Flood control" in content.get("error_description", content["error"]):
             raise aiohttp.web.HTTPException(text="Bruteforce error. "
                                                  "Слишком много запросов на верификацию, "
                                                  "лучше попробовать позже.")
 
-        self._access_token = ["access_token"]
+        if "access_token" not in content:
+            raise aiohttp.web.HTTPException(text=f"Ошибка авторизации: {content.get('error_description', content)}")
 
-    async def _playlist(self, owner_id: str, playlist_id: str):
-        """Запрашивает плейлист по id пользователя и id плейлиста"""
-        if not self._access_token:
-            await self._update_access_token()
+        return content["access_token"]
 
+    async def _playlist(self, owner_id: str, playlist_id: str, offset: int, count: int):
+        """Запрашивает страницу плейлиста по id пользователя и id плейлиста"""
         params = [
-            ("access_token", self._access_token),
-            ("https", 1),
-            ("lang", "ru"),
-            ("extended", 1),
-            ("v", "5.131"),
-            ("count", "1000"),
+            ("count", count),
+            ("offset", offset),
             ("owner_id", owner_id),
             ("album_id", playlist_id)
         ]
 
-        async with self.session.post(f"https://api.vk.com/method/audio.get", data=params, ssl=False) as response:
-            data = await response.json()
-            if "error" in data.keys():
-                raise HTTPNotFound()
-            return data
+        data = await self._call("audio.get", params)
+        if "error" in data.keys():
+            raise HTTPNotFound()
+        return data
 
     async def _search(self, query: str, count: int):
         """Запрашивает трэки"""
-        if not self._access_token:
-            await self._update_access_token()
-
         params = [
-            ("access_token", self._access_token),
-            ("https", 1),
-            ("lang", "ru"),
-            ("extended", 1),
-            ("v", "5.131"),
             ("q", query),
             ("count", count),
             ("offset", 0),
@@ -175,24 +558,34 @@ class VKMusicSearch:
             ("autocomplete", 1)
         ]
 
-        async with self.session.post(f"https://api.vk.com/method/audio.search", data=params, ssl=False) as response:
-            return await response.json()
+        return await self._call("audio.search", params)
 
-    async def _request_auth(self):
+    async def _get_by_id(self, audios: List[str]):
+        """Запрашивает трэки по идентификаторам owner_id_id[_access_key]"""
+        params = [
+            ("audios", ",".join(audios)),
+        ]
+
+        data = await self._call("audio.getById", params)
+        if "error" in data.keys():
+            raise HTTPNotFound()
+        return data
+
+    async def _request_auth(self, credentials: Credentials):
         """Запрашивает OAuth ВКонтакте"""
         params = [
             ("grant_type", "password"),
             ("client_id", self._client.client_id),
             ("client_secret", self._client.client_secret),
-            ("username", self._creds.login),
-            ("password", self._creds.password),
+            ("username", credentials.login),
+            ("password", credentials.password),
             ("scope", "audio,offline"),
             ("v", 5.131),
         ]
 
-        session = ClientSession(headers={"User-Agent": self._client.user_agent})
+        await self.start()
 
-        async with session.post("https://oauth.vk.com/token", data=params, ssl=False) as response:
+        async with self.session.post(VK_OAUTH_URL, data=params, ssl=False) as response:
             return await response.json()
 
 
@@ -206,3 +599,12 @@ AccessCredentials = Credentials(
     login=VK_LOGIN,
     password=VK_PASSWORD,
 )
+
+# Пул аккаунтов и токенов. Без VK_BYPASS_AUTH основной аккаунт входит по логину и паролю, как и раньше
+VKAccounts = [Credentials(login, password) for login, password in VK_ACCOUNTS]
+VKAccessTokens = list(VK_ACCESS_TOKENS)
+
+if VK_BYPASS_AUTH and VK_BYPASS_ACCESS_TOKEN:
+    VKAccessTokens.insert(0, VK_BYPASS_ACCESS_TOKEN)
+elif VK_LOGIN and VK_PASSWORD:
+    VKAccounts.insert(0, AccessCredentials)
@@ -0,0 +1,85 @@
+"""
+Голосовые подключения гильдий: переиспользование, переезд между каналами и отложенный выход
+"""
+import asyncio
+
+from typing import Dict, Optional
+
+import discord
+
+from loguru import logger
+
+from .metrics import VOICE_CONNECT_SECONDS, VOICE_JOINS
+
+
+class VoiceManager:
+    """
+    Держит голосовые подключения гильдий.
+    Подключение к Discord (рукопожатие голосового шлюза и UDP discovery) занимает секунды, поэтому
+    следующая команда переиспользует уже открытое подключение, в другой канал гильдии бот переезжает через
+    move_to, а после окончания очереди выходит из канала только через grace секунд простоя
+    """
+
+    def __init__(self, grace: float):
+        self.grace = grace
+        self._leaving: Dict[int, asyncio.Task] = {}
+
+    async def join(self, guild: discord.Guild, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        """Подключение гильдии в канале channel: уже открытое, перенесённое из другого канала или новое"""
+        self._cancel_leave(guild.id)
+        voice_client = guild.voice_client
+
+        if voice_client and voice_client.is_connected():
+            if voice_client.channel == channel:
+                VOICE_JOINS.inc(how="reuse")
+                return voice_client
+
+            with VOICE_CONNECT_SECONDS.time():
+                await voice_client.move_to(channel)
+            VOICE_JOINS.inc(how="move")
+            return voice_client
+
+        if voice_client:
+            # Разорванное подключение всё ещё числится за гильдией и не даст подключиться заново
+            await voice_client.disconnect(force=True)
+
+        with VOICE_CONNECT_SECONDS.time():
+            voice_client = await channel.connect()
+        VOICE_JOINS.inc(how="connect")
+        return voice_client
+
+    def release(self, guild: discord.Guild, grace: Optional[float] = None) -> None:
+        """Выходит из голосового канала, если за grace секунд подключение снова не понадобится"""
+        grace = self.grace if grace is None else grace
+        self._cancel_leave(guild.id)
+
+        self._leaving[guild.id] = asyncio.get_running_loop().create_task(self._leave(guild, grace))
+
+    async def leave(self, guild: discord.Guild) -> None:
+        """Выходит из голосового канала сразу"""
+        self._cancel_leave(guild.id)
+
+        voice_client = guild.voice_client
+        if voice_client:
+            await voice_client.disconnect(force=True)
+
+    async def close(self) -> None:
+        for task in list(self._leaving.values()):
+            task.cancel()
+        self._leaving.clear()
+
+    def _cancel_leave(self, guild_id: int) -> None:
+        task = self._leaving.pop(guild_id, None)
+        if task:
+            task.cancel()
+
+    async def _leave(self, guild: discord.Guild, grace: float) -> None:
+        await asyncio.sleep(grace)
+        del self._leaving[guild.id]
+
+        voice_client = guild.voice_client
+        if not voice_client or voice_client.is_playing():
+            return
+
+        await voice_client.disconnect(force=True)
+        logger.info(f"{guild.name} | Бот вышел из голосового канала после {grace:.0f} с простоя.")
@@ -0,0 +1,163 @@
+"""
+Сторож event loop: находит блокирующий код по снимкам стека во время зависаний
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .metrics import LOOP_STALLS
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_INTERVAL = 10  # Секунды между предупреждениями об одном и том же месте
+
+
+class Offender:
+    """Место в коде, на котором заставали зависший event loop"""
+
+    def __init__(self, where: str):
+        self.where = where
+        self.samples = 0
+        self.stalls = 0
+        self.worst = 0.0
+        self.stack: List[str] = []
+        self.logged = 0.0
+
+
+class LoopWatchdog:
+    """
+    Поток-сторож, который следит за сердцебиением event loop.
+    Корутина на loop отмечается раз в interval. Если отметки нет дольше interval + threshold, loop занят
+    синхронным кодом: сторож раз в interval снимает стек потока loop, пока тот не освободится.
+    Снимки группируются по самому глубокому кадру кода бота, так что в отчёте видно, кто держит loop и сколько
+    """
+
+    def __init__(self, threshold: float, interval: float, depth: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.depth = depth
+
+        self._offenders: Dict[str, Offender] = {}
+        self._lock = threading.Lock()
+        self._tick = 0.0
+        self._loop_thread: Optional[int] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Запускает сторожа. Вызывается из потока event loop"""
+        if self.running:
+            return
+
+        self._loop_thread = threading.get_ident()
+        self._tick = time.monotonic()
+        self._heartbeat_task = asyncio.get_event_loop().create_task(self._heartbeat())
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Сторож | Запущен: порог {self.threshold * 1000:.0f} мс, снимки раз в {self.interval * 1000:.0f} мс")
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+
+        self._stopped.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self._thread = None
+
+        for offender in self.report(3):
+            logger.info(f"Сторож | {offender.where}: {offender.stalls} зависаний, "
+                        f"до {offender.worst * 1000:.0f} мс, {offender.samples} снимков")
+        logger.info("Сторож | Остановлен")
+
+    def reset(self) -> None:
+        with self._lock:
+            self._offenders.clear()
+
+    def report(self, top: int) -> List[Offender]:
+        """Места, чаще всего державшие loop: по числу снимков, то есть по суммарному времени блокировки"""
+        with self._lock:
+            offenders = list(self._offenders.values())
+        return sorted(offenders, key=lambda offender: (offender.samples, offender.worst), reverse=True)[:top]
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        stall_tick, stall_started, culprits = None, 0.0, {}
+
+        while not self._stopped.wait(self.interval):
+            tick = self._tick
+            now = time.monotonic()
+
+            if stall_tick is not None and tick != stall_tick:
+                # Loop снова отметился: зависание закончилось
+                self._finish(now - stall_started, culprits)
+                stall_tick, culprits = None, {}
+
+            if now - tick <= self.interval + self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            if stall_tick is None:
+                stall_tick, stall_started = tick, tick + self.interval
+
+            where, stack = self._sample(frame)
+            del frame
+            with self._lock:
+                offender = self._offenders.get(where)
+                if offender is None:
+                    offender = self._offenders[where] = Offender(where)
+                offender.samples += 1
+                offender.stack = stack
+            culprits[where] = culprits.get(where, 0) + 1
+
+    def _sample(self, frame) -> Tuple[str, List[str]]:
+        """Место блокировки и стек. Место — самый глубокий кадр из кода бота, иначе самый глубокий кадр"""
+        summary = traceback.extract_stack(frame, limit=self.depth)
+        own = [entry for entry in summary if entry.filename.startswith(PROJECT_DIR)]
+        entry = (own or summary)[-1]
+
+        filename = os.path.relpath(entry.filename, PROJECT_DIR) if own else entry.filename
+        where = f"{filename}:{entry.lineno} {entry.name}"
+        return where, [line.rstrip() for line in summary.format()]
+
+    def _finish(self, duration: float, culprits: Dict[str, int]) -> None:
+        if not culprits:
+            return
+
+        LOOP_STALLS.inc()
+        where = max(culprits, key=culprits.get)
+        with self._lock:
+            offender = self._offenders.get(where)
+            if offender is None:
+                # Счётчики сбросили посреди зависания
+                return
+            offender.stalls += 1
+            offender.worst = max(offender.worst, duration)
+
+            now = time.monotonic()
+            if now - offender.logged < LOG_INTERVAL:
+                return
+            offender.logged = now
+
+        logger.warning(f"Сторож | Event loop заблокирован на {duration * 1000:.0f} мс: {where}")
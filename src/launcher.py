@@ -0,0 +1,110 @@
+"""
+Запуск бота в нескольких процессах: шарды делятся на диапазоны, каждый диапазон обслуживает свой процесс main.py
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import tempfile
+import subprocess
+
+from os import path
+from typing import Dict, List
+
+from aiohttp import ClientSession
+
+from loguru import logger
+
+from bulbex.cluster import shard_ranges
+from bulbex.config import TOKEN, SHARD_COUNT, PROCESS_COUNT, CLUSTER_STATS_DIR
+
+MAIN = path.join(path.dirname(path.abspath(__file__)), "main.py")
+RESTART_DELAY = 5  # Секунды перед перезапуском упавшего процесса
+RESTART_DELAY_MAX = 300
+
+
+async def recommended_shards() -> int:
+    """Рекомендуемое Discord количество шардов"""
+    async with ClientSession(headers={"Authorization": f"Bot {TOKEN}"}) as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot") as response:
+            response.raise_for_status()
+            return (await response.json())["shards"]
+
+
+def spawn(index: int, ranges: List[List[int]], shard_count: int, stats_dir: str) -> subprocess.Popen:
+    """Запускает процесс бота для диапазона шардов"""
+    env = dict(os.environ,
+               SHARDED="true",
+               SHARD_COUNT=str(shard_count),
+               SHARD_IDS=",".join(map(str, ranges[index])),
+               PROCESS_INDEX=str(index),
+               PROCESS_COUNT=str(len(ranges)),
+               CLUSTER_STATS_DIR=stats_dir)
+
+    logger.info(f"Лаунчер | Процесс {index}: шарды {ranges[index][0]}-{ranges[index][-1]} из {shard_count}")
+    return subprocess.Popen([sys.executable, MAIN], env=env)
+
+
+def run():
+    """Запускает процессы и перезапускает упавшие, пока лаунчер не остановят"""
+    shard_count = SHARD_COUNT or asyncio.run(recommended_shards())
+    ranges = shard_ranges(shard_count, PROCESS_COUNT)
+    stats_dir = CLUSTER_STATS_DIR or tempfile.mkdtemp(prefix="bulbex-cluster-")
+
+    processes: Dict[int, subprocess.Popen] = {}
+    started: Dict[int, float] = {}
+    delays = {index: RESTART_DELAY for index in range(len(ranges))}
+    restart_at: Dict[int, float] = {}
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(len(ranges)):
+        processes[index] = spawn(index, ranges, shard_count, stats_dir)
+        started[index] = time.monotonic()
+        # Процессы подключаются к шлюзу по очереди, чтобы не упереться в ограничение на IDENTIFY
+        time.sleep(RESTART_DELAY)
+
+    while not stopping:
+        time.sleep(1)
+
+        for index, process in processes.items():
+            if process.poll() is None or index in restart_at:
+                continue
+
+            if time.monotonic() - started[index] > RESTART_DELAY_MAX:
+                # Процесс долго работал нормально: падение не повторяющееся, задержка сбрасывается
+                delays[index] = RESTART_DELAY
+
+            logger.warning(f"Лаунчер | Процесс {index} завершился с кодом {process.returncode}, "
+                           f"перезапуск через {delays[index]} с.")
+            restart_at[index] = time.monotonic() + delays[index]
+            delays[index] = min(delays[index] * 2, RESTART_DELAY_MAX)
+
+        for index, at in list(restart_at.items()):
+            if time.monotonic() >= at and not stopping:
+                del restart_at[index]
+                processes[index] = spawn(index, ranges, shard_count, stats_dir)
+                started[index] = time.monotonic()
+
+    logger.info("Лаунчер | Остановка процессов...")
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+
+    for process in processes.values():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == '__main__':
+    run()
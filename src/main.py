@@ -1,6 +1,8 @@
 """
 Точка входа бота
 """
+from os import path
+
 import discord
 from discord.ext import commands
 
@@ -8,16 +10,55 @@ from loguru import logger
 
 from bulbex.maincog import MusicCog
 from bulbex.debugcog import DebugCog
-from bulbex.config import TOKEN, ON_READY_GUILD_SYNC, LOGGER_FILE_PATH, LOGGER_ROTATION
+from bulbex.commandsync import CommandSync
+from bulbex.config import (TOKEN, ON_READY_GUILD_SYNC, LOGGER_FILE_PATH, LOGGER_ROTATION,
+                           COMMAND_SYNC_STATE_PATH, COMMAND_SYNC_CONCURRENCY,
+                           SHARDED, SHARD_COUNT, SHARD_IDS, PROCESS_INDEX, PROCESS_COUNT)
+
+
+class BulbexBotMixin:
+    """Общее для обычного и шардированного бота: синхронизация команд и закрытие ресурсов cog'ов при остановке"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Каждый процесс хранит хэши своих гильдий в своём файле, чтобы процессы не затирали записи друг друга
+        state_path = COMMAND_SYNC_STATE_PATH if PROCESS_COUNT == 1 else f"{COMMAND_SYNC_STATE_PATH}.{PROCESS_INDEX}"
+        self.command_sync = CommandSync(self, state_path=state_path, concurrency=COMMAND_SYNC_CONCURRENCY)
+
+    async def close(self):
+        for name in ("MusicCog", "DebugCog"):
+            cog = self.get_cog(name)
+            if cog:
+                await cog.close()
+
+        await super().close()
+
+
+class BulbexBot(BulbexBotMixin, commands.Bot):
+    """Бот в одном процессе с одним подключением к шлюзу"""
+
+
+class ShardedBulbexBot(BulbexBotMixin, commands.AutoShardedBot):
+    """Бот, обслуживающий шарды SHARD_IDS. Запускается лаунчером по процессу на диапазон шардов"""
+
 
 # Доступы
 intents = discord.Intents.default()
 
 # Бот
-bot = commands.Bot(command_prefix="/", intents=intents, case_insensitive=False)
+if SHARDED:
+    bot = ShardedBulbexBot(command_prefix="/", intents=intents, case_insensitive=False,
+                           shard_count=SHARD_COUNT or None, shard_ids=SHARD_IDS or None)
+else:
+    bot = BulbexBot(command_prefix="/", intents=intents, case_insensitive=False)
 
-# Логгера
-logger.add(LOGGER_FILE_PATH, rotation=LOGGER_ROTATION)
+# Логгера. Процессы лаунчера пишут в отдельные файлы, иначе ротация одного файла из нескольких процессов ломается
+if PROCESS_COUNT > 1:
+    root, ext = path.splitext(LOGGER_FILE_PATH)
+    logger.add(f"{root}.{PROCESS_INDEX}{ext}", rotation=LOGGER_ROTATION)
+else:
+    logger.add(LOGGER_FILE_PATH, rotation=LOGGER_ROTATION)
 
 
 @bot.event
@@ -28,11 +69,24 @@ async def on_ready():
 
     if ON_READY_GUILD_SYNC:
         logger.info("Сихронизация гильдий...")
-        await bot.sync_commands(guild_ids=[guild.id for guild in bot.guilds])
+        await bot.command_sync.sync([guild.id for guild in bot.guilds])
 
     logger.info("Бот запущен!")
 
 
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    """Синхронизирует команды с новой гильдией"""
+    if ON_READY_GUILD_SYNC:
+        await bot.command_sync.sync([guild.id])
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    """Забывает хэш гильдии, чтобы после повторного добавления команды синхронизировались заново"""
+    bot.command_sync.forget([guild.id])
+
+
 def start():
     """Запуск бота"""
     bot.add_cog(MusicCog(bot))
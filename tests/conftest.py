@@ -0,0 +1,21 @@
+"""
+Общая подготовка тестов: путь до пакета и обязательные переменные конфига
+"""
+import sys
+
+from os import environ, path
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), "src"))
+
+# config.py требует эти переменные; для тестов подойдут любые значения
+for name, value in {
+    "GUILD_ID": "0",
+    "TRUSTED_IDS": "0",
+    "ON_READY_GUILD_SYNC": "0",
+    "VK_BYPASS_AUTH": "1",
+    "VK_BYPASS_ACCESS_TOKEN": "test",
+    "FFMPEG": "ffmpeg",
+    "BITRATE": "128",
+    "PREFETCH_AHEAD": "20",
+}.items():
+    environ.setdefault(name, value)
@@ -0,0 +1,91 @@
+"""
+Подготовка следующего трэка при изменении головы очереди во время проигрывания
+"""
+import asyncio
+
+from types import SimpleNamespace
+from typing import List
+
+from bulbex.vkmusic import Song
+from bulbex.songqueue import SongQueue
+from bulbex.maincog import MusicCog
+from bulbex.player import PreparedSource
+
+
+def song(i: int, duration: int = 300) -> Song:
+    return Song(artist="Artist", title=f"Track {i}", duration=duration, download_link=f"http://cdn/{i}.mp3",
+                owner_id=1, track_id=i)
+
+
+class PlayingVoiceClient:
+    def is_connected(self) -> bool:
+        return True
+
+    def is_playing(self) -> bool:
+        return True
+
+
+class FakeSource:
+    def __init__(self):
+        self.closed = False
+
+    def cleanup(self) -> None:
+        self.closed = True
+
+
+def test_head_listener_reports_only_head_changes():
+    queue = SongQueue()
+    changes = []
+    queue.head_listener = lambda: changes.append(queue.slice(0, 1)[0].title if queue else None)
+
+    queue.append(song(1))
+    queue.append(song(2))
+    queue.extend([song(3), song(4)])
+    assert changes == ["Track 1"]
+
+    queue.move(2, 0)
+    queue.remove_at(0)
+    queue.appendleft(song(5))
+    queue.popleft()
+    queue.clear()
+    assert changes == ["Track 1", "Track 3", "Track 1", "Track 5", "Track 1", None]
+
+
+def test_enqueue_after_start_prepares_next_track():
+    async def run():
+        cog = MusicCog(SimpleNamespace(loop=asyncio.get_running_loop()))
+        prepared: List[Song] = []
+
+        async def prepare(song_: Song, **_) -> PreparedSource:
+            prepared.append(song_)
+            return PreparedSource(song_, FakeSource())
+
+        cog.sources.prepare = prepare
+
+        session = cog.sessions.get(SimpleNamespace(id=1, name="guild"))
+        session.voice_client = PlayingVoiceClient()
+        session.now_playing = song(0, duration=10)
+        cog._schedule_prefetch(session, session.now_playing)
+
+        # Подготовка сработала сразу, пока очередь была пустой
+        await asyncio.sleep(0.05)
+        assert prepared == [] and session.prefetched is None
+
+        upcoming = song(1)
+        session.queue.append(upcoming)
+        await asyncio.sleep(0.05)
+        assert prepared == [upcoming]
+        assert session.prefetched.song is upcoming
+
+        # Новая голова очереди после /remove: старый источник закрыт, готовится новый
+        replaced = session.prefetched.source
+        session.queue.append(song(2))
+        session.queue.remove_at(0)
+        await asyncio.sleep(0.05)
+        assert replaced.closed
+        assert session.prefetched.song.title == "Track 2"
+
+        session.cancel_prefetch()
+        await cog.close()
+
+    asyncio.run(run())